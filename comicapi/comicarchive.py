@@ -20,8 +20,10 @@ try:
 except ImportError:
     pil_available = False
 
+import copy
 import os
 import platform
+import shutil
 import struct
 import subprocess
 import sys
@@ -29,48 +31,62 @@ import tempfile
 import time
 import zipfile
 
-import natsort
 # from PyPDF2 import PdfFileReader
-try:
-    #from unrar import rarfile
-    #from unrar import unrarlib
-    #from unrar import constants
-    import rarfile
-    # monkey patch unrarlib to avoid segfaults on Win10
-    if platform.system() == 'Windows' and False:
-        unrarlib.UNRARCALLBACK = ctypes.WINFUNCTYPE(
-            # return type
-            ctypes.c_int,
-            # msg
-            ctypes.c_uint,
-            # UserData
-            ctypes.c_long,
-            # MONKEY PATCH HERE -- use a pointer instead of a long, in unrar code: (LPARAM)(*byte), 
-            # that is a pointer to byte casted to LPARAM
-            # On win10 64bit causes nasty segfaults when used from pyinstaller
-            ctypes.POINTER(ctypes.c_byte),
-            # size
-            ctypes.c_long
-        )
-        RARSetCallback = unrarlib._c_func(unrarlib.RARSetCallback, None,
-                         [unrarlib.HANDLE, unrarlib.UNRARCALLBACK, ctypes.c_long])
-        def _rar_cb(self, msg, user_data, p1, p2):
-            if (msg == constants.UCM_NEEDPASSWORD or
-                msg == constants.UCM_NEEDPASSWORDW):
-                # This is a work around since libunrar doesn't
-                # properly return the error code when files are encrypted
-                self._missing_password = True
-            elif msg == constants.UCM_PROCESSDATA:
-                if self._data is None:
-                    self._data = b''
-                chunk = ctypes.string_at(p1, p2)
-                self._data += chunk
-            return 1
-        rarfile._ReadIntoMemory._callback = _rar_cb
-except Exception as e:
-    print(e)
-    print("WARNING: cannot find libunrar, rar support is disabled")
-    pass
+
+# rarfile loads libunrar, and natsort takes a while to import, so they're
+# only imported when they're first needed
+rarfile = None
+rarfile_tried = False
+
+
+def loadRarfile():
+    """Returns True if rar support is available"""
+    global rarfile, rarfile_tried
+
+    if not rarfile_tried:
+        rarfile_tried = True
+        try:
+            #from unrar import rarfile
+            #from unrar import unrarlib
+            #from unrar import constants
+            import rarfile
+            # monkey patch unrarlib to avoid segfaults on Win10
+            if platform.system() == 'Windows' and False:
+                unrarlib.UNRARCALLBACK = ctypes.WINFUNCTYPE(
+                    # return type
+                    ctypes.c_int,
+                    # msg
+                    ctypes.c_uint,
+                    # UserData
+                    ctypes.c_long,
+                    # MONKEY PATCH HERE -- use a pointer instead of a long, in unrar code: (LPARAM)(*byte), 
+                    # that is a pointer to byte casted to LPARAM
+                    # On win10 64bit causes nasty segfaults when used from pyinstaller
+                    ctypes.POINTER(ctypes.c_byte),
+                    # size
+                    ctypes.c_long
+                )
+                RARSetCallback = unrarlib._c_func(unrarlib.RARSetCallback, None,
+                                 [unrarlib.HANDLE, unrarlib.UNRARCALLBACK, ctypes.c_long])
+                def _rar_cb(self, msg, user_data, p1, p2):
+                    if (msg == constants.UCM_NEEDPASSWORD or
+                        msg == constants.UCM_NEEDPASSWORDW):
+                        # This is a work around since libunrar doesn't
+                        # properly return the error code when files are encrypted
+                        self._missing_password = True
+                    elif msg == constants.UCM_PROCESSDATA:
+                        if self._data is None:
+                            self._data = b''
+                        chunk = ctypes.string_at(p1, p2)
+                        self._data += chunk
+                    return 1
+                rarfile._ReadIntoMemory._callback = _rar_cb
+        except Exception as e:
+            rarfile = None
+            print(e)
+            print("WARNING: cannot find libunrar, rar support is disabled")
+
+    return rarfile is not None
 
 
 from .comet import CoMet
@@ -89,6 +105,14 @@ class MetaDataStyle:
     name = ["ComicBookLover", "ComicRack", "CoMet"]
 
 
+# ZipArchiver.copyRawFile() relies on zipfile internals.  They're the same in
+# the Python versions it has been checked against; anything else copies the
+# files by decompressing and recompressing them instead
+raw_copy_supported = (3, 6) <= sys.version_info[:2] <= (3, 13) and all(
+    hasattr(zipfile, name) for name in ["_strip_extra", "structFileHeader", "sizeFileHeader", "_FH_FILENAME_LENGTH", "_FH_EXTRA_FIELD_LENGTH"]
+)
+
+
 class ZipArchiver:
 
     """ZIP implementation"""
@@ -96,19 +120,64 @@ class ZipArchiver:
     def __init__(self, path):
         self.path = path
 
+        # changes collected by a transaction: name -> data, or None if the
+        # file is to be removed
+        self.pending = None
+        self.pending_comment = None
+
     def getArchiveComment(self):
-        zf = zipfile.ZipFile(self.path, "r")
-        comment = zf.comment
-        zf.close()
+        if self.pending_comment is not None:
+            return self.pending_comment
+
+        comment = self.readZipComment()
+        if comment is None:
+            # couldn't make sense of the end of the file, let zipfile try
+            zf = zipfile.ZipFile(self.path, "r")
+            comment = zf.comment
+            zf.close()
         return comment
 
+    def readZipComment(self):
+        """
+        Read the comment straight from the "End of Central Directory" record
+        at the end of the file, without parsing the central directory like
+        zipfile does.  Returns None if the record can't be found.
+        """
+
+        eocd_size = struct.calcsize(zipfile.structEndArchive)
+        try:
+            with open(self.path, "rb") as f:
+                # the comment is at most 64k, so the record is somewhere in
+                # the tail of the file
+                f.seek(0, 2)
+                tail_size = min(f.tell(), eocd_size + 0xFFFF)
+                f.seek(-tail_size, 2)
+                tail = f.read()
+        except (IOError, OSError):
+            return None
+
+        pos = tail.rfind(zipfile.stringEndArchive)
+        while pos >= 0:
+            record = tail[pos : pos + eocd_size]
+            if len(record) == eocd_size:
+                comment_length = struct.unpack(zipfile.structEndArchive, record)[zipfile._ECD_COMMENT_SIZE]
+                # the comment has to reach exactly to the end of the file
+                if pos + eocd_size + comment_length == len(tail):
+                    return tail[pos + eocd_size :]
+            pos = tail.rfind(zipfile.stringEndArchive, 0, pos)
+        return None
+
     def setArchiveComment(self, comment):
-        zf = zipfile.ZipFile(self.path, "a")
-        zf.comment = bytes(comment, "utf-8")
-        zf.close()
-        return True
+        return self.stageChanges(dict(), bytes(comment, "utf-8"))
 
     def readArchiveFile(self, archive_file):
+        if self.pending is not None and archive_file in self.pending:
+            data = self.pending[archive_file]
+            if data is None:
+                print("file removed in transaction: {0} :: {1}".format(self.path, archive_file), file=sys.stderr)
+                raise IOError
+            return bytes(data, "utf-8") if isinstance(data, str) else data
+
         data = ""
         zf = zipfile.ZipFile(self.path, "r")
 
@@ -127,62 +196,149 @@ class ZipArchiver:
         return data
 
     def removeArchiveFile(self, archive_file):
-        try:
-            self.rebuildZipFile([archive_file])
-        except:
-            return False
-        else:
-            return True
+        return self.stageChanges({archive_file: None})
 
     def writeArchiveFile(self, archive_file, data):
-        #  At the moment, no other option but to rebuild the whole
-        #  zip archive w/o the indicated file. Very sucky, but maybe
-        # another solution can be found
-        try:
-            self.rebuildZipFile([archive_file])
-
-            # now just add the archive file as a new one
-            zf = zipfile.ZipFile(self.path, mode="a", allowZip64=True, compression=zipfile.ZIP_DEFLATED)
-            zf.writestr(archive_file, data)
-            zf.close()
-            return True
-        except:
-            return False
+        return self.stageChanges({archive_file: data})
 
     def getArchiveFilenameList(self):
         try:
             zf = zipfile.ZipFile(self.path, "r")
             namelist = zf.namelist()
             zf.close()
-            return namelist
         except Exception as e:
             print("Unable to get zipfile list [{0}]: {1}".format(e, self.path), file=sys.stderr)
             return []
 
-    def rebuildZipFile(self, exclude_list):
+        if self.pending is not None:
+            # what the archive will look like once the transaction is done
+            namelist = [name for name in namelist if name not in self.pending]
+            namelist.extend(name for name, data in self.pending.items() if data is not None)
+        return namelist
+
+    def removeArchiveFiles(self, archive_file_list, new_files=None):
+        """Remove several files, and add or replace the ones in the new_files
+        dict (name -> data), with a single rebuild of the archive"""
+        changes = {name: None for name in archive_file_list}
+        if new_files is not None:
+            changes.update(new_files)
+        return self.stageChanges(changes)
+
+    def beginTransaction(self):
+        self.pending = dict()
+        self.pending_comment = None
+
+    def inTransaction(self):
+        return self.pending is not None
+
+    def rollbackTransaction(self):
+        self.pending = None
+        self.pending_comment = None
+
+    def commitTransaction(self):
+        changes = self.pending
+        comment = self.pending_comment
+        self.rollbackTransaction()
+        return self.applyChanges(changes, comment)
+
+    def stageChanges(self, changes, comment=None):
+        """Apply the changes now, or hold on to them if a transaction is open"""
+        if self.pending is None:
+            return self.applyChanges(changes, comment)
+
+        self.pending.update(changes)
+        if comment is not None:
+            self.pending_comment = comment
+        return True
+
+    def applyChanges(self, changes, comment=None):
+        try:
+            if len(changes) != 0:
+                self.rebuildZipFile(changes, comment)
+            elif comment is not None:
+                # the comment is in the central directory at the end of the
+                # file, so it can be changed without a rebuild
+                zf = zipfile.ZipFile(self.path, "a")
+                zf.comment = comment
+                zf.close()
+        except Exception as e:
+            print("Error while writing {0}: {1}".format(self.path, e), file=sys.stderr)
+            return False
+        else:
+            return True
+
+    def rebuildZipFile(self, changes, comment=None):
         """Zip helper func
 
-        This recompresses the zip archive, without the files in the exclude_list
+        Writes a new copy of the archive with the changes (name -> data, or
+        None to remove the file) applied, and swaps it in for the old one.
+        Untouched files are copied over without recompressing them, where
+        raw_copy_supported allows it.  The new copy is synced to disk before
+        the rename, so if anything goes wrong the original archive is left as
+        it was.
         """
-        tmp_fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        tmp_fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
         os.close(tmp_fd)
 
-        zin = zipfile.ZipFile(self.path, "r")
-        zout = zipfile.ZipFile(tmp_name, "w", allowZip64=True)
-        for item in zin.infolist():
-            buffer = zin.read(item.filename)
-            if item.filename not in exclude_list:
-                zout.writestr(item, buffer)
+        try:
+            with zipfile.ZipFile(self.path, "r") as zin, open(tmp_name, "wb") as f:
+                with zipfile.ZipFile(f, "w", allowZip64=True) as zout:
+                    for item in zin.infolist():
+                        if item.filename not in changes:
+                            if raw_copy_supported:
+                                self.copyRawFile(zin, zout, item)
+                            else:
+                                zout.writestr(copy.copy(item), zin.read(item))
+
+                    for name, data in changes.items():
+                        if data is not None:
+                            zout.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data, compress_type=zipfile.ZIP_DEFLATED)
 
-        # preserve the old comment
-        zout.comment = zin.comment
+                    # preserve the old comment, unless there's a new one
+                    zout.comment = zin.comment if comment is None else comment
 
-        zout.close()
-        zin.close()
+                f.flush()
+                os.fsync(f.fileno())
+
+            shutil.copymode(self.path, tmp_name)
+        except:
+            os.remove(tmp_name)
+            raise
 
         # replace with the new file
-        os.remove(self.path)
-        os.rename(tmp_name, self.path)
+        os.replace(tmp_name, self.path)
+
+    def copyRawFile(self, zin, zout, item, chunk_size=1024 * 1024):
+        """Copy one file's compressed data from zin to zout, as is"""
+
+        # skip over the local header, which may differ from the central one
+        zin.fp.seek(item.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, zin.fp.read(zipfile.sizeFileHeader))
+        zin.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+        info = copy.copy(item)
+        info.extra = zipfile._strip_extra(item.extra, (1,))
+        info.header_offset = zout.fp.tell()
+        zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+        zout.fp.write(info.FileHeader(zip64))
+
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = zin.fp.read(min(chunk_size, remaining))
+            if len(chunk) == 0:
+                raise IOError("truncated data for {0}".format(item.filename))
+            zout.fp.write(chunk)
+            remaining -= len(chunk)
+
+        if info.flag_bits & 0x08:
+            # the sizes and CRC go in a data descriptor after the data
+            fmt = "<4sLQQ" if zip64 else "<4sLLL"
+            zout.fp.write(struct.pack(fmt, b"PK\x07\x08", info.CRC, info.compress_size, info.file_size))
+
+        zout.filelist.append(info)
+        zout.NameToInfo[info.filename] = info
+        zout.start_dir = zout.fp.tell()
+        zout._didModify = True
 
     def writeZipComment(self, filename, comment):
         """
@@ -455,6 +611,8 @@ class RarArchiver:
         while tries < 7:
             try:
                 tries = tries + 1
+                if not loadRarfile():
+                    raise IOError("rar support is disabled")
                 rarc = rarfile.RarFile( self.path )
 
             except (OSError, IOError) as e:
@@ -558,6 +716,37 @@ class UnknownArchiver:
         return []
 
 
+class ArchiveTransaction:
+
+    """
+    Collects the writes made to a ComicArchive inside a with block, and makes
+    them in one go at the end of it.  See ComicArchive.transaction()
+    """
+
+    def __init__(self, comic_archive):
+        self.ca = comic_archive
+        self.owner = False
+        self.success = True
+
+    def __enter__(self):
+        archiver = self.ca.archiver
+        # nested transactions just join the outer one
+        if hasattr(archiver, "beginTransaction") and not archiver.inTransaction():
+            archiver.beginTransaction()
+            self.owner = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.owner:
+            if exc_type is None:
+                self.success = self.ca.archiver.commitTransaction()
+            else:
+                self.ca.archiver.rollbackTransaction()
+                self.success = False
+            self.ca.resetCache()
+        return False
+
+
 class ComicArchive:
     logo_data = None
 
@@ -612,6 +801,7 @@ class ComicArchive:
         self.has_cbi = None
         self.has_comet = None
         self.comet_filename = None
+        self.raw_cbi = None
         self.page_count = None
         self.page_list = None
         self.cix_md = None
@@ -626,10 +816,25 @@ class ComicArchive:
         self.path = path
         self.archiver.path = path
 
+    def transaction(self):
+        """
+        Use as "with ca.transaction() as t:" to group several writes into
+        one.  Tag writes and removals, file changes and the comment are held
+        until the block ends, and then a zip archive is rewritten only once
+        for all of them.  If the block raises, nothing is written.  Check
+        t.success afterwards, since the individual write calls can't know if
+        the final rewrite worked.
+
+        Other archive types make each change as it comes.
+        """
+        return ArchiveTransaction(self)
+
     def zipTest(self):
         return zipfile.is_zipfile(self.path)
 
     def rarTest(self):
+        if not loadRarfile():
+            return False
         try:
             rarc = rarfile.RarFile(self.path)
         except:  # InvalidRARArchive:
@@ -680,9 +885,10 @@ class ComicArchive:
         else:
             return False
 
-    def readMetadata(self, style):
+    def readMetadata(self, style, fields=None):
+        # fields narrows down what's read, see ComicInfoXml.metadataFromString()
         if style == MetaDataStyle.CIX:
-            return self.readCIX()
+            return self.readCIX(fields)
         elif style == MetaDataStyle.CBI:
             return self.readCBI()
         elif style == MetaDataStyle.COMET:
@@ -814,6 +1020,8 @@ class ComicArchive:
                 # so as a hack I'm temporarily replacing all '-' with '*'
                 files=[f.replace('-','*') for f in files]
 
+                import natsort
+
                 files = natsort.natsorted(files, alg=natsort.ns.IC | natsort.ns.I)
 
                 # undo replacement
@@ -848,18 +1056,22 @@ class ComicArchive:
         if not self.hasCBI():
             return None
 
-        return self.archiver.getArchiveComment()
+        return self.raw_cbi
 
     def hasCBI(self):
         if self.has_cbi is None:
 
             # if ( not ( self.isZip() or self.isRar()) or not
             # self.seemsToBeAComicArchive() ):
-            if not self.seemsToBeAComicArchive():
+            if not (self.isZip() or self.isRar()):
                 self.has_cbi = False
             else:
+                # check the comment first: for a zip file that's a single
+                # small read, which is far cheaper than listing the pages
                 comment = self.archiver.getArchiveComment()
-                self.has_cbi = ComicBookInfo().validateString(comment)
+                self.has_cbi = ComicBookInfo().validateString(comment) and self.seemsToBeAComicArchive()
+                if self.has_cbi:
+                    self.raw_cbi = comment
 
         return self.has_cbi
 
@@ -886,7 +1098,18 @@ class ComicArchive:
             return write_success
         return True
 
-    def readCIX(self):
+    def readCIX(self, fields=None):
+        if fields is not None and self.cix_md is None:
+            # just a few fields, so parse only as much as needed, and don't
+            # keep the partial result
+            raw_cix = self.readRawCIX()
+            if raw_cix is not None and raw_cix != "":
+                try:
+                    return ComicInfoXml().metadataFromString(raw_cix, fields)
+                except:
+                    pass
+            return GenericMetadata()
+
         if self.cix_md is None:
             raw_cix = self.readRawCIX()
             if raw_cix is None or raw_cix == "":
@@ -898,13 +1121,13 @@ class ComicArchive:
                     self.cix_md = GenericMetadata()
 
             # validate the existing page list (make sure count is correct)
-            if len(self.cix_md.pages) != 0:
-                if len(self.cix_md.pages) != self.getNumberOfPages():
+            if self.cix_md.pageListLength() != 0:
+                if self.cix_md.pageListLength() != self.getNumberOfPages():
                     # pages array doesn't match the actual number of images we're seeing
                     # in the archive, so discard the data
                     self.cix_md.pages = []
 
-            if len(self.cix_md.pages) == 0:
+            if self.cix_md.pageListLength() == 0:
                 self.cix_md.setDefaultPageList(self.getNumberOfPages())
 
         return self.cix_md
@@ -932,6 +1155,38 @@ class ComicArchive:
         else:
             return False
 
+    def removePages(self, page_index_list):
+        """
+        Remove the pages with the given indices, and renumber the page list in
+        the CIX metadata to match.  Done as one transaction, so that a zip
+        archive is only rewritten once, the new ComicInfo.xml included.
+        """
+
+        remove_set = set(page_index_list)
+        remove_names = [self.getPageName(idx) for idx in sorted(remove_set) if self.getPageName(idx) is not None]
+        if len(remove_names) == 0:
+            return True
+
+        cix_md = None
+        if self.hasCIX():
+            cix_md = self.readCIX()
+            pages = [p for p in cix_md.pages if int(p["Image"]) not in remove_set]
+            for num, p in enumerate(pages):
+                p["Image"] = str(num)
+            cix_md.pages = pages
+            cix_md.pageCount = self.getNumberOfPages() - len(remove_names)
+
+        with self.transaction() as t:
+            write_success = True
+            for name in remove_names:
+                write_success = write_success and self.archiver.removeArchiveFile(name)
+            self.resetCache()
+            if write_success and cix_md is not None:
+                write_success = self.writeCIX(cix_md)
+
+        self.resetCache()
+        return write_success and t.success
+
     def removeCIX(self):
         if self.hasCIX():
             write_success = self.archiver.removeArchiveFile(self.ci_xml_filename)
@@ -85,6 +85,12 @@ class ComicBookInfo:
     def validateString(self, string):
         """Verify that the string actually contains CBI data in JSON format"""
 
+        # most archive comments are empty or something else entirely, so
+        # don't bother parsing them
+        key = b"ComicBookInfo/1.0" if isinstance(string, bytes) else "ComicBookInfo/1.0"
+        if string is None or key not in string:
+            return False
+
         try:
             cbi_container = json.loads(string)
         except:
@@ -18,12 +18,20 @@ import xml.etree.ElementTree as ET
 
 from . import utils
 from .genericmetadata import GenericMetadata
-from .issuestring import IssueString
+from .issuestring import IssueString, cachedIssueString
 
 # from datetime import datetime
 # from pprint import pprint
 # import zipfile
 
+# the characters ET.tostring() escapes in element text, and in attribute values
+text_escapes = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+attrib_escapes = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"})
+
+
+def escapeXML(text, attrib=False):
+    return text.translate(attrib_escapes if attrib else text_escapes)
+
 
 class ComicInfoXml:
 
@@ -35,6 +43,27 @@ class ComicInfoXml:
     cover_synonyms = ["cover", "covers", "coverartist", "cover artist"]
     editor_synonyms = ["editor"]
 
+    # CIX credit elements, in the order they are written
+    credit_order = ["Writer", "Penciller", "Inker", "Colorist", "Letterer", "CoverArtist", "Editor"]
+
+    @classmethod
+    def buildRoleTags(cls):
+        # lower case role -> the CIX credit elements it goes in
+        role_tags = dict()
+        synonym_lists = [
+            cls.writer_synonyms,
+            cls.penciller_synonyms,
+            cls.inker_synonyms,
+            cls.colorist_synonyms,
+            cls.letterer_synonyms,
+            cls.cover_synonyms,
+            cls.editor_synonyms,
+        ]
+        for tag, synonyms in zip(cls.credit_order, synonym_lists):
+            for role in synonyms:
+                role_tags.setdefault(role, []).append(tag)
+        return role_tags
+
     def getParseableCredits(self):
         parsable_credits = []
         parsable_credits.extend(self.writer_synonyms)
@@ -46,18 +75,181 @@ class ComicInfoXml:
         parsable_credits.extend(self.editor_synonyms)
         return parsable_credits
 
-    def metadataFromString(self, string):
+    # CIX element -> (GenericMetadata field, how to convert the text)
+    tag_fields = {
+        "Series": ("series", "str"),
+        "Title": ("title", "str"),
+        "Number": ("issue", "issue"),
+        "Count": ("issueCount", "int"),
+        "Volume": ("volume", "int"),
+        "AlternateSeries": ("alternateSeries", "str"),
+        "AlternateNumber": ("alternateNumber", "issue"),
+        "AlternateCount": ("alternateCount", "int"),
+        "Summary": ("comments", "str"),
+        "Notes": ("notes", "str"),
+        "Year": ("year", "int"),
+        "Month": ("month", "int"),
+        "Day": ("day", "int"),
+        "SeriesYear": ("seriesYear", "int"),
+        "Publisher": ("publisher", "str"),
+        "Imprint": ("imprint", "str"),
+        "Genre": ("genre", "str"),
+        "Web": ("webLink", "str"),
+        "LanguageISO": ("language", "str"),
+        "Format": ("format", "str"),
+        "Manga": ("manga", "str"),
+        "Characters": ("characters", "str"),
+        "Teams": ("teams", "str"),
+        "Locations": ("locations", "str"),
+        "PageCount": ("pageCount", "int"),
+        "ScanInformation": ("scanInfo", "str"),
+        "StoryArc": ("storyArc", "str"),
+        "SeriesGroup": ("seriesGroup", "str"),
+        "AgeRating": ("maturityRating", "str"),
+        "BlackAndWhite": ("blackAndWhite", "bool"),
+    }
+
+    # CIX credit element -> role
+    credit_tags = {
+        "Writer": "Writer",
+        "Penciller": "Penciller",
+        "Inker": "Inker",
+        "Colorist": "Colorist",
+        "Letterer": "Letterer",
+        "Editor": "Editor",
+        "CoverArtist": "Cover",
+    }
+
+    # how much of the document to hand the parser at a time, when looking
+    # for just a few fields
+    chunk_size = 1024
+
+    def metadataFromString(self, string, fields=None):
+        """
+        Parse the XML into a GenericMetadata.  If a set of field names is
+        given (GenericMetadata attribute names, plus "credits" and "pages"
+        for those lists), only those are filled in, and parsing stops as
+        soon as they have all been seen.
+        """
+
+        if fields is not None:
+            return self.partialMetadataFromString(string, fields)
 
         tree = ET.ElementTree(ET.fromstring(string))
         return self.convertXMLToMetadata(tree)
 
-    def stringFromMetadata(self, metadata):
+    def partialMetadataFromString(self, string, fields):
+
+        wanted = set(tag for tag, (name, kind) in self.tag_fields.items() if name in fields)
+        want_credits = "credits" in fields
+        want_pages = "pages" in fields
+
+        values = dict()
+        credits = []
+        pages = None
+
+        parser = ET.XMLPullParser(events=("start", "end"))
+        depth = 0
+        done = False
+        for offset in range(0, len(string), self.chunk_size):
+            parser.feed(string[offset : offset + self.chunk_size])
+            for event, elem in parser.read_events():
+                if event == "start":
+                    if depth == 0 and elem.tag != "ComicInfo":
+                        raise ValueError("Not a ComicInfo document")
+                    depth += 1
+                    continue
+
+                depth -= 1
+                if depth != 1:
+                    # only the children of the root matter
+                    continue
+
+                tag = elem.tag
+                if tag in wanted:
+                    wanted.discard(tag)
+                    values[tag] = elem.text
+                elif want_credits and tag in self.credit_tags:
+                    credits.append((tag, elem.text))
+                elif want_pages and tag == "Pages":
+                    want_pages = False
+                    pages = [page.attrib for page in elem]
+                elem.clear()
+
+                # credits can be anywhere, so they need the whole document
+                if len(wanted) == 0 and not want_pages and not want_credits:
+                    done = True
+                    break
+            if done:
+                break
 
-        header = '<?xml version="1.0"?>\n'
+        md = GenericMetadata()
+        for tag, (name, kind) in self.tag_fields.items():
+            if name in fields:
+                self.setField(md, name, kind, values.get(tag))
+        for tag, text in credits:
+            self.addCredits(md, tag, text)
+        if pages is not None:
+            for page in pages:
+                md.addPage(page)
 
-        tree = self.convertMetadataToXML(self, metadata)
-        tree_str = ET.tostring(tree.getroot()).decode()
-        return header + tree_str
+        md.isEmpty = False
+
+        return md
+
+    def setField(self, md, name, kind, text):
+        if kind == "str":
+            setattr(md, name, utils.xlate(text))
+        elif kind == "int":
+            setattr(md, name, utils.xlate(text, True))
+        elif kind == "issue":
+            setattr(md, name, cachedIssueString(utils.xlate(text)).asString())
+        elif kind == "bool":
+            tmp = utils.xlate(text)
+            if tmp is not None and tmp.lower() in ["yes", "true", "1"]:
+                setattr(md, name, True)
+
+    def addCredits(self, md, tag, text):
+        if text is not None:
+            for name in text.split(","):
+                md.addCredit(name.strip(), self.credit_tags[tag])
+
+    def stringFromMetadata(self, metadata):
+        """
+        Write the metadata as ComicInfo.xml text.  This is written out
+        directly, but comes out exactly the same as convertMetadataToXML()'s
+        tree would from ET.tostring()
+        """
+
+        out = ['<?xml version="1.0"?>\n<ComicInfo xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema"']
+
+        empty = True
+        for tag, text in self.metadataElements(metadata):
+            if empty:
+                out.append(">")
+                empty = False
+            if text:
+                out.append("\n  <{0}>{1}</{0}>".format(tag, escapeXML(text)))
+            else:
+                out.append("\n  <{0} />".format(tag))
+
+        first_page = True
+        for page_dict in metadata.iterPages():
+            if empty:
+                out.append(">")
+                empty = False
+            if first_page:
+                out.append("\n  <Pages>")
+                first_page = False
+            attribs = "".join(' {0}="{1}"'.format(key, escapeXML(value, True)) for key, value in page_dict.items())
+            out.append("\n    <Page{0} />".format(attribs))
+        if not first_page:
+            out.append("\n  </Pages>")
+
+        out.append(" />" if empty else "\n</ComicInfo>\n")
+
+        # ET.tostring() writes ASCII, with character references for the rest
+        return "".join(out).encode("ascii", "xmlcharrefreplace").decode()
 
     def indent(self, elem, level=0):
         # for making the XML output readable
@@ -75,20 +267,29 @@ class ComicInfoXml:
             if level and (not elem.tail or not elem.tail.strip()):
                 elem.tail = i
 
-    def convertMetadataToXML(self, filename, metadata):
+    def creditElements(self, metadata):
+        """The (tag, text) pairs for the credits, in CIX order"""
 
-        # shorthand for the metadata
-        md = metadata
+        # need to specially process the credits, since they are structured
+        # differently than CIX.  First build a list for each role that CIX
+        # supports
+        names = dict()
+        for credit in metadata.credits:
+            for tag in self.role_tags.get(credit["role"].lower(), ()):
+                names.setdefault(tag, []).append(credit["person"].replace(",", ""))
 
-        # build a tree structure
-        root = ET.Element("ComicInfo")
-        root.attrib["xmlns:xsi"] = "http://www.w3.org/2001/XMLSchema-instance"
-        root.attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
-        # helper func
+        # then convert each list to a string
+        return [(tag, utils.listToString(names[tag])) for tag in self.credit_order if tag in names]
+
+    def metadataElements(self, metadata):
+        """The (tag, text) pairs for everything but the pages, in CIX order"""
+
+        md = metadata
+        elements = []
 
         def assign(cix_entry, md_entry):
             if md_entry is not None:
-                ET.SubElement(root, cix_entry).text = "{0}".format(md_entry)
+                elements.append((cix_entry, "{0}".format(md_entry)))
 
         assign("Title", md.title)
         assign("Series", md.series)
@@ -107,69 +308,7 @@ class ComicInfoXml:
         assign("Day", md.day)
         assign("SeriesYear", md.seriesYear)
 
-        # need to specially process the credits, since they are structured
-        # differently than CIX
-        credit_writer_list = list()
-        credit_penciller_list = list()
-        credit_inker_list = list()
-        credit_colorist_list = list()
-        credit_letterer_list = list()
-        credit_cover_list = list()
-        credit_editor_list = list()
-
-        # first, loop thru credits, and build a list for each role that CIX
-        # supports
-        for credit in metadata.credits:
-
-            if credit["role"].lower() in set(self.writer_synonyms):
-                credit_writer_list.append(credit["person"].replace(",", ""))
-
-            if credit["role"].lower() in set(self.penciller_synonyms):
-                credit_penciller_list.append(credit["person"].replace(",", ""))
-
-            if credit["role"].lower() in set(self.inker_synonyms):
-                credit_inker_list.append(credit["person"].replace(",", ""))
-
-            if credit["role"].lower() in set(self.colorist_synonyms):
-                credit_colorist_list.append(credit["person"].replace(",", ""))
-
-            if credit["role"].lower() in set(self.letterer_synonyms):
-                credit_letterer_list.append(credit["person"].replace(",", ""))
-
-            if credit["role"].lower() in set(self.cover_synonyms):
-                credit_cover_list.append(credit["person"].replace(",", ""))
-
-            if credit["role"].lower() in set(self.editor_synonyms):
-                credit_editor_list.append(credit["person"].replace(",", ""))
-
-        # second, convert each list to string, and add to XML struct
-        if len(credit_writer_list) > 0:
-            node = ET.SubElement(root, "Writer")
-            node.text = utils.listToString(credit_writer_list)
-
-        if len(credit_penciller_list) > 0:
-            node = ET.SubElement(root, "Penciller")
-            node.text = utils.listToString(credit_penciller_list)
-
-        if len(credit_inker_list) > 0:
-            node = ET.SubElement(root, "Inker")
-            node.text = utils.listToString(credit_inker_list)
-
-        if len(credit_colorist_list) > 0:
-            node = ET.SubElement(root, "Colorist")
-            node.text = utils.listToString(credit_colorist_list)
-
-        if len(credit_letterer_list) > 0:
-            node = ET.SubElement(root, "Letterer")
-            node.text = utils.listToString(credit_letterer_list)
-
-        if len(credit_cover_list) > 0:
-            node = ET.SubElement(root, "CoverArtist")
-            node.text = utils.listToString(credit_cover_list)
-
-        if len(credit_editor_list) > 0:
-            node = ET.SubElement(root, "Editor")
-            node.text = utils.listToString(credit_editor_list)
+        elements.extend(self.creditElements(md))
 
         assign("Publisher", md.publisher)
         assign("Imprint", md.imprint)
@@ -180,17 +319,29 @@ class ComicInfoXml:
         assign("Format", md.format)
         assign("AgeRating", md.maturityRating)
         if md.blackAndWhite is not None and md.blackAndWhite:
-            ET.SubElement(root, "BlackAndWhite").text = "Yes"
+            elements.append(("BlackAndWhite", "Yes"))
         assign("Manga", md.manga)
         assign("Characters", md.characters)
         assign("Teams", md.teams)
         assign("Locations", md.locations)
         assign("ScanInformation", md.scanInfo)
 
+        return elements
+
+    def convertMetadataToXML(self, filename, metadata):
+
+        # build a tree structure
+        root = ET.Element("ComicInfo")
+        root.attrib["xmlns:xsi"] = "http://www.w3.org/2001/XMLSchema-instance"
+        root.attrib["xmlns:xsd"] = "http://www.w3.org/2001/XMLSchema"
+
+        for tag, text in self.metadataElements(metadata):
+            ET.SubElement(root, tag).text = text
+
         #  loop and add the page entries under pages node
-        if len(md.pages) > 0:
+        if metadata.pageListLength() > 0:
             pages_node = ET.SubElement(root, "Pages")
-            for page_dict in md.pages:
+            for page_dict in metadata.iterPages():
                 page_node = ET.SubElement(pages_node, "Page")
                 page_node.attrib = page_dict
 
@@ -217,56 +368,19 @@ class ComicInfoXml:
 
         md = GenericMetadata()
 
-        md.series = utils.xlate(get("Series"))
-        md.title = utils.xlate(get("Title"))
-        md.issue = IssueString(utils.xlate(get("Number"))).asString()
-        md.issueCount = utils.xlate(get("Count"), True)
-        md.volume = utils.xlate(get("Volume"), True)
-        md.alternateSeries = utils.xlate(get("AlternateSeries"))
-        md.alternateNumber = IssueString(utils.xlate(get("AlternateNumber"))).asString()
-        md.alternateCount = utils.xlate(get("AlternateCount"), True)
-        md.comments = utils.xlate(get("Summary"))
-        md.notes = utils.xlate(get("Notes"))
-        md.year = utils.xlate(get("Year"), True)
-        md.month = utils.xlate(get("Month"), True)
-        md.day = utils.xlate(get("Day"), True)
-        md.seriesYear = utils.xlate(get("SeriesYear"), True)
-        md.publisher = utils.xlate(get("Publisher"))
-        md.imprint = utils.xlate(get("Imprint"))
-        md.genre = utils.xlate(get("Genre"))
-        md.webLink = utils.xlate(get("Web"))
-        md.language = utils.xlate(get("LanguageISO"))
-        md.format = utils.xlate(get("Format"))
-        md.manga = utils.xlate(get("Manga"))
-        md.characters = utils.xlate(get("Characters"))
-        md.teams = utils.xlate(get("Teams"))
-        md.locations = utils.xlate(get("Locations"))
-        md.pageCount = utils.xlate(get("PageCount"), True)
-        md.scanInfo = utils.xlate(get("ScanInformation"))
-        md.storyArc = utils.xlate(get("StoryArc"))
-        md.seriesGroup = utils.xlate(get("SeriesGroup"))
-        md.maturityRating = utils.xlate(get("AgeRating"))
-
-        tmp = utils.xlate(get("BlackAndWhite"))
-        if tmp is not None and tmp.lower() in ["yes", "true", "1"]:
-            md.blackAndWhite = True
+        for tag, (name, kind) in self.tag_fields.items():
+            self.setField(md, name, kind, get(tag))
+
         # Now extract the credit info
         for n in root:
-            if n.tag == "Writer" or n.tag == "Penciller" or n.tag == "Inker" or n.tag == "Colorist" or n.tag == "Letterer" or n.tag == "Editor":
-                if n.text is not None:
-                    for name in n.text.split(","):
-                        md.addCredit(name.strip(), n.tag)
-
-            if n.tag == "CoverArtist":
-                if n.text is not None:
-                    for name in n.text.split(","):
-                        md.addCredit(name.strip(), "Cover")
+            if n.tag in self.credit_tags:
+                self.addCredits(md, n.tag, n.text)
 
         # parse page data now
         pages_node = root.find("Pages")
         if pages_node is not None:
             for page in pages_node:
-                md.pages.append(page.attrib)
+                md.addPage(page.attrib)
                 # print page.attrib
 
         md.isEmpty = False
@@ -283,3 +397,6 @@ class ComicInfoXml:
 
         tree = ET.parse(filename)
         return self.convertXMLToMetadata(tree)
+
+
+ComicInfoXml.role_tags = ComicInfoXml.buildRoleTags()
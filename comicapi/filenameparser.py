@@ -22,175 +22,292 @@ This should probably be re-written, but, well, it mostly works!
 
 import os
 import re
+import threading
+from collections import OrderedDict
 from urllib.parse import unquote
 
 
+# The patterns are compiled once, rather than being looked up in re's cache
+# on every call
+dashdash_re = re.compile("--.*")
+underunder_re = re.compile("__.*")
+paren_re = re.compile(r"\(.*?\)")
+word_re = re.compile(r"\S+")
+hash_issue_re = re.compile(r"#[-]?(([0-9]*\.[0-9]+|[0-9]+)(\w*))")
+hash_word_re = re.compile(r"#\S+")
+volume_re = re.compile(r"(.+)([vV]|[Vv][oO][Ll]\.?\s?)(\d+)\s*$")
+volume_end_re = re.compile(r"[vV](?:[oO][lL]\.?\s?)?(\d+)\s*$")
+paren_year_re = re.compile(r"(\()(\d{4})(-(\d{4}|)|)(\))")
+year_re = re.compile(r"\((\d\d\d\d)\)|--(\d\d\d\d)--")
+non_digit_re = re.compile("[^0-9]")
+count_re = re.compile(r"\sof\s(\d+)(?=\s)", re.IGNORECASE)
+paren_count_re = re.compile(r"\(of\s(\d+)\)", re.IGNORECASE)
+
+# The phrases that can't hold the issue number: parenthetical phrases, then
+# bracketed ones, then "of NN".  Blanking them all with one pass of this is
+# the same as blanking each kind in turn, since a bracketed phrase skips over
+# any parenthetical ones inside it, and a "(" with no ")" after it on the
+# line is just a character.  A run of phrases with only spaces between them
+# is blanked as one, which saves a callback for each of the others
+paren_phrase = r"\([^)\n]*\)"
+open_paren = r"\((?![^)\n]*\))"
+skip = r"{0}|\[(?:[^](\n]|{0}|{1})*\]|of \d+".format(paren_phrase, open_paren)
+skip_re = re.compile(r"(?:{0})(?:\s*(?:{0}))*".format(skip))
+
+one_shot_words = ["tpb", "os", "one-shot", "ogn", "gn"]
+
+
+def blank(m):
+    return " " * (m.end() - m.start())
+
+
+class ParseCache:
+    """
+    A bounded, least-recently-used cache of filename parse results, keyed by
+    the file's basename (the only part of the path the parser looks at).
+    The results are stored as tuples of strings, so callers can't change
+    the cached copy.
+    """
+
+    # bump this when the parser's results change, so that results stored
+    # by an older version are thrown away
+    version = 1
+
+    def __init__(self, max_size=20000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get_many(self, keys):
+        """Returns the result for each key, or None for those not cached"""
+
+        with self.lock:
+            results = [self.entries.get(key) for key in keys]
+            for key, result in zip(keys, results):
+                if result is not None:
+                    self.entries.move_to_end(key)
+            found = len(results) - results.count(None)
+            self.hits += found
+            self.misses += len(results) - found
+            return results
+
+    def put_many(self, items):
+        with self.lock:
+            # only the last max_size of them would be kept anyway
+            for key, result in list(items)[-self.max_size :]:
+                self.entries[key] = result
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def items(self):
+        """Returns a list of the (key, result) pairs, least recently used first"""
+
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# shared by all parsers
+parse_cache = ParseCache()
+
+
 class FileNameParser:
     def repl(self, m):
         return " " * len(m.group())
 
     def fixSpaces(self, string, remove_dashes=True):
+        # turn name separators into spaces.  Runs of spaces are left as they
+        # are, so the words stay at the same positions
         if remove_dashes:
-            placeholders = ["[-_]", "  +"]
-        else:
-            placeholders = ["[_]", "  +"]
-        for ph in placeholders:
-            string = re.sub(ph, self.repl, string)
-        return string  # .strip()
+            string = string.replace("-", " ")
+        return string.replace("_", " ")
+
+    def tokenize(self, filename):
+        """Returns the filename with underscores turned into spaces, a copy of
+        that with everything that can't be the issue number blanked out, and
+        the words of the copy.  Both strings keep every character at its
+        position in the filename, so the issue word's position is shared by
+        all the later steps
+        """
 
-    def getIssueCount(self, filename, issue_end):
+        spaced = filename.replace("_", " ")
 
-        count = ""
-        filename = filename[issue_end:]
+        # first, look for multiple "--", this means it's formatted differently
+        # from most.  The pattern seems to be that anything to left of the
+        # first "--" (or "__") is the series name followed by issue
+        if "--" in filename:
+            cleaned = dashdash_re.sub(blank, filename).replace("_", " ")
+        elif "__" in filename:
+            cleaned = underunder_re.sub(blank, filename).replace("_", " ")
+        else:
+            cleaned = spaced
 
         # replace any name separators with spaces
-        tmpstr = self.fixSpaces(filename)
-        found = False
+        cleaned = cleaned.replace("+", " ").replace("-", " ")
 
-        match = re.search("(?<=\sof\s)\d+(?=\s)", tmpstr, re.IGNORECASE)
-        if match:
-            count = match.group()
-            found = True
+        # blank the parenthetical and bracketed phrases, and any "of NN"
+        # phrase (problem: this could break on some titles)
+        if "(" in cleaned or "[" in cleaned or "of " in cleaned:
+            match = skip_re.search(cleaned)
+            if match is None:
+                pass
+            elif match.end() != len(cleaned) and cleaned[match.end() :].strip():
+                cleaned = skip_re.sub(blank, cleaned)
+            else:
+                # usually they're all at the end, and then cutting them off
+                # leaves the words where they were
+                cleaned = cleaned[: match.start()]
 
-        if not found:
-            match = re.search("(?<=\(of\s)\d+(?=\))", tmpstr, re.IGNORECASE)
-            if match:
-                count = match.group()
-                found = True
+        return spaced, cleaned, cleaned.split()
+
+    def getIssueCount(self, spaced, issue_end):
 
-        count = count.lstrip("0")
+        count = ""
+        spaced = spaced[issue_end:]
+
+        if ("f" in spaced or "F" in spaced) and "of" in spaced.lower():
+            spaced = spaced.replace("-", " ")
+            match = count_re.search(spaced)
+            if match is None:
+                match = paren_count_re.search(spaced)
+            if match:
+                count = match.group(1).lstrip("0")
 
         return count
 
-    def getIssueNumber(self, filename):
+    def getIssueNumber(self, cleaned, words):
         """Returns a tuple of issue number string, and start and end indexes in the filename
         (The indexes will be used to split the string up for further parsing)
         """
 
-        found = False
         issue = ""
         start = 0
         end = 0
 
-        # first, look for multiple "--", this means it's formatted differently
-        # from most:
-        if "--" in filename:
-            # the pattern seems to be that anything to left of the first "--"
-            # is the series name followed by issue
-            filename = re.sub("--.*", self.repl, filename)
-
-        elif "__" in filename:
-            # the pattern seems to be that anything to left of the first "__"
-            # is the series name followed by issue
-            filename = re.sub("__.*", self.repl, filename)
-
-        filename = filename.replace("+", " ")
-
-        # replace parenthetical phrases with spaces
-        filename = re.sub("\(.*?\)", self.repl, filename)
-        filename = re.sub("\[.*?\]", self.repl, filename)
-
-        # replace any name separators with spaces
-        filename = self.fixSpaces(filename)
-
-        # remove any "of NN" phrase with spaces (problem: this could break on
-        # some titles)
-        filename = re.sub("of [\d]+", self.repl, filename)
-
-        # print u"[{0}]".format(filename)
-
-        # we should now have a cleaned up filename version with all the words in
-        # the same positions as original filename
-
-        # make a list of each word and its position
-        word_list = list()
-        for m in re.finditer("\S+", filename):
-            word_list.append((m.group(0), m.start(), m.end()))
-
-        # remove the first word, since it can't be the issue number
-        if len(word_list) > 1:
-            word_list = word_list[1:]
-        else:
+        # skip the first word, since it can't be the issue number
+        if len(words) <= 1:
             # only one word??  just bail.
-            return word_list[0][0], start, end
+            return words[0], start, end
 
         # Now try to search for the likely issue number word in the list
+        last = len(words) - 1
+        idx = 0
+        has_hash = "#" in cleaned
 
         # first look for a word with "#" followed by digits with optional suffix
         # this is almost certainly the issue number
-        for w in reversed(word_list):
-            if re.match("#[-]?(([0-9]*\.[0-9]+|[0-9]+)(\w*))", w[0]):
-                found = True
-                break
+        if has_hash:
+            for i in range(last, 0, -1):
+                if words[i][0] == "#" and hash_issue_re.match(words[i]):
+                    idx = i
+                    break
 
         # same as above but w/o a '#', and only look at the last word in the
-        # list
-        if not found:
-            w = word_list[-1]
-            if re.match("[-]?(([0-9]*\.[0-9]+|[0-9]+)(\w*))", w[0]):
-                found = True
+        # list.  The dashes are gone by now, so that's a word starting with a
+        # digit, or with a "." and a digit
+        word = words[last]
+        if not idx and ("0" <= word[0] <= "9" or (word[0] == "." and "0" <= word[1:2] <= "9")):
+            idx = last
 
         # now try to look for a # followed by any characters
-        if not found:
-            for w in reversed(word_list):
-                if re.match("#\S+", w[0]):
-                    found = True
+        if not idx and has_hash:
+            for i in range(last, 0, -1):
+                if hash_word_re.match(words[i]):
+                    idx = i
                     break
 
-        if found:
-            issue = w[0]
-            start = w[1]
-            end = w[2]
+        if idx:
+            issue = words[idx]
+            if idx == last:
+                end = len(cleaned.rstrip())
+                start = end - len(issue)
+            else:
+                for i, m in enumerate(word_re.finditer(cleaned)):
+                    if i == idx:
+                        start, end = m.span()
+                        break
             if issue[0] == "#":
                 issue = issue[1:]
 
         return issue, start, end
 
-    def getSeriesName(self, filename, issue_start):
+    def getSeriesName(self, filename, issue_start, spaced):
         """Use the issue number string index to split the filename string"""
 
         if issue_start != 0:
-            filename = filename[:issue_start]
+            spaced = spaced[:issue_start]
 
         # in case there is no issue number, remove some obvious stuff
-        if "--" in filename:
-            # the pattern seems to be that anything to left of the first "--"
-            # is the series name followed by issue
-            filename = re.sub("--.*", self.repl, filename)
-
-        elif "__" in filename:
-            # the pattern seems to be that anything to left of the first "__"
-            # is the series name followed by issue
-            filename = re.sub("__.*", self.repl, filename)
-
-        filename = filename.replace("+", " ")
-        tmpstr = self.fixSpaces(filename, remove_dashes=False)
-
-        series = tmpstr
+        if "--" in filename or "__" in filename:
+            if issue_start != 0:
+                filename = filename[:issue_start]
+            if "--" in filename:
+                spaced = dashdash_re.sub(blank, filename).replace("_", " ")
+            elif "__" in filename:
+                spaced = underunder_re.sub(blank, filename).replace("_", " ")
+
+        series = spaced.replace("+", " ")
         volume = ""
 
-        # save the last word
-        try:
-            last_word = series.split()[-1]
-        except:
-            last_word = ""
+        # save the series before the parenthetical phrases are removed, for
+        # its last word
+        tmpstr = series
 
         # remove any parenthetical phrases
-        series = re.sub("\(.*?\)", "", series)
-
-        # search for volume number
-        match = re.search("(.+)([vV]|[Vv][oO][Ll]\.?\s?)(\d+)\s*$", series)
-        if match:
-            series = match.group(1)
-            volume = match.group(3)
+        if "(" in series:
+            series = paren_re.sub("", series)
+
+        # search for volume number.  Without a newline in the way, the "v"
+        # can only be the one just before the digits at the end, so it's
+        # enough to find that, as long as something comes before it
+        if "\n" in series:
+            match = volume_re.search(series)
+            if match:
+                series = match.group(1)
+                volume = match.group(3).strip()
+        elif ("v" in series or "V" in series) and series.rstrip()[-1:].isdecimal():
+            match = volume_end_re.search(series)
+            if match and match.start() > 0:
+                series = series[: match.start()]
+                volume = match.group(1)
 
         # if a volume wasn't found, see if the last word is a year in parentheses
         # since that's a common way to designate the volume
-        if volume == "":
-            # match either (YEAR), (YEAR-), or (YEAR-YEAR2)
-            match = re.search("(\()(\d{4})(-(\d{4}|)|)(\))", last_word)
-            if match:
-                volume = match.group(2)
+        if volume == "" and "(" in tmpstr:
+            last_word = tmpstr.split()[-1]
+            if "(" in last_word:
+                # match either (YEAR), (YEAR-), or (YEAR-YEAR2)
+                match = paren_year_re.search(last_word)
+                if match:
+                    volume = match.group(2)
 
         series = series.strip()
 
@@ -198,42 +315,36 @@ class FileNameParser:
         # for hints i.e. "TPB", "one-shot", "OS", "OGN", etc that might
         # be removed to help search online
         if issue_start == 0:
-            one_shot_words = ["tpb", "os", "one-shot", "ogn", "gn"]
-            try:
-                last_word = series.split()[-1]
-                if last_word.lower() in one_shot_words:
-                    series = series.rsplit(" ", 1)[0]
-            except:
-                pass
+            words = series.split()
+            if len(words) > 0 and words[-1].lower() in one_shot_words:
+                series = series.rsplit(" ", 1)[0]
 
-        return series, volume.strip()
+        return series, volume
 
     def getYear(self, filename, issue_end):
 
-        filename = filename[issue_end:]
-
         year = ""
         # look for four digit number with "(" ")" or "--" around it
-        match = re.search("(\(\d\d\d\d\))|(--\d\d\d\d--)", filename)
+        match = year_re.search(filename, issue_end)
         if match:
-            year = match.group()
+            year = match.group(match.lastindex)
             # remove non-digits
-            year = re.sub("[^0-9]", "", year)
+            if year.strip("0123456789"):
+                year = non_digit_re.sub("", year)
         return year
 
-    def getRemainder(self, filename, year, count, volume, issue_end):
+    def getRemainder(self, filename, year, count, volume, issue_end, spaced):
         """Make a guess at where the the non-interesting stuff begins"""
 
         remainder = ""
 
         if "--" in filename:
-            remainder = filename.split("--", 1)[1]
+            remainder = spaced[filename.index("--") + 2 :]
         elif "__" in filename:
-            remainder = filename.split("__", 1)[1]
+            remainder = spaced[filename.index("__") + 2 :]
         elif issue_end != 0:
-            remainder = filename[issue_end:]
+            remainder = spaced[issue_end:]
 
-        remainder = self.fixSpaces(remainder, remove_dashes=False)
         if volume != "":
             remainder = remainder.replace("Vol." + volume, "", 1)
         if year != "":
@@ -246,39 +357,122 @@ class FileNameParser:
 
         return remainder.strip()
 
-    def parseFilename(self, filename):
+    def parseFilename(self, filename, use_cache=True):
 
         # remove the path
         filename = os.path.basename(filename)
 
-        # remove the extension
-        filename = os.path.splitext(filename)[0]
+        result = parse_cache.get(filename) if use_cache else None
+        if result is None:
+            result = self.parseBasename(filename)
+            if use_cache:
+                parse_cache.put(filename, result)
+        else:
+            self.setResult(result)
+
+    def getResult(self):
+        return (self.issue, self.series, self.volume, self.year, self.issue_count, self.remainder)
+
+    def setResult(self, result):
+        self.issue, self.series, self.volume, self.year, self.issue_count, self.remainder = result
+
+    def parseBasename(self, filename, shared=None):
+        """Parses a filename without its path, and returns the results as a
+        tuple, as well as setting them on the parser.
+
+        shared, if given, is a dict that remembers the series and the scan
+        info worked out from the text before and after the issue number, so
+        that a batch of names from the same series works each out only once
+        """
+
+        # remove the extension, as os.path.splitext does for a name without
+        # a directory
+        dot = filename.rfind(".")
+        if dot > 0 and (filename[0] != "." or filename[:dot].lstrip(".")):
+            filename = filename[:dot]
 
         # url decode, just in case
-        filename = unquote(filename)
+        if "%" in filename:
+            filename = unquote(filename)
 
         # sometimes archives get messed up names from too many decodes
         # often url encodings will break and leave "_28" and "_29" in place
         # of "(" and ")"  see if there are a number of these, and replace them
-        if filename.count("_28") > 1 and filename.count("_29") > 1:
+        if "_2" in filename and filename.count("_28") > 1 and filename.count("_29") > 1:
             filename = filename.replace("_28", "(")
             filename = filename.replace("_29", ")")
 
-        self.issue, issue_start, issue_end = self.getIssueNumber(filename)
-        self.series, self.volume = self.getSeriesName(filename, issue_start)
+        spaced, cleaned, words = self.tokenize(filename)
+
+        issue, issue_start, issue_end = self.getIssueNumber(cleaned, words)
 
-        # provides proper value when the filename doesn't have a issue number
-        if issue_end == 0:
-            issue_end = len(self.series)
+        if shared is None or issue_start == 0 or "--" in filename or "__" in filename:
+            series, volume = self.getSeriesName(filename, issue_start, spaced)
 
-        self.year = self.getYear(filename, issue_end)
-        self.issue_count = self.getIssueCount(filename, issue_end)
-        self.remainder = self.getRemainder(filename, self.year, self.issue_count, self.volume, issue_end)
+            # provides proper value when the filename doesn't have a issue number
+            if issue_end == 0:
+                issue_end = len(series)
 
-        if self.issue != "":
+            year = self.getYear(filename, issue_end)
+            count = self.getIssueCount(spaced, issue_end)
+            remainder = self.getRemainder(filename, year, count, volume, issue_end, spaced)
+        else:
+            # with an issue number and no "--" or "__", the series only
+            # depends on the text before the issue, and the rest on the text
+            # after it (and the volume)
+            head = filename[:issue_start]
+            found = shared.get(head)
+            if found is None:
+                found = shared[head] = self.getSeriesName(filename, issue_start, spaced)
+            series, volume = found
+
+            tail = (filename[issue_end:], volume)
+            found = shared.get(tail)
+            if found is None:
+                year = self.getYear(filename, issue_end)
+                count = self.getIssueCount(spaced, issue_end)
+                remainder = self.getRemainder(filename, year, count, volume, issue_end, spaced)
+                found = shared[tail] = (year, count, remainder)
+            year, count, remainder = found
+
+        if issue != "":
             # strip off leading zeros
-            self.issue = self.issue.lstrip("0")
-            if self.issue == "":
-                self.issue = "0"
-            if self.issue[0] == ".":
-                self.issue = "0" + self.issue
+            issue = issue.lstrip("0")
+            if issue == "":
+                issue = "0"
+            if issue[0] == ".":
+                issue = "0" + issue
+
+        result = (issue, series, volume, year, count, remainder)
+        self.setResult(result)
+        return result
+
+
+def parse_many(paths):
+    """Parse a list of filenames, returning a FileNameParser for each.  The
+    shared cache is looked up and filled once for the whole list, rather than
+    once per name, and the names share the work on their series and scan info
+    """
+
+    names = [os.path.basename(path) for path in paths]
+    results = parse_cache.get_many(names)
+
+    parsed = []
+    new_parsers = dict()
+    shared = dict()
+    for name, result in zip(names, results):
+        fnp = FileNameParser()
+        if result is None:
+            if name in new_parsers:
+                fnp.setResult(new_parsers[name].getResult())
+            else:
+                new_parsers[name] = fnp
+                fnp.parseBasename(name, shared)
+        else:
+            fnp.setResult(result)
+        parsed.append(fnp)
+
+    # only the last max_size of them would be kept anyway
+    new_names = list(new_parsers)[-parse_cache.max_size :]
+    parse_cache.put_many((name, new_parsers[name].getResult()) for name in new_names)
+    return parsed
@@ -20,6 +20,8 @@ possible, however lossy it might be
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from array import array
+
 from . import utils
 
 
@@ -55,61 +57,296 @@ class PageInfo:
 """
 
 
+class PageRecords:
+
+    """
+    A page list kept in a couple of arrays instead of a list of dicts, which
+    takes a small fraction of the memory.  The numeric attributes are stored
+    as numbers, Type and DoublePage as codes into a shared table, and
+    anything else (Key, Bookmark, odd looking values) in a side dict.  The
+    order of each page's keys is kept as a code too.  The dicts built by
+    toList() are the same as the ones that were added, down to the key order.
+    """
+
+    __slots__ = ["count", "nums", "codes", "orders", "extra"]
+
+    num_keys = ("Image", "ImageSize", "ImageWidth", "ImageHeight")
+    code_keys = ("Type", "DoublePage")
+    # the CIX attribute order, for pages whose own order couldn't be kept
+    key_order = ("Image", "Type", "DoublePage", "ImageSize", "Key", "Bookmark", "ImageWidth", "ImageHeight")
+
+    # shared by all records, since there are only a handful of page types and
+    # key orders.  The codes are only good in this process, so pickling
+    # stores the values (see __reduce__)
+    code_values = []
+    code_lookup = dict()
+    max_codes = 30000
+
+    missing = -1
+
+    def __init__(self):
+        self.count = 0
+        self.nums = array("i")
+        self.codes = array("h")
+        self.orders = array("h")
+        self.extra = None
+
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        return (PageRecords.fromList, (self.toList(),))
+
+    def isSame(self, other):
+        # the same values get the same codes in a process, so the arrays can
+        # be compared as they are.  Key order doesn't count, as with dicts
+        return (
+            self.count == other.count
+            and self.nums == other.nums
+            and self.codes == other.codes
+            and (self.extra or dict()) == (other.extra or dict())
+        )
+
+    @staticmethod
+    def fromList(page_list):
+        records = PageRecords()
+        for page_dict in page_list:
+            records.append(page_dict)
+        return records
+
+    @classmethod
+    def getCode(cls, value):
+        code = cls.code_lookup.get(value)
+        if code is None and len(cls.code_values) < cls.max_codes:
+            code = len(cls.code_values)
+            cls.code_values.append(value)
+            cls.code_lookup[value] = code
+        return code
+
+    def append(self, page_dict):
+        extra = None
+        found = 0
+
+        for key in self.num_keys:
+            value = page_dict.get(key)
+            if value is None:
+                self.nums.append(self.missing)
+                continue
+            found += 1
+            # only plain numbers that convert back to the same string
+            if isinstance(value, str) and value.isascii() and value.isdigit() and len(value) < 10 and (value[0] != "0" or value == "0"):
+                self.nums.append(int(value))
+            else:
+                self.nums.append(self.missing)
+                extra = extra or dict()
+                extra[key] = value
+
+        for key in self.code_keys:
+            value = page_dict.get(key)
+            if value is None:
+                self.codes.append(self.missing)
+                continue
+            found += 1
+            code = self.code_lookup.get(value)
+            if code is None:
+                code = self.getCode(value)
+            if code is None:
+                self.codes.append(self.missing)
+                extra = extra or dict()
+                extra[key] = value
+            else:
+                self.codes.append(code)
+
+        if len(page_dict) > found:
+            for key, value in page_dict.items():
+                if key not in self.num_keys and key not in self.code_keys:
+                    extra = extra or dict()
+                    extra[key] = value
+
+        order = self.getCode(tuple(page_dict.keys()))
+        self.orders.append(self.missing if order is None else order)
+
+        if extra is not None:
+            if self.extra is None:
+                self.extra = dict()
+            self.extra[self.count] = extra
+        self.count += 1
+
+    def appendDefault(self, count):
+        # plain numbered pages, the first one marked as the cover
+        start = self.count
+        cover = self.getCode(PageType.FrontCover) if start == 0 else self.missing
+        cover_order = self.getCode(("Image", "Type"))
+        page_order = self.getCode(("Image",))
+        for i in range(start, start + count):
+            self.nums.extend((i, self.missing, self.missing, self.missing))
+            self.codes.extend((cover if i == 0 else self.missing, self.missing))
+            order = cover_order if i == 0 else page_order
+            self.orders.append(self.missing if order is None else order)
+        self.count += count
+
+    def get(self, index, key):
+        """The value of one attribute of a page, or None"""
+        if key in self.num_keys:
+            value = self.nums[index * len(self.num_keys) + self.num_keys.index(key)]
+            if value != self.missing:
+                return str(value)
+        elif key in self.code_keys:
+            code = self.codes[index * len(self.code_keys) + self.code_keys.index(key)]
+            if code != self.missing:
+                return self.code_values[code]
+        if self.extra is not None and index in self.extra:
+            return self.extra[index].get(key)
+        return None
+
+    def getDict(self, index):
+        page_dict = dict()
+        order = self.orders[index]
+        if order != self.missing:
+            for key in self.code_values[order]:
+                page_dict[key] = self.get(index, key)
+            return page_dict
+
+        extra = self.extra.get(index) if self.extra is not None else None
+        for key in self.key_order:
+            value = self.get(index, key)
+            if value is not None:
+                page_dict[key] = value
+        if extra is not None:
+            for key, value in extra.items():
+                page_dict.setdefault(key, value)
+        return page_dict
+
+    def toList(self):
+        return [self.getDict(i) for i in range(self.count)]
+
+
 class GenericMetadata:
+
+    # the plain value fields, in display order
+    fields = (
+        "series",
+        "issue",
+        "issueCount",
+        "title",
+        "publisher",
+        "seriesYear",
+        "year",
+        "month",
+        "day",
+        "volume",
+        "volumeCount",
+        "genre",
+        "language",  # 2 letter iso code
+        "country",
+        "criticalRating",
+        "alternateSeries",
+        "alternateNumber",
+        "alternateCount",
+        "imprint",
+        "webLink",
+        "format",
+        "manga",
+        # Some CoMet-only items
+        "price",
+        "isVersionOf",
+        "rights",
+        "identifier",
+        "lastMark",
+        "blackAndWhite",
+        "maturityRating",
+        "storyArc",
+        "seriesGroup",
+        "scanInfo",
+        "characters",
+        "teams",
+        "locations",
+        "comments",  # use same way as Summary in CIX
+        "notes",
+    )
+
+    # fields that overlay() leaves alone
+    other_fields = ("isEmpty", "tagOrigin", "pageCount", "coverImage")
+
+    # everything but the page list, for isSame()
+    data_fields = fields + other_fields + ("credits", "tags")
+
+    __slots__ = data_fields + ("_pages", "_page_records")
+
     def __init__(self):
 
+        for name in self.fields:
+            setattr(self, name, None)
+
         self.isEmpty = True
         self.tagOrigin = None
-
-        self.series = None
-        self.issue = None
-        self.title = None
-        self.publisher = None
-        self.seriesYear = None
-        self.month = None
-        self.year = None
-        self.day = None
-        self.issueCount = None
-        self.volume = None
-        self.genre = None
-        self.language = None  # 2 letter iso code
-        self.comments = None  # use same way as Summary in CIX
-
-        self.volumeCount = None
-        self.criticalRating = None
-        self.country = None
-
-        self.alternateSeries = None
-        self.alternateNumber = None
-        self.alternateCount = None
-        self.imprint = None
-        self.notes = None
-        self.webLink = None
-        self.format = None
-        self.manga = None
-        self.blackAndWhite = None
         self.pageCount = None
-        self.maturityRating = None
-
-        self.storyArc = None
-        self.seriesGroup = None
-        self.scanInfo = None
-
-        self.characters = None
-        self.teams = None
-        self.locations = None
+        self.coverImage = None
 
         self.credits = list()
         self.tags = list()
-        self.pages = list()
 
-        # Some CoMet-only items
-        self.price = None
-        self.isVersionOf = None
-        self.rights = None
-        self.identifier = None
-        self.lastMark = None
-        self.coverImage = None
+        # The page list is either a list of dicts in _pages, or packed into
+        # _page_records until something asks for the dicts
+        self._pages = None
+        self._page_records = None
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._pages = self._page_records.toList() if self._page_records is not None else list()
+            self._page_records = None
+        return self._pages
+
+    @pages.setter
+    def pages(self, pages):
+        self._pages = pages
+        self._page_records = None
+
+    def pageListLength(self):
+        # same as len(self.pages), without unpacking them
+        if self._pages is None:
+            return len(self._page_records) if self._page_records is not None else 0
+        return len(self._pages)
+
+    def addPage(self, page_dict):
+        if self._pages is not None:
+            self._pages.append(page_dict)
+        else:
+            if self._page_records is None:
+                self._page_records = PageRecords()
+            self._page_records.append(page_dict)
+
+    def iterPages(self):
+        # the page dicts, without keeping them around if they're packed
+        if self._pages is None and self._page_records is not None:
+            return (self._page_records.getDict(i) for i in range(len(self._page_records)))
+        return iter(self.pages)
+
+    def getPageValue(self, index, key):
+        if self._pages is None:
+            return self._page_records.get(index, key)
+        return self._pages[index].get(key)
+
+    def isSame(self, other):
+        """
+        True if the other metadata has the same values and pages.  Not
+        __eq__, so metadata stays hashable by identity.  Packed page lists
+        are compared without unpacking them.
+        """
+
+        if not isinstance(other, GenericMetadata):
+            return False
+
+        for name in self.data_fields:
+            if getattr(self, name) != getattr(other, name):
+                return False
+
+        if self.pageListLength() != other.pageListLength():
+            return False
+        if self._page_records is not None and other._page_records is not None:
+            return self._page_records.isSame(other._page_records)
+        return all(page == other_page for page, other_page in zip(self.iterPages(), other.iterPages()))
 
     def overlay(self, new_md):
         """Overlay a metadata object on this one
@@ -118,54 +355,16 @@ class GenericMetadata:
         to this one.
         """
 
-        def assign(cur, new):
-            if new is not None:
-                if isinstance(new, str) and len(new) == 0:
-                    setattr(self, cur, None)
-                else:
-                    setattr(self, cur, new)
-
         if not new_md.isEmpty:
             self.isEmpty = False
 
-        assign("series", new_md.series)
-        assign("issue", new_md.issue)
-        assign("issueCount", new_md.issueCount)
-        assign("title", new_md.title)
-        assign("publisher", new_md.publisher)
-        assign("seriesYear", new_md.seriesYear)
-        assign("day", new_md.day)
-        assign("month", new_md.month)
-        assign("year", new_md.year)
-        assign("volume", new_md.volume)
-        assign("volumeCount", new_md.volumeCount)
-        assign("genre", new_md.genre)
-        assign("language", new_md.language)
-        assign("country", new_md.country)
-        assign("criticalRating", new_md.criticalRating)
-        assign("alternateSeries", new_md.alternateSeries)
-        assign("alternateNumber", new_md.alternateNumber)
-        assign("alternateCount", new_md.alternateCount)
-        assign("imprint", new_md.imprint)
-        assign("webLink", new_md.webLink)
-        assign("format", new_md.format)
-        assign("manga", new_md.manga)
-        assign("blackAndWhite", new_md.blackAndWhite)
-        assign("maturityRating", new_md.maturityRating)
-        assign("storyArc", new_md.storyArc)
-        assign("seriesGroup", new_md.seriesGroup)
-        assign("scanInfo", new_md.scanInfo)
-        assign("characters", new_md.characters)
-        assign("teams", new_md.teams)
-        assign("locations", new_md.locations)
-        assign("comments", new_md.comments)
-        assign("notes", new_md.notes)
-
-        assign("price", new_md.price)
-        assign("isVersionOf", new_md.isVersionOf)
-        assign("rights", new_md.rights)
-        assign("identifier", new_md.identifier)
-        assign("lastMark", new_md.lastMark)
+        for name in self.fields:
+            new = getattr(new_md, name)
+            if new is not None:
+                if isinstance(new, str) and len(new) == 0:
+                    setattr(self, name, None)
+                else:
+                    setattr(self, name, new)
 
         self.overlayCredits(new_md.credits)
         # TODO
@@ -176,10 +375,11 @@ class GenericMetadata:
         # For now, go the easy route, where any overlay
         # value wipes out the whole list
         if len(new_md.tags) > 0:
-            assign("tags", new_md.tags)
+            self.tags = new_md.tags
 
-        if len(new_md.pages) > 0:
-            assign("pages", new_md.pages)
+        if new_md.pageListLength() > 0:
+            self._pages = new_md._pages
+            self._page_records = new_md._page_records
 
     def overlayCredits(self, new_credits):
         for c in new_credits:
@@ -199,27 +399,32 @@ class GenericMetadata:
 
     def setDefaultPageList(self, count):
         # generate a default page list, with the first page marked as the cover
-        for i in range(count):
-            page_dict = dict()
-            page_dict["Image"] = str(i)
-            if i == 0:
-                page_dict["Type"] = PageType.FrontCover
-            self.pages.append(page_dict)
+        if self._pages is None:
+            if self._page_records is None:
+                self._page_records = PageRecords()
+            self._page_records.appendDefault(count)
+        else:
+            for i in range(count):
+                page_dict = dict()
+                page_dict["Image"] = str(i)
+                if i == 0:
+                    page_dict["Type"] = PageType.FrontCover
+                self._pages.append(page_dict)
 
     def getArchivePageIndex(self, pagenum):
         # convert the displayed page number to the page index of the file in
         # the archive
-        if pagenum < len(self.pages):
-            return int(self.pages[pagenum]["Image"])
+        if pagenum < self.pageListLength():
+            return int(self.getPageValue(pagenum, "Image"))
         else:
             return 0
 
     def getCoverPageIndexList(self):
         # return a list of archive page indices of cover pages
         coverlist = []
-        for p in self.pages:
-            if "Type" in p and p["Type"] == PageType.FrontCover:
-                coverlist.append(int(p["Image"]))
+        for i in range(self.pageListLength()):
+            if self.getPageValue(i, "Type") == PageType.FrontCover:
+                coverlist.append(int(self.getPageValue(i, "Image")))
 
         if len(coverlist) == 0:
             coverlist.append(0)
@@ -255,51 +460,11 @@ class GenericMetadata:
             if val is not None and "{0}".format(val) != "":
                 vals.append((tag, val))
 
-        def add_attr_string(tag):
-            val = getattr(self, tag)
+        for tag in self.fields:
+            if tag == "blackAndWhite" and not self.blackAndWhite:
+                continue
             add_string(tag, getattr(self, tag))
 
-        add_attr_string("series")
-        add_attr_string("issue")
-        add_attr_string("issueCount")
-        add_attr_string("title")
-        add_attr_string("publisher")
-        add_attr_string("seriesYear")
-        add_attr_string("year")
-        add_attr_string("month")
-        add_attr_string("day")
-        add_attr_string("volume")
-        add_attr_string("volumeCount")
-        add_attr_string("genre")
-        add_attr_string("language")
-        add_attr_string("country")
-        add_attr_string("criticalRating")
-        add_attr_string("alternateSeries")
-        add_attr_string("alternateNumber")
-        add_attr_string("alternateCount")
-        add_attr_string("imprint")
-        add_attr_string("webLink")
-        add_attr_string("format")
-        add_attr_string("manga")
-
-        add_attr_string("price")
-        add_attr_string("isVersionOf")
-        add_attr_string("rights")
-        add_attr_string("identifier")
-        add_attr_string("lastMark")
-
-        if self.blackAndWhite:
-            add_attr_string("blackAndWhite")
-        add_attr_string("maturityRating")
-        add_attr_string("storyArc")
-        add_attr_string("seriesGroup")
-        add_attr_string("scanInfo")
-        add_attr_string("characters")
-        add_attr_string("teams")
-        add_attr_string("locations")
-        add_attr_string("comments")
-        add_attr_string("notes")
-
         add_string("tags", utils.listToString(self.tags))
 
         for c in self.credits:
@@ -22,7 +22,10 @@ comics industry throws at us.
 
 # import utils
 # import math
-# import re
+import functools
+import re
+
+suffix_split_re = re.compile(r"(\d+)")
 
 
 class IssueString:
@@ -34,6 +37,18 @@ class IssueString:
         self.num = None
         self.suffix = ""
 
+        self.parse(text)
+
+        # for sorting: issues without a number go last, then by number, and
+        # then by the suffix, with any numbers in it compared as numbers
+        suffix_key = tuple((0, int(part)) if part.isdecimal() else (1, part) for part in suffix_split_re.split(self.suffix.lower()) if part != "")
+        num = self.asFloat()
+        if num is None:
+            self.sort_key = (1, 0.0, suffix_key)
+        else:
+            self.sort_key = (0, num, suffix_key)
+
+    def parse(self, text):
         if text is None:
             return
 
@@ -122,6 +137,10 @@ class IssueString:
 
         return num_s
 
+    def asKey(self):
+        # the normalized form used to match up issue numbers
+        return self.asString().lower()
+
     def asFloat(self):
         # return the float, with no suffix
         if self.suffix == "½":
@@ -136,3 +155,12 @@ class IssueString:
         if self.num is None:
             return None
         return int(self.num)
+
+
+@functools.lru_cache(maxsize=8192)
+def cachedIssueString(text):
+    """
+    A shared IssueString for the text, for when the same issue numbers are
+    parsed over and over.  The result mustn't be modified.
+    """
+    return IssueString(text)
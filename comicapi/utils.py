@@ -16,17 +16,45 @@
 # limitations under the License.
 
 import codecs
+import functools
+import json
 import locale
 import os
 import platform
 import re
 import sys
+import threading
+import unicodedata
+
+try:
+    import tomllib
+
+    tomllib_available = True
+except ImportError:
+    tomllib_available = False
 
 
 class UtilsVars:
     already_fixed_encoding = False
 
 
+http_sessions = threading.local()
+
+
+def getHttpSession():
+    """Returns a requests session for the calling thread.  The session keeps
+    its connections open, so later requests to the same host skip the
+    connect and TLS handshake"""
+
+    session = getattr(http_sessions, "session", None)
+    if session is None:
+        import requests
+
+        session = requests.Session()
+        http_sessions.session = session
+    return session
+
+
 def get_actual_preferred_encoding():
     preferred_encoding = locale.getpreferredencoding()
     if platform.system() == "Darwin":
@@ -137,6 +165,7 @@ def xlate(data, isInt=False):
         return str(data)
 
 
+@functools.lru_cache(maxsize=4096)
 def removearticles(text):
     text = text.lower()
     articles = ["and", "a", "&", "issue", "the"]
@@ -150,6 +179,22 @@ def removearticles(text):
     return newText
 
 
+non_alphanumeric_re = re.compile(r"[^A-Za-z0-9]+")
+
+
+@functools.lru_cache(maxsize=8192)
+def normalizeSeriesName(name):
+    """The series name the way Comic Vine matches it: ascii only, no
+    punctuation or articles, all lower case"""
+
+    # normalize unicode and convert to ascii. Does not work for everything eg ½ to 1⁄2 not 1/2
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    # comicvine ignores punctuation and accents
+    name = non_alphanumeric_re.sub(" ", name)
+    # remove extra space and articles and all lower case
+    return removearticles(name).lower().strip()
+
+
 def unique_file(file_name):
     counter = 1
     # returns ('/path/file', '.ext')
@@ -602,14 +647,53 @@ def getLanguageFromISO(iso):
 def getPublisher(publisher):
     if publisher is None:
         return ("", "")
-    imprint = ""
 
+    found = publisher_table.get(publisher.casefold())
+    if found is None:
+        return ("", publisher)
+    return found
+
+
+def buildPublisherTable():
+    """
+    Flatten the ImprintDicts in publishers into one table of case folded
+    name -> (imprint, publisher).  Where a name is listed more than once, the
+    first publisher in the list wins.
+    """
+
+    publisher_table.clear()
     for pub in publishers:
-        imprint, publisher, ok = pub[publisher]
-        if ok:
-            break
+        for name, imprint in dict.items(pub):
+            publisher_table.setdefault(name.casefold(), (imprint, pub.publisher))
 
-    return (imprint, publisher)
+
+def loadPublisherFile(filename):
+    """
+    Add the imprints from a JSON or TOML file, which maps each publisher's
+    name to a table of imprint names (in any case) and the proper imprint
+    name, with "" for the publisher itself.  They take precedence over the
+    built-in ones.  Returns False if the file couldn't be loaded.
+    """
+
+    try:
+        if os.path.splitext(filename)[1].lower() == ".toml":
+            if not tomllib_available:
+                print("Can't load {0}: TOML needs Python 3.11 or newer".format(filename), file=sys.stderr)
+                return False
+            with open(filename, "rb") as f:
+                data = tomllib.load(f)
+        else:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+        new_publishers = [ImprintDict(publisher, mapping) for publisher, mapping in data.items()]
+    except Exception as e:
+        print("Can't load publisher file {0}: {1}".format(filename, e), file=sys.stderr)
+        return False
+
+    publishers[0:0] = new_publishers
+    buildPublisherTable()
+    return True
 
 
 class ImprintDict(dict):
@@ -778,3 +862,7 @@ Archie_Comics = ImprintDict(
     },
 )
 publishers = [Marvel, DC_Comics, Dark_Horse_Comics, Archie_Comics]
+
+# filled in by buildPublisherTable()
+publisher_table = dict()
+buildPublisherTable()
@@ -0,0 +1,3 @@
+from comictaggerlib.main import ctmain
+
+ctmain()
@@ -16,6 +16,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import json
 import os
 import sys
@@ -24,10 +25,7 @@ from pprint import pprint
 from . import utils
 from .cbltransformer import CBLTransformer
 from .comicarchive import ComicArchive, MetaDataStyle
-from .comicvinetalker import ComicVineTalker, ComicVineTalkerException
-from .filerenamer import FileRenamer
 from .genericmetadata import GenericMetadata
-from .issueidentifier import IssueIdentifier
 from .options import Options
 from .settings import ComicTaggerSettings
 
@@ -40,6 +38,10 @@ from .settings import ComicTaggerSettings
 
 filename_encoding = sys.getfilesystemencoding()
 
+# When running as a server, the archives are taken from (and given back to)
+# this pool, so they're kept open from one command to the next
+archive_pool = None
+
 
 class MultipleMatch:
     def __init__(self, filename, match_list):
@@ -57,7 +59,20 @@ class OnlineMatchResults:
         self.fetchDataFailures = []
 
 
+def online_setup(settings):
+    """
+    Import the Comic Vine talker and image fetcher and apply the settings to
+    them.  They're slow to import, so that's only done when they're needed.
+    """
+    from .comicvinetalker import ComicVineTalker
+    from .imagefetcher import ImageFetcher
+
+    ComicVineTalker.api_key = settings.cv_api_key
+    ImageFetcher.max_cache_size = settings.image_cache_max_mb * 1024 * 1024
+
+
 def actual_issue_data_fetch(match, settings, opts):
+    from .comicvinetalker import ComicVineTalker, ComicVineTalkerException
 
     # now get the particular issue data
     try:
@@ -119,7 +134,7 @@ def display_match_set_for_choice(label, match_set, opts, settings):
             cv_md = actual_issue_data_fetch(match_set.matches[int(i)], settings, opts)
             md.overlay(cv_md)
 
-            if settings.auto_imprint:
+            if opts.auto_imprint:
                 md.fixPublisher()
 
             actual_metadata_save(ca, opts, md)
@@ -173,6 +188,9 @@ def cli_mode(opts, settings):
         print("You must specify at least one filename.  Use the -h option for more info", file=sys.stderr)
         return
 
+    if opts.search_online:
+        online_setup(settings)
+
     match_results = OnlineMatchResults()
 
     for f in opts.file_list:
@@ -190,7 +208,9 @@ def create_local_metadata(opts, ca, has_desired_tags):
     md.setDefaultPageList(ca.getNumberOfPages())
 
     if has_desired_tags:
-        md = ca.readMetadata(opts.data_style)
+        # a copy, as the archive keeps what it read, and a server hands the
+        # archive on to the commands that follow
+        md = copy.deepcopy(ca.readMetadata(opts.data_style))
 
     # now, overlay the parsed filename info
     if opts.parse_filename:
@@ -205,11 +225,21 @@ def create_local_metadata(opts, ca, has_desired_tags):
 
 def process_file_cli(filename, opts, settings, match_results):
 
-    batch_mode = len(opts.file_list) > 1
+    if archive_pool is None:
+        ca = ComicArchive(filename, settings.rar_exe_path, ComicTaggerSettings.getGraphic("nocover.png"))
+        process_archive_cli(ca, filename, opts, settings, match_results)
+        return
 
-    settings.auto_imprint = opts.auto_imprint
+    ca = archive_pool.checkout(filename, settings)
+    try:
+        process_archive_cli(ca, filename, opts, settings, match_results)
+    finally:
+        archive_pool.checkin(ca)
 
-    ca = ComicArchive(filename, settings.rar_exe_path, ComicTaggerSettings.getGraphic("nocover.png"))
+
+def process_archive_cli(ca, filename, opts, settings, match_results):
+
+    batch_mode = len(opts.file_list) > 1
 
     if not os.path.lexists(filename):
         print("Cannot find " + filename, file=sys.stderr)
@@ -225,13 +255,18 @@ def process_file_cli(filename, opts, settings, match_results):
         print("This archive is not writable for that tag type", file=sys.stderr)
         return
 
+    # only look for the tag styles the command needs, since checking for
+    # CIX and CoMet means reading in files from the archive
+    if opts.data_style is None:
+        check_styles = [MetaDataStyle.CIX, MetaDataStyle.CBI, MetaDataStyle.COMET]
+    else:
+        check_styles = [opts.data_style]
+        if opts.copy_tags and opts.copy_source is not None:
+            check_styles.append(opts.copy_source)
+
     has = [False, False, False]
-    if ca.hasCIX():
-        has[MetaDataStyle.CIX] = True
-    if ca.hasCBI():
-        has[MetaDataStyle.CBI] = True
-    if ca.hasCoMet():
-        has[MetaDataStyle.COMET] = True
+    for style in check_styles:
+        has[style] = ca.hasMetadata(style)
 
     if opts.print_tags:
 
@@ -350,6 +385,9 @@ def process_file_cli(filename, opts, settings, match_results):
 
         # now, search online
         if opts.search_online:
+            from .comicvinetalker import ComicVineTalker, ComicVineTalkerException
+            from .issueidentifier import IssueIdentifier
+
             if opts.issue_id is not None:
                 # we were given the actual ID to search with
                 try:
@@ -437,7 +475,7 @@ def process_file_cli(filename, opts, settings, match_results):
 
             md.overlay(cv_md)
 
-            if settings.auto_imprint:
+            if opts.auto_imprint:
                 md.fixPublisher()
 
         # ok, done building our metadata. time to save
@@ -470,6 +508,8 @@ def process_file_cli(filename, opts, settings, match_results):
             elif ca.isRar():
                 new_ext = ".cbr"
 
+        from .filerenamer import FileRenamer
+
         renamer = FileRenamer(md)
         renamer.setTemplate(settings.rename_template)
         renamer.setIssueZeroPadding(settings.rename_issue_number_padding)
@@ -15,10 +15,12 @@
 # limitations under the License.
 
 import datetime
+import json
 import os
 import sqlite3 as lite
 
 from . import ctversion, utils
+from .issuestring import cachedIssueString
 from .settings import ComicTaggerSettings
 
 # import sys
@@ -26,6 +28,13 @@ from .settings import ComicTaggerSettings
 
 
 class ComicVineCacher:
+
+    # the schema version upgrade_cache_db() brings the database up to, kept
+    # in its user_version
+    db_version = 2
+    # the database only needs checking by the first cacher in a process
+    db_checked = False
+
     def __init__(self):
         self.settings_folder = ComicTaggerSettings.getSettingsFolder()
         self.db_file = os.path.join(self.settings_folder, "cv_cache.db")
@@ -44,6 +53,10 @@ class ComicVineCacher:
 
         if not os.path.exists(self.db_file):
             self.create_cache_db()
+            self.upgrade_cache_db()
+        elif not ComicVineCacher.db_checked:
+            self.upgrade_cache_db()
+        ComicVineCacher.db_checked = True
 
     def clearCache(self):
         try:
@@ -118,6 +131,40 @@ class ComicVineCacher:
                 + "PRIMARY KEY (id))"
             )
 
+    def upgrade_cache_db(self):
+        con = lite.connect(self.db_file)
+        with con:
+            cur = con.cursor()
+            cur.execute("PRAGMA user_version")
+            version = cur.fetchone()[0]
+
+            # databases made before user_version was set may already have
+            # some of these, so each step checks first
+            if version < 1:
+                # hashes of Comic Vine cover images, and the issue match each
+                # one belongs to (as the JSON of an IssueIdentifier match)
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS CoverHashes("
+                    + "url TEXT,"
+                    + "algorithm TEXT,"
+                    + "hash TEXT,"
+                    + "issue_id INT,"
+                    + "volume_id INT,"
+                    + "match TEXT,"
+                    + "PRIMARY KEY (url, algorithm))"
+                )
+            if version < 2:
+                # the normalized issue number of each cached issue, so an
+                # issue can be looked up in its volume without loading the
+                # whole list
+                cur.execute("PRAGMA table_info(Issues)")
+                if "issue_key" not in [row[1] for row in cur.fetchall()]:
+                    cur.execute("ALTER TABLE Issues ADD COLUMN issue_key TEXT")
+                cur.execute("CREATE INDEX IF NOT EXISTS IssuesByKey ON Issues(volume_id, issue_key)")
+            if version < ComicVineCacher.db_version:
+                cur.execute("PRAGMA user_version = {0}".format(ComicVineCacher.db_version))
+        con.close()
+
     def add_search_results(self, search_term, cv_search_results):
 
         con = lite.connect(self.db_file)
@@ -127,7 +174,7 @@ class ComicVineCacher:
             cur = con.cursor()
 
             # remove all previous entries with this search term
-            cur.execute("DELETE FROM VolumeSearchCache WHERE search_term = ?", [search_term.lower()])
+            cur.execute("DELETE FROM VolumeSearchCache WHERE search_term = ?", [utils.normalizeSeriesName(search_term)])
 
             # now add in new results
             for record in cv_search_results:
@@ -148,7 +195,7 @@ class ComicVineCacher:
                     + "(search_term, id, name, start_year, publisher, count_of_issues, image_url, description) "
                     + "VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
                     (
-                        search_term.lower(),
+                        utils.normalizeSeriesName(search_term),
                         record["id"],
                         record["name"],
                         record["start_year"],
@@ -172,25 +219,45 @@ class ComicVineCacher:
             cur.execute("DELETE FROM VolumeSearchCache WHERE timestamp  < ?", [str(a_day_ago)])
 
             # fetch
-            cur.execute("SELECT * FROM VolumeSearchCache WHERE search_term=?", [search_term.lower()])
+            cur.execute("SELECT * FROM VolumeSearchCache WHERE search_term=?", [utils.normalizeSeriesName(search_term)])
             rows = cur.fetchall()
             # now process the results
             for record in rows:
+                results.append(self.search_result_from_row(record))
 
-                result = dict()
-                result["id"] = record[1]
-                result["name"] = record[2]
-                result["start_year"] = record[3]
-                result["publisher"] = dict()
-                result["publisher"]["name"] = record[4]
-                result["count_of_issues"] = record[5]
-                result["image"] = dict()
-                result["image"]["super_url"] = record[6]
-                result["description"] = record[7]
+        return results
 
-                results.append(result)
+    def get_all_search_results(self):
+        """Returns one record for every volume in the cached search results"""
 
-        return results
+        results = dict()
+        con = lite.connect(self.db_file)
+        with con:
+            con.text_factory = str
+            cur = con.cursor()
+
+            a_day_ago = datetime.datetime.today() - datetime.timedelta(days=1)
+            cur.execute("SELECT * FROM VolumeSearchCache WHERE timestamp >= ? ORDER BY timestamp", [str(a_day_ago)])
+            rows = cur.fetchall()
+            # the newest copy of each volume wins
+            for record in rows:
+                results[record[1]] = self.search_result_from_row(record)
+        con.close()
+
+        return list(results.values())
+
+    def search_result_from_row(self, record):
+        result = dict()
+        result["id"] = record[1]
+        result["name"] = record[2]
+        result["start_year"] = record[3]
+        result["publisher"] = dict()
+        result["publisher"]["name"] = record[4]
+        result["count_of_issues"] = record[5]
+        result["image"] = dict()
+        result["image"]["super_url"] = record[6]
+        result["description"] = record[7]
+        return result
 
     def add_alt_covers(self, issue_id, url_list):
 
@@ -275,6 +342,7 @@ class ComicVineCacher:
                     "volume_id": volume_id,
                     "name": issue["name"],
                     "issue_number": issue["issue_number"],
+                    "issue_key": cachedIssueString(issue["issue_number"]).asKey(),
                     "site_detail_url": issue["site_detail_url"],
                     "cover_date": issue["cover_date"],
                     "super_url": issue["image"]["super_url"],
@@ -361,6 +429,40 @@ class ComicVineCacher:
 
         return results
 
+    def get_volume_issue(self, volume_id, issue_key):
+        """Returns the first cached issue of the volume with the given
+        normalized issue number, or None"""
+
+        result = None
+
+        con = lite.connect(self.db_file)
+        with con:
+            cur = con.cursor()
+            con.text_factory = str
+
+            a_week_ago = datetime.datetime.today() - datetime.timedelta(days=7)
+            cur.execute(
+                "SELECT id,name,issue_number,site_detail_url,cover_date,super_url,thumb_url,description FROM Issues "
+                + "WHERE volume_id = ? AND issue_key = ? AND timestamp >= ? ORDER BY rowid LIMIT 1",
+                [volume_id, issue_key, str(a_week_ago)],
+            )
+            row = cur.fetchone()
+
+            if row is not None:
+                result = dict()
+                result["id"] = row[0]
+                result["name"] = row[1]
+                result["issue_number"] = row[2]
+                result["site_detail_url"] = row[3]
+                result["cover_date"] = row[4]
+                result["image"] = dict()
+                result["image"]["super_url"] = row[5]
+                result["image"]["thumb_url"] = row[6]
+                result["description"] = row[7]
+        con.close()
+
+        return result
+
     def add_issue_select_details(self, issue_id, image_url, thumb_image_url, cover_date, site_detail_url):
 
         con = lite.connect(self.db_file)
@@ -404,6 +506,88 @@ class ComicVineCacher:
 
             return details
 
+    def add_cover_hashes(self, algorithm, cover_list):
+        """cover_list is a list of (url, hash, match) tuples"""
+
+        con = lite.connect(self.db_file)
+
+        with con:
+            cur = con.cursor()
+            for url, image_hash, match in cover_list:
+                cur.execute(
+                    "INSERT or REPLACE INTO CoverHashes VALUES(?, ?, ?, ?, ?, ?)",
+                    (url, algorithm, "{0:016x}".format(image_hash), match["issue_id"], match["volume_id"], json.dumps(match)),
+                )
+        con.close()
+
+    def get_cover_hashes(self, algorithm):
+
+        con = lite.connect(self.db_file)
+        with con:
+            cur = con.cursor()
+            cur.execute("SELECT url,hash FROM CoverHashes WHERE algorithm=?", [algorithm])
+            rows = cur.fetchall()
+        con.close()
+
+        return rows
+
+    def get_cover_hash_matches(self, algorithm, url_list):
+        """Returns a dict mapping each known URL to its stored match"""
+
+        matches = dict()
+        con = lite.connect(self.db_file)
+        with con:
+            cur = con.cursor()
+            for url in url_list:
+                cur.execute("SELECT match FROM CoverHashes WHERE url=? AND algorithm=?", (url, algorithm))
+                row = cur.fetchone()
+                if row is not None:
+                    matches[url] = json.loads(row[0])
+        con.close()
+
+        return matches
+
+    def get_cached_issue_covers(self):
+        """Returns every cached issue that has a cover, along with its volume info"""
+
+        results = list()
+        con = lite.connect(self.db_file)
+        with con:
+            cur = con.cursor()
+            con.text_factory = str
+
+            cur.execute(
+                "SELECT Issues.id,Issues.name,Issues.issue_number,Issues.site_detail_url,Issues.cover_date,"
+                + "Issues.super_url,Issues.thumb_url,Issues.description,"
+                + "Volumes.id,Volumes.name,Volumes.publisher,Volumes.count_of_issues,Volumes.start_year "
+                + "FROM Issues JOIN Volumes ON Issues.volume_id = Volumes.id "
+                + "WHERE Issues.thumb_url IS NOT NULL AND Issues.issue_number IS NOT NULL"
+            )
+            for row in cur.fetchall():
+                issue = dict()
+                issue["id"] = row[0]
+                issue["name"] = row[1]
+                issue["issue_number"] = row[2]
+                issue["site_detail_url"] = row[3]
+                issue["cover_date"] = row[4]
+                issue["image"] = dict()
+                issue["image"]["super_url"] = row[5]
+                issue["image"]["thumb_url"] = row[6]
+                issue["description"] = row[7]
+
+                series = dict()
+                series["id"] = row[8]
+                series["name"] = row[9]
+                series["publisher"] = dict()
+                series["publisher"]["name"] = row[10]
+                series["count_of_issues"] = row[11]
+                series["start_year"] = row[12]
+
+                results.append((series, issue))
+        con.close()
+
+        return results
+
     def upsert(self, cur, tablename, pkname, pkval, data):
         """This does an insert if the given PK doesn't exist, and an
         update it if does
@@ -23,34 +23,16 @@ import time
 import unicodedata
 
 import requests
-from bs4 import BeautifulSoup
 
 from . import ctversion, utils
 from .comicvinecacher import ComicVineCacher
 from .genericmetadata import GenericMetadata
-from .issuestring import IssueString
+from .issuestring import IssueString, cachedIssueString
+from .seriesindex import SeriesIndex
 
 # from pprint import pprint
 # import math
 
-
-try:
-    from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
-    from PyQt5.QtCore import QUrl, pyqtSignal, QObject, QByteArray
-except ImportError:
-    # No Qt, so define a few dummy QObjects to help us compile
-    class QObject:
-        def __init__(self, *args):
-            pass
-
-    class pyqtSignal:
-        def __init__(self, *args):
-            pass
-
-        def emit(a, b, c):
-            pass
-
-
 # from settings import ComicTaggerSettings
 
 
@@ -76,11 +58,14 @@ class ComicVineTalkerException(Exception):
             return "CV error #{0}:  [{1}]. \n".format(self.code, self.desc)
 
 
-class ComicVineTalker(QObject):
+class ComicVineTalker:
 
     logo_url = "http://static.comicvine.com/bundles/comicvinesite/images/logo.png"
     api_key = ""
 
+    # trigram index of the cached search results, shared by all talkers
+    series_index = None
+
     @staticmethod
     def getRateLimitMessage():
         if ComicVineTalker.api_key == "":
@@ -89,7 +74,6 @@ class ComicVineTalker(QObject):
             return "Comic Vine rate limit exceeded.  Please wait a bit."
 
     def __init__(self):
-        QObject.__init__(self)
 
         self.api_base_url = "https://comicvine.gamespot.com/api"
         self.wait_for_rate_limit = False
@@ -103,6 +87,7 @@ class ComicVineTalker(QObject):
             self.api_key = ComicVineTalker.api_key
 
         self.log_func = None
+        self.signals = None
 
     def setLogFunc(self, log_func):
         self.log_func = log_func
@@ -133,7 +118,7 @@ class ComicVineTalker(QObject):
         try:
             test_url = self.api_base_url + "/issue/1/?api_key=" + key + "&format=json&field_list=name"
 
-            cv_response = requests.get(test_url, headers={"user-agent": "comictagger/" + ctversion.version}).json()
+            cv_response = utils.getHttpSession().get(test_url, headers={"user-agent": "comictagger/" + ctversion.version}).json()
 
             # Bogus request, but if the key is wrong, you get error 100: "Invalid
             # API Key"
@@ -178,7 +163,7 @@ class ComicVineTalker(QObject):
         # print("---", url)
         for tries in range(3):
             try:
-                resp = requests.get(url, params=params, headers={"user-agent": "comictagger/" + ctversion.version})
+                resp = utils.getHttpSession().get(url, params=params, headers={"user-agent": "comictagger/" + ctversion.version})
                 if resp.status_code == 200:
                     return resp.json()
                 if resp.status_code == 500:
@@ -253,23 +238,40 @@ class ComicVineTalker(QObject):
 
         return search_results
 
+    def getSeriesIndex(self):
+        if ComicVineTalker.series_index is None:
+            index = SeriesIndex()
+            for record in ComicVineCacher().get_all_search_results():
+                index.add(record)
+            ComicVineTalker.series_index = index
+        return ComicVineTalker.series_index
+
+    def rankSeries(self, series_name, search_results):
+        """
+        Sorts search results by how similar their names are to the searched
+        one, using the local series index.  Those with the same similarity
+        keep Comic Vine's order.
+        """
+
+        rank = dict()
+        for i, (record, similarity) in enumerate(self.getSeriesIndex().query(series_name)):
+            rank[record["id"]] = i
+        return sorted(search_results, key=lambda record: rank.get(record["id"], len(rank)))
+
     def searchForSeries(self, series_name, callback=None, refresh_cache=False):
 
-        # normalize unicode and convert to ascii. Does not work for everything eg ½ to 1⁄2 not 1/2
-        search_series_name = unicodedata.normalize("NFKD", series_name).encode("ascii", "ignore").decode("ascii")
-        # comicvine ignores punctuation and accents
-        search_series_name = re.sub(r"[^A-Za-z0-9]+", " ", search_series_name)
-        # remove extra space and articles and all lower case
-        search_series_name = utils.removearticles(search_series_name).lower().strip()
+        search_series_name = utils.normalizeSeriesName(series_name)
 
         # before we search online, look in our cache, since we might have
-        # done this same search recently
+        # done this same search recently.  The cache is keyed by the
+        # normalized name, which is what Comic Vine is asked for, so other
+        # spellings of the same name find it too
         cvc = ComicVineCacher()
         if not refresh_cache:
             cached_search_results = cvc.get_search_results(series_name)
 
             if len(cached_search_results) > 0:
-                return cached_search_results
+                return self.rankSeries(series_name, cached_search_results)
 
         params = {
             "api_key": self.api_key,
@@ -316,14 +318,7 @@ class ComicVineTalker(QObject):
         stop_searching = False
         while current_result_count < total_result_count:
 
-            last_result = search_results[-1]["name"]
-
-            # normalize unicode and convert to ascii. Does not work for everything eg ½ to 1⁄2 not 1/2
-            last_result = unicodedata.normalize("NFKD", last_result).encode("ascii", "ignore").decode("ascii")
-            # comicvine ignores punctuation and accents
-            last_result = re.sub(r"[^A-Za-z0-9]+", " ", last_result)
-            # remove extra space and articles and all lower case
-            last_result = utils.removearticles(last_result).lower().strip()
+            last_result = utils.normalizeSeriesName(search_results[-1]["name"])
 
             # See if the last result's name has all the of the search terms.
             # if not, break out of this, loop, we're done.
@@ -364,14 +359,8 @@ class ComicVineTalker(QObject):
         # (iterate backwards for easy removal)
         for i in range(len(search_results) - 1, -1, -1):
             record = search_results[i]
+            recordName = utils.normalizeSeriesName(record["name"])
             for term in search_series_name.split():
-                # normalize unicode and convert to ascii. Does not work for everything eg ½ to 1⁄2 not 1/2
-                recordName = unicodedata.normalize("NFKD", record["name"]).encode("ascii", "ignore").decode("ascii")
-                # comicvine ignores punctuation and accents
-                recordName = re.sub(r"[^A-Za-z0-9]+", " ", recordName)
-                # remove extra space and articles and all lower case
-                recordName = utils.removearticles(recordName).lower().strip()
-
                 if term not in recordName:
                     del search_results[i]
                     break
@@ -384,8 +373,11 @@ class ComicVineTalker(QObject):
 
         # cache these search results
         cvc.add_search_results(series_name, search_results)
+        index = self.getSeriesIndex()
+        for record in search_results:
+            index.add(record)
 
-        return search_results
+        return self.rankSeries(series_name, search_results)
 
     def fetchVolumeData(self, series_id):
 
@@ -456,6 +448,13 @@ class ComicVineTalker(QObject):
 
         return volume_issues_result
 
+    def indexIssues(self, issue_list):
+        # map each normalized issue number to the first record that has it
+        issue_index = dict()
+        for record in issue_list:
+            issue_index.setdefault(cachedIssueString(record["issue_number"]).asKey(), record)
+        return issue_index
+
     def fetchIssuesByVolumeIssueNumAndYear(self, volume_id_list, issue_number, year):
         volume_filter = ""
         for vid in volume_id_list:
@@ -506,17 +505,18 @@ class ComicVineTalker(QObject):
     def fetchIssueData(self, series_id, issue_number, settings):
 
         volume_results = self.fetchVolumeData(series_id)
-        issues_list_results = self.fetchIssuesByVolume(series_id)
-
-        found = False
-        for record in issues_list_results:
-            if IssueString(issue_number).asString() is None:
-                issue_number = 1
-            if IssueString(record["issue_number"]).asString().lower() == IssueString(issue_number).asString().lower():
-                found = True
-                break
 
-        if found:
+        if cachedIssueString(issue_number).asString() is None:
+            issue_number = 1
+        issue_key = cachedIssueString(issue_number).asKey()
+
+        # the cache can look the issue up directly, if the volume's issue
+        # list is there
+        record = ComicVineCacher().get_volume_issue(series_id, issue_key)
+        if record is None:
+            record = self.indexIssues(self.fetchIssuesByVolume(series_id)).get(issue_key)
+
+        if record is not None:
             issue_url = self.api_base_url + "/issue/" + CVTypeID.Issue + "-" + str(record["id"])
             params = {"api_key": self.api_key, "format": "json"}
             cv_response = self.getCVContent(issue_url, params)
@@ -618,6 +618,11 @@ class ComicVineTalker(QObject):
 
         if string is None:
             return ""
+
+        # BeautifulSoup is slow to import, and only needed here and for
+        # scraping alternate covers
+        from bs4 import BeautifulSoup
+
         # find any tables
         soup = BeautifulSoup(string, "html.parser")
         tables = soup.findAll("table")
@@ -760,7 +765,7 @@ class ComicVineTalker(QObject):
             return url_list
 
         # scrape the CV issue page URL to get the alternate cover URLs
-        content = requests.get(issue_page_url, headers={"user-agent": "comictagger/" + ctversion.version}).text
+        content = utils.getHttpSession().get(issue_page_url, headers={"user-agent": "comictagger/" + ctversion.version}).text
         alt_cover_url_list = self.parseOutAltCoverUrls(content)
 
         # cache this alt cover URL list
@@ -769,6 +774,8 @@ class ComicVineTalker(QObject):
         return alt_cover_url_list
 
     def parseOutAltCoverUrls(self, page_html):
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(page_html, "html.parser")
 
         alt_cover_url_list = []
@@ -805,7 +812,23 @@ class ComicVineTalker(QObject):
         cvc.add_alt_covers(issue_id, url_list)
 
     # -------------------------------------------------------------------------
-    urlFetchComplete = pyqtSignal(str, str, int)
+    # The async fetches are only used by the GUI, so Qt is imported when the
+    # first one asks for its signals, or starts a request
+
+    def getSignals(self):
+        if self.signals is None:
+            from .qtsignals import TalkerSignals
+
+            self.signals = TalkerSignals()
+        return self.signals
+
+    @property
+    def urlFetchComplete(self):
+        return self.getSignals().urlFetchComplete
+
+    @property
+    def altUrlListFetchComplete(self):
+        return self.getSignals().altUrlListFetchComplete
 
     def asyncFetchIssueCoverURLs(self, issue_id):
 
@@ -825,6 +848,9 @@ class ComicVineTalker(QObject):
             + self.api_key
             + "&format=json&field_list=image,cover_date,site_detail_url"
         )
+        from PyQt5.QtCore import QUrl
+        from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
+
         self.nam = QNetworkAccessManager()
         self.nam.finished.connect(self.asyncFetchIssueCoverURLComplete)
         self.nam.get(QNetworkRequest(QUrl(issue_url)))
@@ -854,8 +880,6 @@ class ComicVineTalker(QObject):
 
         self.urlFetchComplete.emit(image_url, thumb_url, self.issue_id)
 
-    altUrlListFetchComplete = pyqtSignal(list, int)
-
     def asyncFetchAlternateCoverURLs(self, issue_id, issue_page_url):
         # This async version requires the issue page url to be provided!
         self.issue_id = issue_id
@@ -864,6 +888,9 @@ class ComicVineTalker(QObject):
             self.altUrlListFetchComplete.emit(url_list, int(self.issue_id))
             return
 
+        from PyQt5.QtCore import QUrl
+        from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
+
         self.nam = QNetworkAccessManager()
         self.nam.finished.connect(self.asyncFetchAlternateCoverURLsComplete)
         self.nam.get(QNetworkRequest(QUrl(str(issue_page_url))))
@@ -0,0 +1,463 @@
+"""Classes to find near-duplicate image hashes quickly"""
+
+# Copyright 2012-2014 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import os
+import sqlite3 as lite
+
+from comicapi import filenameparser
+
+from .imagehasher import ImageHasher, numpy_available, popcount
+from .settings import ComicTaggerSettings
+
+if numpy_available:
+    import numpy as np
+
+
+class HashIndex:
+    """
+    Multi-index hashing table over 64-bit image hashes.
+
+    Each hash is split into 4 chunks of 16 bits, and each chunk gets its own
+    lookup table.  Two hashes within distance r of each other must have at
+    least one chunk within distance r // 4, so a radius query only needs to
+    look up the few chunk values near the query's own, and then check the
+    real distance of the candidates it finds.
+    """
+
+    chunks = 4
+    chunk_bits = 16
+
+    # hashes that say nothing about the image (a cover that couldn't be
+    # decoded hashes to 0), which groups() leaves out
+    degenerate_hashes = {0, (1 << 64) - 1}
+
+    # when grouping, chunk values shared by more hashes than this (dark or
+    # mostly white covers share a lot of chunks) are joined a block of pairs
+    # at a time, rather than all at once
+    max_bucket = 1024
+    block_size = 1 << 20
+
+    def __init__(self):
+        self.tables = [dict() for i in range(self.chunks)]
+        self.hashes = dict()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def split(self, h):
+        mask = (1 << self.chunk_bits) - 1
+        return [(h >> (i * self.chunk_bits)) & mask for i in range(self.chunks)]
+
+    def add(self, key, h):
+        """Add a hash (int or hex string) under the given key"""
+        h = ImageHasher.hash_to_int(h)
+        if key in self.hashes:
+            self.remove(key)
+
+        self.hashes[key] = h
+        for table, chunk in zip(self.tables, self.split(h)):
+            table.setdefault(chunk, set()).add(key)
+
+    def remove(self, key):
+        h = self.hashes.pop(key, None)
+        if h is None:
+            return
+
+        for table, chunk in zip(self.tables, self.split(h)):
+            keys = table[chunk]
+            keys.discard(key)
+            if len(keys) == 0:
+                del table[chunk]
+
+    def neighbors(self, chunk, distance):
+        # all values within the given hamming distance of a chunk
+        yield chunk
+        for d in range(1, distance + 1):
+            for bits in itertools.combinations(range(self.chunk_bits), d):
+                flipped = chunk
+                for b in bits:
+                    flipped ^= 1 << b
+                yield flipped
+
+    def candidates(self, h, radius):
+        keys = set()
+        for table, chunk in zip(self.tables, self.split(h)):
+            for value in self.neighbors(chunk, radius // self.chunks):
+                bucket = table.get(value)
+                if bucket is not None:
+                    keys.update(bucket)
+        return keys
+
+    def query(self, h, radius):
+        """Returns a list of (key, distance) for every hash within radius, closest first"""
+        h = ImageHasher.hash_to_int(h)
+
+        candidates = self.candidates(h, radius)
+
+        results = []
+        for key in candidates:
+            distance = popcount(h ^ self.hashes[key])
+            if distance <= radius:
+                results.append((key, distance))
+
+        results.sort(key=lambda x: x[1])
+        return results
+
+    def groups(self, radius):
+        """Returns lists of keys whose hashes are connected by steps of at most radius"""
+
+        # keys with the same hash always end up together, so only the
+        # distinct hashes need to be joined
+        members = dict()
+        for key, h in self.hashes.items():
+            if h not in self.degenerate_hashes:
+                members.setdefault(h, []).append(key)
+        values = list(members.keys())
+
+        parent = list(range(len(values)))
+
+        def find(i):
+            root = i
+            while parent[root] != root:
+                root = parent[root]
+            # compress the path, so later lookups are quick
+            while parent[i] != root:
+                parent[i], i = root, parent[i]
+            return root
+
+        for a, b in self.close_pairs(values, radius):
+            root1 = find(a)
+            root2 = find(b)
+            if root1 != root2:
+                parent[root2] = root1
+
+        groups = dict()
+        for i, h in enumerate(values):
+            groups.setdefault(find(i), []).extend(members[h])
+
+        return [g for g in groups.values() if len(g) > 1]
+
+    def close_pairs(self, values, radius):
+        """Returns a list of (i, j) index pairs of the distinct hash values that
+        are within radius of each other"""
+
+        if not numpy_available:
+            index = HashIndex()
+            for i, h in enumerate(values):
+                index.add(i, h)
+
+            pairs = []
+            for i, h in enumerate(values):
+                for j in index.candidates(h, radius):
+                    if i < j and popcount(h ^ values[j]) <= radius:
+                        pairs.append((i, j))
+            return pairs
+
+        # Same idea as query(), but joining every hash against all the others
+        # at once: bucket each chunk's values, then look up the (flipped)
+        # chunk of every hash in the buckets
+        hashes = np.array(values, dtype=np.uint64)
+        n = len(values)
+        mask = np.uint64((1 << self.chunk_bits) - 1)
+
+        first_list = [np.zeros(0, dtype=np.int64)]
+        second_list = [np.zeros(0, dtype=np.int64)]
+        for i in range(self.chunks):
+            chunk = ((hashes >> np.uint64(i * self.chunk_bits)) & mask).astype(np.int64)
+            order = np.argsort(chunk, kind="stable")
+            bucket_size = np.bincount(chunk, minlength=1 << self.chunk_bits)
+            bucket_start = np.cumsum(bucket_size) - bucket_size
+
+            for flip in self.neighbors(0, radius // self.chunks):
+                target = chunk ^ flip
+                big = bucket_size[target] > self.max_bucket
+                counts = np.where(big, 0, bucket_size[target])
+
+                # one row for every (hash, match) combination
+                first = np.repeat(np.arange(n), counts)
+                offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                second = order[np.repeat(bucket_start[target], counts) + offset]
+
+                keep = first < second
+                first = first[keep]
+                second = second[keep]
+
+                close = ImageHasher.hamming_matrix_pairs(hashes[first], hashes[second]) <= radius
+                first_list.append(first[close])
+                second_list.append(second[close])
+
+                big_queries = np.nonzero(big)[0]
+                for value in np.unique(target[big_queries]).tolist():
+                    queries = big_queries[target[big_queries] == value]
+                    members = order[bucket_start[value] : bucket_start[value] + bucket_size[value]]
+                    self.block_pairs(hashes, queries, members, radius, first_list, second_list)
+
+        # a pair can be found through several chunks
+        return list(set(zip(np.concatenate(first_list).tolist(), np.concatenate(second_list).tolist())))
+
+    def block_pairs(self, hashes, queries, members, radius, first_list, second_list):
+        # compare the hashes that look up a big bucket with all of its
+        # members, a block of rows at a time so the distances fit in memory.
+        # Both are in index order, so a block only needs the members after
+        # its first hash
+        rows = max(1, self.block_size // len(members))
+        for start in range(0, len(queries), rows):
+            block = queries[start : start + rows]
+            later = members[np.searchsorted(members, block[0], side="right") :]
+            if len(later) == 0:
+                break
+            close = ImageHasher.bit_counts(hashes[block][:, np.newaxis] ^ hashes[later][np.newaxis, :]) <= radius
+            i, j = np.nonzero(close)
+            first = block[i]
+            second = later[j]
+            keep = first < second
+            first_list.append(first[keep])
+            second_list.append(second[keep])
+
+
+class LibraryHashIndex:
+    """
+    A persistent index of the cover hash of every comic archive seen, so that
+    visually identical books can be found no matter how they are tagged.
+
+    Archives are re-hashed only when their size or modification time change.
+    """
+
+    def __init__(self, db_file=None):
+        if db_file is None:
+            db_file = os.path.join(ComicTaggerSettings.getSettingsFolder(), "cover_hash_index.db")
+        self.db_file = db_file
+        self.index = None
+
+        if not os.path.exists(self.db_file) or self.get_db_version() != ImageHasher.version:
+            # hashes made by another version of the hasher can't be compared
+            self.create_index_db()
+
+    def get_db_version(self):
+        con = lite.connect(self.db_file)
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        con.close()
+        return version
+
+    def create_index_db(self):
+
+        # this will wipe out any existing version
+        open(self.db_file, "w").close()
+
+        con = lite.connect(self.db_file)
+
+        # create tables
+        with con:
+
+            cur = con.cursor()
+
+            cur.execute("CREATE TABLE Covers(" + "path TEXT," + "size INT," + "mtime REAL," + "hash TEXT," + "PRIMARY KEY (path))")
+            cur.execute("PRAGMA user_version = {0}".format(ImageHasher.version))
+
+    def file_stamp(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def is_current(self, path):
+        """True if the stored hash for the archive is still valid"""
+        try:
+            size, mtime = self.file_stamp(path)
+        except OSError:
+            return False
+
+        con = lite.connect(self.db_file)
+        with con:
+            row = con.execute("SELECT size,mtime FROM Covers WHERE path=?", [path]).fetchone()
+        con.close()
+
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def add(self, path, cover_data):
+        """Hash the cover image data of the archive and store it"""
+        self.add_many([(path, cover_data)])
+
+    def add_many(self, item_list):
+        """Hash and store a list of (path, cover_data) tuples"""
+
+        if len(item_list) == 0:
+            return
+
+        hash_list = ImageHasher.hash_many([cover_data for path, cover_data in item_list])
+        self.add_hashes([(path, h) for (path, cover_data), h in zip(item_list, hash_list)])
+
+    def add_hashes(self, hash_list):
+        """Store a list of (path, hash) tuples, for covers hashed elsewhere"""
+
+        rows = []
+        for path, h in hash_list:
+            size, mtime = self.file_stamp(path)
+            rows.append((path, size, mtime, "{0:016x}".format(h)))
+            if self.index is not None:
+                self.index.add(path, h)
+
+        con = lite.connect(self.db_file)
+        with con:
+            con.executemany("INSERT or REPLACE INTO Covers VALUES(?, ?, ?, ?)", rows)
+        con.close()
+
+    def get_current_hashes(self, file_list):
+        """Returns a dict of path to hash, for the archives whose stored hash is still valid"""
+
+        con = lite.connect(self.db_file)
+        stored = {path: (size, mtime, h) for path, size, mtime, h in con.execute("SELECT path,size,mtime,hash FROM Covers")}
+        con.close()
+
+        result = dict()
+        for path in file_list:
+            if path in stored:
+                size, mtime, h = stored[path]
+                try:
+                    if (size, mtime) == self.file_stamp(path):
+                        result[path] = int(h, 16)
+                except OSError:
+                    pass
+        return result
+
+    def update(self, file_list, get_cover):
+        """
+        Bring the index up to date for the given archives.  get_cover(path)
+        should return the cover image data, and is only called for archives
+        that are new or have changed since they were last hashed.
+        """
+
+        current = self.get_current_hashes(file_list)
+
+        pending = []
+        for path in file_list:
+            if path in current or not os.path.exists(path):
+                continue
+
+            cover_data = get_cover(path)
+            if cover_data is not None:
+                pending.append((path, cover_data))
+
+            # keep the memory use down on large libraries
+            if len(pending) >= 100:
+                self.add_many(pending)
+                pending = []
+
+        self.add_many(pending)
+
+    def get_paths(self):
+        """Returns the path of every archive in the index"""
+
+        con = lite.connect(self.db_file)
+        paths = [path for (path,) in con.execute("SELECT path FROM Covers")]
+        con.close()
+
+        return paths
+
+    def prune(self):
+        """Remove archives that no longer exist"""
+
+        con = lite.connect(self.db_file)
+        with con:
+            missing = [(path,) for (path,) in con.execute("SELECT path FROM Covers") if not os.path.exists(path)]
+            con.executemany("DELETE FROM Covers WHERE path=?", missing)
+        con.close()
+
+        if self.index is not None:
+            for (path,) in missing:
+                self.index.remove(path)
+
+    def create_parse_table(self, con):
+        # not in create_index_db(), since older index files don't have it
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS FileNames("
+            + "name TEXT,"
+            + "version INT,"
+            + "issue TEXT,"
+            + "series TEXT,"
+            + "volume TEXT,"
+            + "year TEXT,"
+            + "issue_count TEXT,"
+            + "remainder TEXT,"
+            + "PRIMARY KEY (name))"
+        )
+
+    def load_parse_cache(self, cache=None):
+        """
+        Fill the filename parse cache (the shared one by default) with the
+        results stored in the index, and return how many there were
+        """
+
+        if cache is None:
+            cache = filenameparser.parse_cache
+
+        con = lite.connect(self.db_file)
+        with con:
+            self.create_parse_table(con)
+            rows = con.execute(
+                "SELECT name,issue,series,volume,year,issue_count,remainder FROM FileNames WHERE version=? ORDER BY rowid",
+                [filenameparser.ParseCache.version],
+            ).fetchall()
+        con.close()
+
+        cache.put_many((row[0], tuple(row[1:])) for row in rows)
+        return len(rows)
+
+    def save_parse_cache(self, cache=None):
+        """
+        Store the results in the filename parse cache (the shared one by
+        default) in the index, so that the next run can load them.  Only as
+        many as the cache holds are kept, the most recently used ones.
+        """
+
+        if cache is None:
+            cache = filenameparser.parse_cache
+
+        version = filenameparser.ParseCache.version
+        rows = [(name, version) + tuple(result) for name, result in cache.items()]
+
+        con = lite.connect(self.db_file)
+        with con:
+            self.create_parse_table(con)
+            # replacing a row moves it to the end, so the rowids stay in
+            # least recently used order
+            con.executemany("INSERT or REPLACE INTO FileNames VALUES(?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            con.execute("DELETE FROM FileNames WHERE version!=?", [version])
+            con.execute("DELETE FROM FileNames WHERE rowid NOT IN (SELECT rowid FROM FileNames ORDER BY rowid DESC LIMIT ?)", [cache.max_size])
+        con.close()
+
+    def get_index(self):
+        if self.index is None:
+            self.index = HashIndex()
+            con = lite.connect(self.db_file)
+            for path, h in con.execute("SELECT path,hash FROM Covers"):
+                self.index.add(path, h)
+            con.close()
+
+        return self.index
+
+    def query(self, h, radius=6):
+        """Returns a list of (path, distance) for archives with a cover within radius of the hash"""
+        return self.get_index().query(h, radius)
+
+    def find_duplicates(self, radius=6, path_list=None):
+        """Returns lists of archive paths whose covers are within radius of each other"""
+
+        groups = self.get_index().groups(radius)
+        if path_list is not None:
+            wanted = set(path_list)
+            groups = [[p for p in g if p in wanted] for g in groups]
+            groups = [g for g in groups if len(g) > 1]
+        return groups
@@ -14,60 +14,80 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import datetime
+import hashlib
 import os
 import shutil
 import sqlite3 as lite
 import tempfile
+import threading
+import time
 
-import requests
-
-from . import ctversion
+from . import ctversion, utils
 from .settings import ComicTaggerSettings
 
-try:
-    from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
-    from PyQt5.QtCore import QUrl, pyqtSignal, QObject, QByteArray
-    from PyQt5 import QtGui
-except ImportError:
-    # No Qt, so define a few dummy QObjects to help us compile
-    class QObject:
-        def __init__(self, *args):
-            pass
 
-    class QByteArray:
-        pass
+class ImageFetcherException(Exception):
+    pass
 
-    class pyqtSignal:
-        def __init__(self, *args):
-            pass
 
-        def emit(a, b, c):
-            pass
+class ImageFetcher:
 
+    # Images are stored once per unique content, in a folder tree sharded by
+    # the leading characters of their hash.  When the store grows beyond this
+    # many bytes, the least recently used images are evicted.
+    max_cache_size = 512 * 1024 * 1024
 
-class ImageFetcherException(Exception):
-    pass
+    # number of simultaneous downloads made by fetch_many()
+    max_workers = 8
 
+    # bump this when the layout of the DB or the image store changes
+    db_version = 4
 
-class ImageFetcher(QObject):
+    # a single connection to the URL index is shared by all fetchers
+    db_con = None
+    db_lock = threading.RLock()
 
-    fetchComplete = pyqtSignal(QByteArray, int)
+    # cache hits only note the access time here.  They're written to the DB
+    # in batches: once there are this many, after this many seconds, or
+    # before images are evicted
+    access_times = dict()
+    access_batch_size = 64
+    access_flush_interval = 30
+    access_flushed = time.time()
 
     def __init__(self):
-        QObject.__init__(self)
 
         self.settings_folder = ComicTaggerSettings.getSettingsFolder()
         self.db_file = os.path.join(self.settings_folder, "image_url_cache.db")
         self.cache_folder = os.path.join(self.settings_folder, "image_cache")
 
-        if not os.path.exists(self.db_file):
-            self.create_image_db()
+        self.signals = None
+        self.get_db()
+
+    def getSignals(self):
+        # only the GUI's background fetches use it, so Qt is imported then
+        if self.signals is None:
+            from .qtsignals import FetcherSignals
+
+            self.signals = FetcherSignals()
+        return self.signals
+
+    @property
+    def fetchComplete(self):
+        return self.getSignals().fetchComplete
 
     def clearCache(self):
-        os.unlink(self.db_file)
-        if os.path.isdir(self.cache_folder):
-            shutil.rmtree(self.cache_folder)
+        with ImageFetcher.db_lock:
+            if ImageFetcher.db_con is not None:
+                ImageFetcher.db_con.close()
+                ImageFetcher.db_con = None
+            if os.path.exists(self.db_file):
+                os.unlink(self.db_file)
+            if os.path.isdir(self.cache_folder):
+                shutil.rmtree(self.cache_folder)
+            ImageFetcher.access_times.clear()
 
     def fetch(self, url, user_data=None, blocking=False):
         """
@@ -84,18 +104,13 @@ class ImageFetcher(QObject):
         image_data = self.get_image_from_cache(url)
         if blocking:
             if image_data is None:
-                try:
-                    print(url)
-                    image_data = requests.get(url, headers={"user-agent": "comictagger/" + ctversion.version}).content
-                except Exception as e:
-                    print(e)
-                    raise ImageFetcherException("Network Error!")
-
-            # save the image to the cache
-            self.add_image_to_cache(self.fetched_url, image_data)
+                image_data = self.download(url)
+
             return image_data
 
         else:
+            from PyQt5.QtCore import QByteArray, QUrl
+            from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
 
             # if we found it, just emit the signal asap
             if image_data is not None:
@@ -109,16 +124,88 @@ class ImageFetcher(QObject):
 
             # we'll get called back when done...
 
+    def fetch_many(self, url_list):
+        """
+        Blocking fetch of several images at once.  This is a generator that
+        yields (url, image_data) tuples in the order the images become
+        available: cached images right away, then downloads as they complete.
+        Raises ImageFetcherException if any of the downloads fail.
+        """
+
+        cached = []
+        pending = []
+        for url in dict.fromkeys(url_list):
+            image_data = self.get_image_from_cache(url)
+            if image_data is not None:
+                cached.append((url, image_data))
+            else:
+                pending.append(url)
+
+        if len(pending) == 0:
+            yield from cached
+            return
+
+        # the downloads are started first, so they run while the caller
+        # works through the cached images
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(ImageFetcher.max_workers, len(pending)))
+        futures = {pool.submit(self.download, url): url for url in pending}
+        try:
+            yield from cached
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # if a download failed, or the caller stopped early, don't start
+            # the rest, or wait for the ones in progress.  (shutdown() has no
+            # cancel_futures before Python 3.9)
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def download(self, url):
+        """Fetch the image from the net, and save it to the cache"""
+
+        try:
+            print(url)
+            image_data = utils.getHttpSession().get(url, headers={"user-agent": "comictagger/" + ctversion.version}).content
+        except Exception as e:
+            print(e)
+            raise ImageFetcherException("Network Error!")
+
+        # save the image to the cache
+        self.add_image_to_cache(url, image_data)
+        return image_data
+
     def finishRequest(self, reply):
+        from PyQt5.QtCore import QByteArray
 
         # read in the image data
         image_data = reply.readAll()
 
         # save the image to the cache
-        self.add_image_to_cache(self.fetched_url, image_data)
+        self.add_image_to_cache(self.fetched_url, bytes(image_data))
 
         self.fetchComplete.emit(QByteArray(image_data), self.user_data)
 
+    def get_db(self):
+        with ImageFetcher.db_lock:
+            if ImageFetcher.db_con is None:
+                con = None
+                if os.path.exists(self.db_file):
+                    con = lite.connect(self.db_file, check_same_thread=False)
+                    if con.execute("PRAGMA user_version").fetchone()[0] != ImageFetcher.db_version:
+                        # created by an older version, start over
+                        con.close()
+                        con = None
+                if con is None:
+                    self.create_image_db()
+                    con = lite.connect(self.db_file, check_same_thread=False)
+
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+                ImageFetcher.db_con = con
+
+            return ImageFetcher.db_con
+
     def create_image_db(self):
 
         # this will wipe out any existing version
@@ -136,45 +223,136 @@ class ImageFetcher(QObject):
 
             cur = con.cursor()
 
-            cur.execute("CREATE TABLE Images(" + "url TEXT," + "filename TEXT," + "timestamp TEXT," + "PRIMARY KEY (url))")
+            cur.execute("CREATE TABLE Images(" + "url TEXT," + "hash TEXT," + "timestamp TEXT," + "PRIMARY KEY (url))")
+            cur.execute("CREATE INDEX ImagesByHash ON Images(hash)")
 
-    def add_image_to_cache(self, url, image_data):
+            cur.execute("CREATE TABLE Blobs(" + "hash TEXT," + "size INT," + "last_access REAL," + "PRIMARY KEY (hash))")
+            cur.execute("CREATE INDEX BlobsByAccess ON Blobs(last_access)")
 
-        con = lite.connect(self.db_file)
+            # perceptual hashes of the stored images, so covers only need
+            # to be decoded once per hashing algorithm
+            cur.execute(
+                "CREATE TABLE Hashes("
+                + "hash TEXT,"
+                + "algorithm TEXT,"
+                + "size TEXT,"
+                + "value TEXT,"
+                + "PRIMARY KEY (hash, algorithm, size))"
+            )
 
-        with con:
-
-            cur = con.cursor()
+            cur.execute("PRAGMA user_version = {0}".format(ImageFetcher.db_version))
 
-            timestamp = datetime.datetime.now()
+        con.close()
 
-            tmp_fd, filename = tempfile.mkstemp(dir=self.cache_folder, prefix="img")
-            f = os.fdopen(tmp_fd, "w+b")
-            f.write(image_data)
-            f.close()
+    def get_blob_path(self, digest):
+        return os.path.join(self.cache_folder, digest[0:2], digest[2:4], digest)
 
-            cur.execute("INSERT or REPLACE INTO Images VALUES(?, ?, ?)", (url, filename, timestamp))
+    def add_image_to_cache(self, url, image_data):
+        """Store the image under its content hash, and point the URL at it"""
+
+        digest = hashlib.blake2b(image_data, digest_size=16).hexdigest()
+        path = self.get_blob_path(digest)
+
+        timestamp = datetime.datetime.now()
+
+        # the image is checked for, and stored, under the lock, so evict()
+        # can't remove it before the URL points at it
+        with ImageFetcher.db_lock:
+            # identical content fetched from another URL is only stored once
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(path), prefix="tmp")
+                with os.fdopen(tmp_fd, "w+b") as f:
+                    f.write(image_data)
+                os.replace(tmp_name, path)
+
+            con = self.get_db()
+            with con:
+                cur = con.cursor()
+                cur.execute("INSERT or REPLACE INTO Blobs VALUES(?, ?, ?)", (digest, len(image_data), time.time()))
+                cur.execute("INSERT or REPLACE INTO Images VALUES(?, ?, ?)", (url, digest, timestamp))
+                self.evict(cur)
+
+        return digest
+
+    def evict(self, cur):
+        """Remove least recently used images until the store fits in max_cache_size"""
+
+        total = cur.execute("SELECT SUM(size) FROM Blobs").fetchone()[0] or 0
+        if total <= ImageFetcher.max_cache_size:
+            return
+
+        # so the images that were just used are kept
+        self.flush_access_times(cur)
+
+        cur.execute("SELECT hash,size FROM Blobs ORDER BY last_access")
+        for digest, size in cur.fetchall():
+            if total <= ImageFetcher.max_cache_size:
+                break
+            try:
+                os.unlink(self.get_blob_path(digest))
+            except OSError:
+                pass
+            cur.execute("DELETE FROM Blobs WHERE hash=?", [digest])
+            cur.execute("DELETE FROM Images WHERE hash=?", [digest])
+            cur.execute("DELETE FROM Hashes WHERE hash=?", [digest])
+            total -= size
 
     def get_image_from_cache(self, url):
 
-        con = lite.connect(self.db_file)
-        with con:
-            cur = con.cursor()
-
-            cur.execute("SELECT filename FROM Images WHERE url=?", [url])
-            row = cur.fetchone()
-
-            if row is None:
-                return None
-            else:
-                filename = row[0]
-                image_data = None
-
-                try:
-                    with open(filename, "rb") as f:
-                        image_data = f.read()
-                        f.close()
-                except IOError as e:
-                    pass
-
-                return image_data
+        with ImageFetcher.db_lock:
+            con = self.get_db()
+            row = con.execute("SELECT hash FROM Images WHERE url=?", [url]).fetchone()
+
+        if row is None:
+            return None
+
+        digest = row[0]
+        try:
+            with open(self.get_blob_path(digest), "rb") as f:
+                image_data = f.read()
+        except IOError as e:
+            return None
+
+        # mark as recently used
+        now = time.time()
+        with ImageFetcher.db_lock:
+            ImageFetcher.access_times[digest] = now
+            if len(ImageFetcher.access_times) >= ImageFetcher.access_batch_size or now - ImageFetcher.access_flushed > ImageFetcher.access_flush_interval:
+                with con:
+                    self.flush_access_times(con.cursor())
+
+        return image_data
+
+    def flush_access_times(self, cur):
+        """Write the noted access times to the DB.  Call with db_lock held"""
+
+        cur.executemany("UPDATE Blobs SET last_access=? WHERE hash=?", [(t, digest) for digest, t in ImageFetcher.access_times.items()])
+        ImageFetcher.access_times.clear()
+        ImageFetcher.access_flushed = time.time()
+
+    def get_hash_from_cache(self, url, algorithm, size):
+        """Return the stored image hash for the URL as an int, or None"""
+
+        with ImageFetcher.db_lock:
+            con = self.get_db()
+            row = con.execute(
+                "SELECT Hashes.value FROM Images JOIN Hashes ON Images.hash = Hashes.hash "
+                + "WHERE Images.url=? AND Hashes.algorithm=? AND Hashes.size=?",
+                (url, algorithm, size),
+            ).fetchone()
+
+        if row is None:
+            return None
+        return int(row[0], 16)
+
+    def add_hash_to_cache(self, url, algorithm, size, value):
+        """Remember the image hash for the content currently stored for the URL"""
+
+        with ImageFetcher.db_lock:
+            con = self.get_db()
+            with con:
+                row = con.execute("SELECT hash FROM Images WHERE url=?", [url]).fetchone()
+                if row is None:
+                    return
+                con.execute("INSERT or REPLACE INTO Hashes VALUES(?, ?, ?, ?)", (row[0], algorithm, size, "{0:x}".format(value)))
@@ -26,8 +26,24 @@ try:
 except ImportError:
     pil_available = False
 
+try:
+    import numpy as np
+
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
 
 class ImageHasher(object):
+
+    # bump this when a change gives different hash values for the same image
+    # (version 2 decodes JPEG drafts), so stored hashes aren't compared with
+    # new ones
+    version = 2
+
+    # scripts/hash_bench.py turns this off to time full decodes
+    use_draft = True
+
     def __init__(self, path=None, data=None, width=8, height=8):
         # self.hash_size = size
         self.width = width
@@ -46,9 +62,110 @@ class ImageHasher(object):
                 # just generate a bogus image
                 self.image = Image.new("L", (1, 1))
 
+    # Each hash is done in two steps: shrink the image to a small grayscale
+    # pixel array, then turn the array into bits.  The second step works on a
+    # whole stack of arrays at once, which is what hash_many() relies on.
+    # Bit i of a hash always comes from the i-th value, in row order.
+
+    def shrink(self, width, height):
+        # JPEGs can be decoded straight to grayscale at 1/2, 1/4 or 1/8 scale,
+        # which is far cheaper than decoding the whole page just to throw
+        # nearly all of it away.  Other formats ignore the draft request and
+        # get fully decoded.
+        if self.use_draft:
+            self.image.draft("L", (width, height))
+        return self.image.resize((width, height), Image.LANCZOS).convert("L")
+
+    def get_pixels(self, width, height):
+        """Return the image as a height x width grayscale array, or None"""
+        try:
+            image = self.shrink(width, height)
+        except Exception as e:
+            print("hash error:", e)
+            return None
+
+        return np.asarray(image, dtype=np.float64)
+
+    @staticmethod
+    def bits_to_int(bits):
+        # the little bit order keeps bit i of the result equal to bits[i]
+        return int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little")
+
+    @staticmethod
+    def average_bits(pixels):
+        flat = pixels.reshape(pixels.shape[:-2] + (-1,))
+        return flat > flat.mean(axis=-1, keepdims=True)
+
+    @staticmethod
+    def difference_bits(pixels):
+        # compare each pixel to its right hand neighbor
+        diff = pixels[..., :, 1:] > pixels[..., :, :-1]
+        return diff.reshape(diff.shape[:-2] + (-1,))
+
+    @staticmethod
+    def laplacian_bits(pixels):
+        # 3x3 laplacian filter, mirroring the image at the edges
+        pad = [(0, 0)] * (pixels.ndim - 2) + [(1, 1), (1, 1)]
+        p = np.pad(pixels, pad, mode="symmetric")
+        filt = p[..., :-2, 1:-1] + p[..., 2:, 1:-1] + p[..., 1:-1, :-2] + p[..., 1:-1, 2:] - 4 * p[..., 1:-1, 1:-1]
+        filt = filt.reshape(filt.shape[:-2] + (-1,))
+        return filt >= 0
+
+    @staticmethod
+    def dct_matrix(n):
+        # orthonormal DCT-II basis, so that dct(x) = M @ x @ M.T
+        k = np.arange(n).reshape(-1, 1)
+        m = np.cos(np.pi * (2 * np.arange(n) + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+        m[0] /= np.sqrt(2.0)
+        return m
+
+    def dct_bits(self, pixels):
+        m = self.dct_matrix(pixels.shape[-1])
+        dct = m @ pixels @ m.T
+
+        # keep the lowest frequencies, skipping the DC term's row and column
+        lofreq = dct[..., 1 : self.height + 1, 1 : self.width + 1]
+        return self.average_bits(lofreq)
+
+    # the (width, height) to shrink the image to, and the bit function for
+    # each hash method
+    def hash_params(self, method):
+        if method == "average_hash" or method == "average_hash2":
+            size = (self.width, self.height)
+        elif method == "difference_hash":
+            size = (self.width + 1, self.height)
+        elif method == "dct_average_hash":
+            # DCT needs a square image, 4 times the size of the hash
+            side = 4 * max(self.width, self.height)
+            size = (side, side)
+        else:
+            raise ValueError("Unknown hash method: {0}".format(method))
+
+        bits = {
+            "average_hash": self.average_bits,
+            "average_hash2": self.laplacian_bits,
+            "difference_hash": self.difference_bits,
+            "dct_average_hash": self.dct_bits,
+        }[method]
+
+        return size, bits
+
+    def calc_hash(self, method):
+        size, bits = self.hash_params(method)
+        pixels = self.get_pixels(*size)
+        if pixels is None:
+            return int(0)
+        return self.bits_to_int(bits(pixels))
+
     def average_hash(self):
+        if not numpy_available:
+            return self.average_hash_py()
+        return self.calc_hash("average_hash")
+
+    def average_hash_py(self):
+        # plain python version, for when numpy is missing
         try:
-            image = self.image.resize((self.width, self.height), Image.ANTIALIAS).convert("L")
+            image = self.shrink(self.width, self.height)
         except Exception as e:
             print("average_hash error:", e)
             return int(0)
@@ -72,29 +189,15 @@ class ImageHasher(object):
         return result
 
     def average_hash2(self):
-        pass
-        """
-        # Got this one from somewhere on the net.  Not a clue how the 'convolve2d'
-        # works!
-
-        from numpy import array
-        from scipy.signal import convolve2d
-
-        im = self.image.resize((self.width, self.height), Image.ANTIALIAS).convert('L')
-
-        in_data = array((im.getdata())).reshape(self.width, self.height)
-        filt = array([[0,1,0],[1,-4,1],[0,1,0]])
-        filt_data = convolve2d(in_data,filt,mode='same',boundary='symm').flatten()
+        # sign of a laplacian filter of the image, which picks up edges rather
+        # than overall brightness
+        return self.calc_hash("average_hash2")
 
-        result = reduce(lambda x, (y, z): x | (z << y),
-                         enumerate(map(lambda i: 0 if i < 0 else 1, filt_data)),
-                         0)
-        #print("{0:016x}".format(result))
-        return result
-        """
+    def difference_hash(self):
+        # horizontal gradient of the image
+        return self.calc_hash("difference_hash")
 
     def dct_average_hash(self):
-        pass
         """
         # Algorithm source: http://syntaxcandy.blogspot.com/2012/08/perceptual-hash.html
 
@@ -133,59 +236,105 @@ class ImageHasher(object):
         7. Construct the hash. Set the 64 bits into a 64-bit integer. The order does not
         matter, just as long as you are consistent.
         """
-        """
-        import numpy
-        import scipy.fftpack
-        numpy.set_printoptions(threshold=10000, linewidth=200, precision=2, suppress=True)
-
-        # Step 1,2
-        im = self.image.resize((32, 32), Image.ANTIALIAS).convert("L")
-        in_data = numpy.asarray(im)
-
-        # Step 3
-        dct = scipy.fftpack.dct(in_data.astype(float))
-
-        # Step 4
-        # Just skip the top and left rows when slicing, as suggested somewhere else...
-        lofreq_dct = dct[1:9, 1:9].flatten()
-
-        # Step 5
-        avg = (lofreq_dct.sum()) / (lofreq_dct.size)
-        median = numpy.median(lofreq_dct)
-
-        thresh = avg
+        return self.calc_hash("dct_average_hash")
 
-        # Step 6
-        def compare_value_to_thresh(i):
-            return (1 if i > thresh else 0)
+    @staticmethod
+    def hash_many(data_list, method="average_hash", width=8, height=8):
+        """
+        Hash a list of image data blobs with the named method, returning a
+        list of ints in the same order.  The images are decoded one at a time,
+        but the hashing itself is done on all of them at once.
+        """
 
-        bitlist = map(compare_value_to_thresh, lofreq_dct)
+        if len(data_list) == 0:
+            return []
 
-        #Step 7
-        def set_bit(x, (idx, val)):
-            return (x | (val << idx))
+        hashers = [ImageHasher(data=data, width=width, height=height) for data in data_list]
+        if not numpy_available:
+            return [getattr(hasher, method)() for hasher in hashers]
 
-        result = reduce(set_bit, enumerate(bitlist), long(0))
+        size, bits = hashers[0].hash_params(method)
 
+        stack = np.zeros((len(hashers), size[1], size[0]))
+        failed = []
+        for i, hasher in enumerate(hashers):
+            pixels = hasher.get_pixels(*size)
+            if pixels is None:
+                failed.append(i)
+            else:
+                stack[i] = pixels
 
-        #print("{0:016x}".format(result))
+        result = [ImageHasher.bits_to_int(row) for row in bits(stack)]
+        for i in failed:
+            result[i] = int(0)
         return result
-        """
 
     # accepts 2 hashes (longs or hex strings) and returns the hamming distance
 
     @staticmethod
     def hamming_distance(h1, h2):
-        if isinstance(h1, int) or isinstance(h1, int):
+        if isinstance(h1, int) and isinstance(h2, int):
             n1 = h1
             n2 = h2
         else:
             # convert hex strings to ints
-            n1 = int(h1, 16)
-            n2 = int(h2, 16)
+            n1 = ImageHasher.hash_to_int(h1)
+            n2 = ImageHasher.hash_to_int(h2)
+
+        # xor the two numbers, and count up the 1's
+        return popcount(n1 ^ n2)
+
+    @staticmethod
+    def hash_to_int(h):
+        if isinstance(h, int):
+            return h
+        return int(h, 16)
+
+    @staticmethod
+    def hash_array(hashes, words):
+        """Pack a list of hashes into an (n, words) uint64 array"""
+        data = b"".join(ImageHasher.hash_to_int(h).to_bytes(words * 8, "little") for h in hashes)
+        return np.frombuffer(data, dtype="<u8").reshape(len(hashes), words)
+
+    @staticmethod
+    def hamming_matrix(hashes1, hashes2, bits=64):
+        """
+        Returns the len(hashes1) x len(hashes2) matrix of hamming distances
+        between every pair of hashes, as a NumPy array.  Hashes longer than 64
+        bits (e.g. 12x12 average hashes) need the bits argument.
+        """
+
+        if not numpy_available:
+            return [[ImageHasher.hamming_distance(h1, h2) for h2 in hashes2] for h1 in hashes1]
+
+        words = (bits + 63) // 64
+        a1 = ImageHasher.hash_array(hashes1, words)
+        a2 = ImageHasher.hash_array(hashes2, words)
+
+        return ImageHasher.bit_counts(a1[:, np.newaxis, :] ^ a2[np.newaxis, :, :]).sum(axis=-1, dtype=np.int64)
+
+    @staticmethod
+    def hamming_matrix_pairs(a1, a2):
+        """Element-wise hamming distances between two equal length uint64 arrays"""
+        return ImageHasher.bit_counts(np.bitwise_xor(a1, a2)).astype(np.int64)
+
+    @staticmethod
+    def bit_counts(x):
+        # number of set bits in each element of a uint64 array
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(x)
+        x = np.ascontiguousarray(x, dtype=np.uint64)
+        return popcount_table[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:
+
+    def popcount(n):
+        return bin(n).count("1")
 
-        # xor the two numbers
-        n = n1 ^ n2
 
-        # count up the 1's in the binary string
-        return sum(b == "1" for b in bin(n)[2:])
+if numpy_available:
+    # number of set bits in each possible byte
+    popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
@@ -18,10 +18,12 @@ import io
 import sys
 
 from . import utils
+from .comicvinecacher import ComicVineCacher
 from .comicvinetalker import ComicVineTalker, ComicVineTalkerException
 from .genericmetadata import GenericMetadata
+from .hashindex import HashIndex
 from .imagefetcher import ImageFetcher, ImageFetcherException
-from .imagehasher import ImageHasher
+from .imagehasher import ImageHasher, numpy_available
 from .issuestring import IssueString
 
 try:
@@ -54,6 +56,10 @@ class IssueIdentifier:
     ResultOneGoodMatch = 4
     ResultMultipleGoodMatches = 5
 
+    # index of the hashes of every Comic Vine cover seen so far, for each
+    # hash algorithm.  Loaded from the CV cache on first use.
+    local_cover_index = dict()
+
     def __init__(self, comic_archive, settings):
         self.comic_archive = comic_archive
         self.image_hasher = 1
@@ -90,6 +96,13 @@ class IssueIdentifier:
         self.cancel = False
         self.waitAndRetryOnRateLimit = False
 
+        # hashes of the remote cover images seen so far, keyed by URL
+        self.remote_cover_hashes = dict()
+
+        # look for a strong cover match in the local cover index before
+        # searching Comic Vine
+        self.useLocalCoverIndex = True
+
     def setScoreMinThreshold(self, thresh):
         self.min_score_thresh = thresh
 
@@ -106,15 +119,23 @@ class IssueIdentifier:
         self.publisher_blacklist = blacklist
 
     def setHasherAlgorithm(self, algo):
+        if str(algo) != "1" and not numpy_available:
+            print("NumPy is not available, falling back to the average hash", file=sys.stderr)
+            algo = "1"
         self.image_hasher = algo
         pass
 
+    def setUseLocalCoverIndex(self, use):
+        self.useLocalCoverIndex = use
+
     def setOutputFunction(self, func):
         self.output_function = func
         pass
 
     def calculateHash(self, image_data):
-        if self.image_hasher == "3":
+        if self.image_hasher == "4":
+            return ImageHasher(data=image_data).difference_hash()
+        elif self.image_hasher == "3":
             return ImageHasher(data=image_data).dct_average_hash()
         elif self.image_hasher == "2":
             return ImageHasher(data=image_data).average_hash2()
@@ -243,63 +264,36 @@ class IssueIdentifier:
         # localHashes is a list of pre-calculated hashs.
         # useRemoteAlternates - indicates to use alternate covers from CV
 
-        try:
-            url_image_data = ImageFetcher().fetch(primary_thumb_url, blocking=True)
-        except ImageFetcherException:
-            self.log_msg("Network issue while fetching cover image from Comic Vine. Aborting...")
-            raise IssueIdentifierNetworkError
-
-        if self.cancel:
-            raise IssueIdentifierCancelled
-
-        # alert the GUI, if needed
-        if self.coverUrlCallback is not None:
-            self.coverUrlCallback(url_image_data)
+        self.fetchRemoteCoverHashes([primary_thumb_url])
 
         remote_cover_list = []
         item = dict()
         item["url"] = primary_img_url
-
-        item["hash"] = self.calculateHash(url_image_data)
+        item["hash"] = self.remote_cover_hashes[primary_thumb_url]
         remote_cover_list.append(item)
 
-        if self.cancel:
-            raise IssueIdentifierCancelled
-
         if useRemoteAlternates:
             alt_img_url_list = comicVine.fetchAlternateCoverURLs(issue_id, page_url)
+            self.fetchRemoteCoverHashes(alt_img_url_list)
             for alt_url in alt_img_url_list:
-                try:
-                    alt_url_image_data = ImageFetcher().fetch(alt_url, blocking=True)
-                except ImageFetcherException:
-                    self.log_msg("Network issue while fetching alt. cover image from Comic Vine. Aborting...")
-                    raise IssueIdentifierNetworkError
-
-                if self.cancel:
-                    raise IssueIdentifierCancelled
-
-                # alert the GUI, if needed
-                if self.coverUrlCallback is not None:
-                    self.coverUrlCallback(alt_url_image_data)
-
                 item = dict()
                 item["url"] = alt_url
-                item["hash"] = self.calculateHash(alt_url_image_data)
+                item["hash"] = self.remote_cover_hashes[alt_url]
                 remote_cover_list.append(item)
 
-                if self.cancel:
-                    raise IssueIdentifierCancelled
-
         if useLog and useRemoteAlternates:
             self.log_msg("[{0} alt. covers]".format(len(remote_cover_list) - 1), False)
         if useLog:
             self.log_msg("[ ", False)
 
+        # score every local cover against every remote one in one go
+        score_matrix = ImageHasher.hamming_matrix(localCoverHashList, [item["hash"] for item in remote_cover_list])
+
         score_list = []
         done = False
-        for local_cover_hash in localCoverHashList:
-            for remote_cover_item in remote_cover_list:
-                score = ImageHasher.hamming_distance(local_cover_hash, remote_cover_item["hash"])
+        for i, local_cover_hash in enumerate(localCoverHashList):
+            for j, remote_cover_item in enumerate(remote_cover_list):
+                score = int(score_matrix[i][j])
                 score_item = dict()
                 score_item["score"] = score
                 score_item["url"] = remote_cover_item["url"]
@@ -323,6 +317,166 @@ class IssueIdentifier:
 
         return best_score_item
 
+    def getHashKey(self):
+        """The (algorithm, size) pair that identifies hashes from calculateHash()"""
+        return "{0}v{1}".format(self.image_hasher, ImageHasher.version), "8x8"
+
+    def fetchRemoteCoverHashes(self, url_list):
+        """Fetch the given cover images concurrently, hashing each one as it arrives"""
+
+        fetcher = ImageFetcher()
+        algorithm, size = self.getHashKey()
+
+        url_list = [url for url in url_list if url not in self.remote_cover_hashes]
+
+        # covers hashed in an earlier run don't need to be decoded again, or
+        # even read from the cache, unless the GUI wants to show them
+        if self.coverUrlCallback is None:
+            for url in url_list:
+                image_hash = fetcher.get_hash_from_cache(url, algorithm, size)
+                if image_hash is not None:
+                    self.remote_cover_hashes[url] = image_hash
+            url_list = [url for url in url_list if url not in self.remote_cover_hashes]
+
+        try:
+            for url, image_data in fetcher.fetch_many(url_list):
+                if self.cancel:
+                    raise IssueIdentifierCancelled
+
+                # alert the GUI, if needed
+                if self.coverUrlCallback is not None:
+                    self.coverUrlCallback(image_data)
+
+                image_hash = fetcher.get_hash_from_cache(url, algorithm, size)
+                if image_hash is None:
+                    image_hash = self.calculateHash(image_data)
+                    if image_hash is not None:
+                        fetcher.add_hash_to_cache(url, algorithm, size, image_hash)
+                self.remote_cover_hashes[url] = image_hash
+        except ImageFetcherException:
+            self.log_msg("Network issue while fetching cover images from Comic Vine. Aborting...")
+            raise IssueIdentifierNetworkError
+
+        if self.cancel:
+            raise IssueIdentifierCancelled
+
+    def makeMatch(self, series, issue, issue_number):
+        day, month, year = ComicVineTalker().parseDateStr(issue["cover_date"])
+
+        match = dict()
+        match["series"] = "{0} ({1})".format(series["name"], series["start_year"])
+        match["distance"] = None
+        match["issue_number"] = issue_number
+        match["cv_issue_count"] = series["count_of_issues"]
+        match["url_image_hash"] = None
+        match["issue_title"] = issue["name"]
+        match["issue_id"] = issue["id"]
+        match["volume_id"] = series["id"]
+        match["month"] = month
+        match["year"] = year
+        match["publisher"] = None
+        if series["publisher"] is not None:
+            match["publisher"] = series["publisher"]["name"]
+        match["image_url"] = issue["image"]["super_url"]
+        match["thumb_url"] = issue["image"]["thumb_url"]
+        match["page_url"] = issue["site_detail_url"]
+        match["description"] = issue["description"]
+
+        return match
+
+    def getLocalCoverIndex(self):
+        algorithm, size = self.getHashKey()
+        index = IssueIdentifier.local_cover_index.get(algorithm)
+        if index is None:
+            index = HashIndex()
+            for url, image_hash in ComicVineCacher().get_cover_hashes(algorithm):
+                index.add(url, image_hash)
+            IssueIdentifier.local_cover_index[algorithm] = index
+        return index
+
+    def addToLocalCoverIndex(self, cover_list):
+        """cover_list is a list of (url, match) tuples, for covers that have already been hashed"""
+
+        algorithm, size = self.getHashKey()
+        index = self.getLocalCoverIndex()
+
+        new_covers = []
+        for url, match in cover_list:
+            image_hash = self.remote_cover_hashes.get(url)
+            if image_hash is None:
+                continue
+            match = dict(match)
+            match["distance"] = None
+            match["url_image_hash"] = None
+            new_covers.append((url, image_hash, match))
+            index.add(url, image_hash)
+
+        if len(new_covers) > 0:
+            ComicVineCacher().add_cover_hashes(algorithm, new_covers)
+
+    def indexCachedCovers(self):
+        """
+        Add the covers of all issues in the CV cache to the local cover index.
+        Only images already in the image cache are used, so this doesn't go
+        online.
+        """
+
+        fetcher = ImageFetcher()
+        algorithm, size = self.getHashKey()
+        index = self.getLocalCoverIndex()
+
+        cover_list = []
+        for series, issue in ComicVineCacher().get_cached_issue_covers():
+            url = issue["image"]["thumb_url"]
+            if url in index.hashes:
+                continue
+
+            image_hash = fetcher.get_hash_from_cache(url, algorithm, size)
+            if image_hash is None:
+                image_data = fetcher.get_image_from_cache(url)
+                if image_data is None:
+                    continue
+                image_hash = self.calculateHash(image_data)
+                fetcher.add_hash_to_cache(url, algorithm, size, image_hash)
+
+            self.remote_cover_hashes[url] = image_hash
+            cover_list.append((url, self.makeMatch(series, issue, IssueString(issue["issue_number"]).asString())))
+
+        self.addToLocalCoverIndex(cover_list)
+        return len(cover_list)
+
+    def searchLocalCoverIndex(self, hash_list, issue_number):
+        """Returns the match for a cover that is almost certainly the same image, or None"""
+
+        index = self.getLocalCoverIndex()
+
+        hits = dict()
+        for local_hash in hash_list:
+            for url, distance in index.query(local_hash, self.strong_score_thresh):
+                if url not in hits or distance < hits[url]:
+                    hits[url] = distance
+
+        if len(hits) == 0:
+            return None
+
+        algorithm, size = self.getHashKey()
+        best = dict()
+        for url, match in ComicVineCacher().get_cover_hash_matches(algorithm, hits.keys()).items():
+            # the same cover can turn up on other issues (e.g. a trade), so
+            # only trust it for the issue we're looking for
+            if issue_number is not None and match["issue_number"] != issue_number:
+                continue
+            if match["issue_id"] not in best or hits[url] < best[match["issue_id"]]["distance"]:
+                match["distance"] = hits[url]
+                match["url_image_hash"] = index.hashes[url]
+                best[match["issue_id"]] = match
+
+        # more than one issue with the same cover is for the full search to sort out
+        if len(best) != 1:
+            return None
+
+        return list(best.values())[0]
+
     # def validate(self, issue_id):
     # create hash list
     #    score = self.getIssueMatchScore(issue_id, hash_list, useRemoteAlternates = True)
@@ -380,6 +534,29 @@ class IssueIdentifier:
         if keys["month"] is not None:
             self.log_msg("\tMonth:  " + str(keys["month"]))
 
+        if self.useLocalCoverIndex:
+            hash_list = [cover_hash]
+            if narrow_cover_hash is not None:
+                hash_list.append(narrow_cover_hash)
+            local_match = self.searchLocalCoverIndex(hash_list, keys["issue_number"])
+            if local_match is not None:
+                self.log_msg("Found a strong match in the local cover index")
+                self.match_list = [local_match]
+                self.log_msg("--------------------------------------------------------------------------")
+                self.log_msg(
+                    "-----> {0} #{1} {2} ({3}/{4}) -- score: {5}".format(
+                        local_match["series"],
+                        local_match["issue_number"],
+                        local_match["issue_title"],
+                        local_match["month"],
+                        local_match["year"],
+                        local_match["distance"],
+                    )
+                )
+                self.log_msg("--------------------------------------------------------------------------")
+                self.search_result = self.ResultOneGoodMatch
+                return self.match_list
+
         # self.log_msg("Publisher Blacklist: " + str(self.publisher_blacklist))
         comicVine = ComicVineTalker()
         comicVine.wait_for_rate_limit = self.waitAndRetryOnRateLimit
@@ -467,6 +644,13 @@ class IssueIdentifier:
             self.log_msg("Found {0} series that have an issue #{1} from {2}".format(len(shortlist), keys["issue_number"], keys["year"]))
 
         # now we have a shortlist of volumes with the desired issue number
+        # Get all of the primary covers in one go, so the downloads overlap
+        try:
+            self.fetchRemoteCoverHashes([issue["image"]["thumb_url"] for series, issue in shortlist])
+        except:
+            self.match_list = []
+            return self.match_list
+
         # Do first round of cover matching
         counter = len(shortlist)
         for series, issue in shortlist:
@@ -476,44 +660,25 @@ class IssueIdentifier:
 
             self.log_msg("Examining covers for  ID: {0} {1} ({2}) ...".format(series["id"], series["name"], series["start_year"]), newline=False)
 
-            # parse out the cover date
-            day, month, year = comicVine.parseDateStr(issue["cover_date"])
-
             # Now check the cover match against the primary image
             hash_list = [cover_hash]
             if narrow_cover_hash is not None:
                 hash_list.append(narrow_cover_hash)
 
+            match = self.makeMatch(series, issue, keys["issue_number"])
             try:
-                image_url = issue["image"]["super_url"]
-                thumb_url = issue["image"]["thumb_url"]
-                page_url = issue["site_detail_url"]
-
                 score_item = self.getIssueCoverMatchScore(
-                    comicVine, issue["id"], image_url, thumb_url, page_url, hash_list, useRemoteAlternates=False
+                    comicVine, issue["id"], match["image_url"], match["thumb_url"], match["page_url"], hash_list, useRemoteAlternates=False
                 )
             except:
                 self.match_list = []
                 return self.match_list
 
-            match = dict()
-            match["series"] = "{0} ({1})".format(series["name"], series["start_year"])
             match["distance"] = score_item["score"]
-            match["issue_number"] = keys["issue_number"]
-            match["cv_issue_count"] = series["count_of_issues"]
             match["url_image_hash"] = score_item["hash"]
-            match["issue_title"] = issue["name"]
-            match["issue_id"] = issue["id"]
-            match["volume_id"] = series["id"]
-            match["month"] = month
-            match["year"] = year
-            match["publisher"] = None
-            if series["publisher"] is not None:
-                match["publisher"] = series["publisher"]["name"]
-            match["image_url"] = image_url
-            match["thumb_url"] = thumb_url
-            match["page_url"] = page_url
-            match["description"] = issue["description"]
+
+            # remember the cover, for identifying other copies of this issue
+            self.addToLocalCoverIndex([(match["thumb_url"], match)])
 
             self.match_list.append(match)
 
@@ -558,6 +723,18 @@ class IssueIdentifier:
                 page_hash = self.calculateHash(image_data)
                 hash_list.append(page_hash)
 
+            # fetch all of the alternate covers up front, so the downloads overlap
+            try:
+                alt_cover_list = []
+                for m in self.match_list:
+                    for alt_url in comicVine.fetchAlternateCoverURLs(m["issue_id"], m["page_url"]):
+                        alt_cover_list.append((alt_url, m))
+                self.fetchRemoteCoverHashes([alt_url for alt_url, m in alt_cover_list])
+            except:
+                self.match_list = []
+                return self.match_list
+            self.addToLocalCoverIndex(alt_cover_list)
+
             second_match_list = []
             counter = 2 * len(self.match_list)
             for m in self.match_list:
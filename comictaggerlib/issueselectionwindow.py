@@ -24,7 +24,7 @@ from comictaggerlib.ui.qtutils import reduceWidgetFontSize
 
 from .comicvinetalker import ComicVineTalker, ComicVineTalkerException
 from .coverimagewidget import CoverImageWidget
-from .issuestring import IssueString
+from .issuestring import cachedIssueString
 from .settings import ComicTaggerSettings
 
 # from PyQt5.QtCore import QUrl, pyqtSignal, QByteArray
@@ -39,7 +39,7 @@ class IssueNumberTableWidgetItem(QtWidgets.QTableWidgetItem):
     def __lt__(self, other):
         selfStr = self.data(QtCore.Qt.DisplayRole)
         otherStr = other.data(QtCore.Qt.DisplayRole)
-        return IssueString(selfStr).asFloat() < IssueString(otherStr).asFloat()
+        return cachedIssueString(selfStr).sort_key < cachedIssueString(otherStr).sort_key
 
 
 class IssueSelectionWindow(QtWidgets.QDialog):
@@ -109,6 +109,7 @@ class IssueSelectionWindow(QtWidgets.QDialog):
 
         self.twList.setSortingEnabled(False)
 
+        issue_key = cachedIssueString(self.issue_number).asKey()
         row = 0
         for record in self.issue_list:
             self.twList.insertRow(row)
@@ -142,7 +143,7 @@ class IssueSelectionWindow(QtWidgets.QDialog):
             item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
             self.twList.setItem(row, 2, item)
 
-            if IssueString(record["issue_number"]).asString().lower() == IssueString(self.issue_number).asString().lower():
+            if cachedIssueString(record["issue_number"]).asKey() == issue_key:
                 self.initial_id = record["id"]
 
             row += 1
@@ -21,25 +21,32 @@ import sys
 import traceback
 
 from . import cli, utils
-from .comicvinetalker import ComicVineTalker
 from .options import Options
 from .settings import ComicTaggerSettings
 
 # Need to load setting before anything else
 SETTINGS = ComicTaggerSettings()
 
-try:
-    qt_available = True
-    from PyQt5 import QtCore, QtGui, QtWidgets
-    from .taggerwindow import TaggerWindow
-except ImportError as e:
-    qt_available = False
+# Qt, and the Comic Vine and image fetching modules, take most of the start
+# up time, so they're only imported once it's known that they're needed
 
 
 def ctmain():
     opts = Options()
     opts.parseCmdLineArgs()
 
+    if opts.use_server:
+        from . import server
+
+        try:
+            response = server.send_command(opts.server_address, sys.argv[1:], os.getcwd())
+        except OSError as e:
+            print("Can't connect to the server: {0}".format(e), file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.write(response["stdout"])
+        sys.stderr.write(response["stderr"])
+        sys.exit(response["code"])
+
     # manage the CV API key
     if opts.cv_api_key:
         if opts.cv_api_key != SETTINGS.cv_api_key:
@@ -49,17 +56,32 @@ def ctmain():
         print("Key set")
         return
 
-    ComicVineTalker.api_key = SETTINGS.cv_api_key
+    # extra imprints, if the user has a map of them
+    for name in ["publishers.json", "publishers.toml"]:
+        publisher_file = os.path.join(ComicTaggerSettings.getSettingsFolder(), name)
+        if os.path.exists(publisher_file):
+            utils.loadPublisherFile(publisher_file)
+
+    if opts.serve:
+        from . import server
+
+        server.serve(SETTINGS, opts.server_address)
+        return
 
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    if not qt_available and not opts.no_gui:
-        opts.no_gui = True
-        print("PyQt5 is not available.  ComicTagger is limited to command-line mode.", file=sys.stderr)
+    if not opts.no_gui:
+        try:
+            from PyQt5 import QtCore, QtGui, QtWidgets
+            from .taggerwindow import TaggerWindow
+        except ImportError as e:
+            opts.no_gui = True
+            print("PyQt5 is not available.  ComicTagger is limited to command-line mode.", file=sys.stderr)
 
     if opts.no_gui:
         cli.cli_mode(opts, SETTINGS)
     else:
+        cli.online_setup(SETTINGS)
 
         os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
 
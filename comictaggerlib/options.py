@@ -23,7 +23,6 @@ import traceback
 from . import ctversion, utils
 from .comicarchive import MetaDataStyle
 from .genericmetadata import GenericMetadata
-from .versionchecker import VersionChecker
 
 try:
     import argparse
@@ -97,6 +96,14 @@ If no options are given, {0} will run in windowed mode.
     --only-set-cv-key       Only set the Comic Vine API key and quit.
 -w, --wait-on-cv-rate-limit When encountering a Comic Vine rate limit
                             error, wait and retry query.
+    --serve                 Run as a server, doing the commands sent to
+                            it with --use-server.  Starting up, and the
+                            caches, are then shared by all the commands.
+    --use-server            Send the command to a running server, rather
+                            than doing it here.
+    --socket=ADDRESS        The server's socket file, or HOST:PORT for a
+                            TCP socket on a loopback address (relevant
+                            for --serve and --use-server).
 -v, --verbose               Be noisy when doing what it does.
     --terse                 Don't say much (for print mode).
     --version               Display version.
@@ -137,6 +144,9 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
         self.script = None
         self.wait_and_retry_on_rate_limit = False
         self.assume_issue_is_one_if_not_set = False
+        self.serve = False
+        self.use_server = False
+        self.server_address = None
         self.file_list = []
 
     def display_msg_and_quit(self, msg, code, show_help=False):
@@ -236,9 +246,13 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
 
         sys.exit(0)
 
-    def parseCmdLineArgs(self):
+    def parseCmdLineArgs(self, input_args=None, cwd=None):
+        """Parses the given arguments, or the command line's.  Relative file
+        names are taken to be in cwd, if it's given"""
 
-        if platform.system() == "Darwin" and hasattr(sys, "frozen") and sys.frozen == 1:
+        if input_args is not None:
+            input_args = list(input_args)
+        elif platform.system() == "Darwin" and hasattr(sys, "frozen") and sys.frozen == 1:
             # remove the PSN ("process serial number") argument from OS/X
             input_args = [a for a in sys.argv[1:] if "-psn_0_" not in a]
         else:
@@ -287,6 +301,9 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
                     "cv-api-key=",
                     "only-set-cv-key",
                     "wait-on-cv-rate-limit",
+                    "serve",
+                    "use-server",
+                    "socket=",
                 ],
             )
 
@@ -360,6 +377,12 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
                 self.cv_api_key = a
             if o == "--only-set-cv-key":
                 self.only_set_key = True
+            if o == "--serve":
+                self.serve = True
+            if o == "--use-server":
+                self.use_server = True
+            if o == "--socket":
+                self.server_address = a
             if o == "--version":
                 print("ComicTagger {0}:  Copyright (c) 2012-2014 Anthony Beville".format(ctversion.version))
                 print("Distributed under Apache License 2.0 (http://www.apache.org/licenses/LICENSE-2.0)")
@@ -374,7 +397,7 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
                 else:
                     self.display_msg_and_quit("Invalid tag type", 1)
 
-        if self.print_tags or self.delete_tags or self.save_tags or self.copy_tags or self.rename_file or self.export_to_zip or self.only_set_key:
+        if self.print_tags or self.delete_tags or self.save_tags or self.copy_tags or self.rename_file or self.export_to_zip or self.only_set_key or self.serve:
             self.no_gui = True
 
         count = 0
@@ -394,14 +417,21 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
             count += 1
         if self.only_set_key:
             count += 1
+        if self.serve:
+            count += 1
 
         if count > 1:
-            self.display_msg_and_quit("Must choose only one action of print, delete, save, copy, rename, export, set key, or run script", 1)
+            self.display_msg_and_quit("Must choose only one action of print, delete, save, copy, rename, export, set key, run script, or serve", 1)
+
+        if self.serve and self.use_server:
+            self.display_msg_and_quit("Can't both serve and use a server", 1)
 
         if self.script is not None:
             self.launch_script(self.script)
 
         if len(args) > 0:
+            if cwd is not None:
+                args = [os.path.join(cwd, item) for item in args]
             if platform.system() == "Windows":
                 # no globbing on windows shell, so do it for them
                 import glob
@@ -418,7 +448,7 @@ For more help visit the wiki at: http://code.google.com/p/comictagger/
         if self.only_set_key and self.cv_api_key is None:
             self.display_msg_and_quit("Key not given!", 1)
 
-        if (self.only_set_key == False) and self.no_gui and (self.filename is None):
+        if (self.only_set_key == False) and (self.serve == False) and self.no_gui and (self.filename is None):
             self.display_msg_and_quit("Command requires at least one filename!", 1)
 
         if self.delete_tags and self.data_style is None:
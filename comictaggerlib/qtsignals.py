@@ -0,0 +1,32 @@
+"""Qt signals for the GUI's asynchronous Comic Vine and image fetches
+
+The talker and the image fetcher are also used by the command line, which
+doesn't need Qt, and shouldn't pay for importing it.  So the signals live on
+these small objects, which are only created (and Qt imported) when the GUI
+first asks for one.
+"""
+
+# Copyright 2012-2014 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from PyQt5.QtCore import QByteArray, QObject, pyqtSignal
+
+
+class TalkerSignals(QObject):
+    urlFetchComplete = pyqtSignal(str, str, int)
+    altUrlListFetchComplete = pyqtSignal(list, int)
+
+
+class FetcherSignals(QObject):
+    fetchComplete = pyqtSignal(QByteArray, int)
@@ -0,0 +1,89 @@
+"""A trigram index over series names, for searching them locally"""
+
+# Copyright 2012-2014 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import utils
+
+
+class SeriesIndex:
+    """
+    Maps each three letter slice of the normalized series names to the
+    volumes that have it.  A query only has to look at the volumes that
+    share a trigram with the search name, and ranks them by how many of
+    their trigrams are in common (the Jaccard similarity).
+    """
+
+    def __init__(self):
+        self.trigrams = dict()
+        self.names = dict()
+        self.records = dict()
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def split(name):
+        padded = "  " + name + " "
+        return set(padded[i : i + 3] for i in range(len(padded) - 2))
+
+    def add(self, record):
+        """Add a volume search result record, replacing any with the same id"""
+
+        volume_id = record["id"]
+        if volume_id in self.records:
+            self.remove(volume_id)
+
+        name = utils.normalizeSeriesName(record["name"] or "")
+        self.names[volume_id] = name
+        self.records[volume_id] = record
+        for trigram in self.split(name):
+            self.trigrams.setdefault(trigram, set()).add(volume_id)
+
+    def remove(self, volume_id):
+        name = self.names.pop(volume_id, None)
+        if name is None:
+            return
+
+        del self.records[volume_id]
+        for trigram in self.split(name):
+            ids = self.trigrams[trigram]
+            ids.discard(volume_id)
+            if len(ids) == 0:
+                del self.trigrams[trigram]
+
+    def query(self, series_name, min_similarity=0.0):
+        """Returns a list of (record, similarity) for the volumes whose names
+        contain all the words of the search name, most similar first"""
+
+        search_name = utils.normalizeSeriesName(series_name)
+        terms = search_name.split()
+        search_trigrams = self.split(search_name)
+
+        shared = dict()
+        for trigram in search_trigrams:
+            for volume_id in self.trigrams.get(trigram, ()):
+                shared[volume_id] = shared.get(volume_id, 0) + 1
+
+        results = []
+        for volume_id, count in shared.items():
+            name = self.names[volume_id]
+            if not all(term in name for term in terms):
+                continue
+            similarity = count / float(len(search_trigrams) + len(self.split(name)) - count)
+            if similarity >= min_similarity:
+                results.append((self.records[volume_id], similarity))
+
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results
@@ -0,0 +1,375 @@
+"""A server that runs ComicTagger commands sent to it by other processes
+
+Each command line tool run pays for the interpreter start up, the imports and
+opening the caches.  The server pays for them once, and keeps the Comic Vine
+data, the HTTP connections and the opened archives around for the commands
+that follow.  Clients send the command line arguments, and get back what the
+command printed.
+
+Only this user can connect to the socket file.  Where there are no unix
+sockets, the server listens on a loopback TCP port, and a client must send
+the token the server wrote to a file only this user can read.
+"""
+
+# Copyright 2012-2014 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import hmac
+import io
+import ipaddress
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+
+from . import cli
+from .comicarchive import ComicArchive
+from .options import Options
+from .settings import ComicTaggerSettings
+
+# used where there are no unix sockets
+default_port = 47632
+
+
+def default_address():
+    if hasattr(socket, "AF_UNIX"):
+        return os.path.join(ComicTaggerSettings.getSettingsFolder(), "server.sock")
+    return "127.0.0.1:{0}".format(default_port)
+
+
+def parse_address(address):
+    """Returns the socket family and address for a socket file name, or a
+    HOST:PORT string"""
+
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdecimal():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def is_loopback(host):
+    """True if every address the host name resolves to is a loopback one"""
+
+    try:
+        infos = socket.getaddrinfo(host, None, socket.AF_INET)
+        return len(infos) > 0 and all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+    except (OSError, ValueError):
+        return False
+
+
+def token_file(port):
+    return os.path.join(ComicTaggerSettings.getSettingsFolder(), "server-{0}.token".format(port))
+
+
+def create_token(port):
+    """
+    A new token for the clients of a TCP server.  Anyone on the machine can
+    connect to a TCP port, so it's in a file only this user can read, and
+    requests without it are refused.
+    """
+
+    path = token_file(port)
+    if os.path.exists(path):
+        os.unlink(path)
+    token = secrets.token_hex(16)
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+        f.write(token)
+    return token
+
+
+def read_token(port):
+    try:
+        with open(token_file(port)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class ArchivePool:
+    """
+    The archives opened by earlier commands, with their file sizes and
+    modification times.  An archive is only handed out again if the file
+    hasn't changed since, and only to one command at a time; any others
+    that want it at the same time get a fresh one.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.archives = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def checkout(self, path, settings):
+        with self.lock:
+            entry = self.archives.pop(path, None)
+
+        if entry is not None and entry[0] == self.stamp(path):
+            return entry[1]
+
+        return ComicArchive(path, settings.rar_exe_path, ComicTaggerSettings.getGraphic("nocover.png"))
+
+    def checkin(self, ca):
+        # a renamed or deleted file has no stamp, so it's dropped
+        stamp = self.stamp(ca.path)
+        if stamp is None:
+            return
+
+        with self.lock:
+            self.archives[ca.path] = (stamp, ca)
+            self.archives.move_to_end(ca.path)
+            while len(self.archives) > self.max_size:
+                self.archives.popitem(last=False)
+
+
+class ThreadOutput:
+    """
+    Stands in for sys.stdout or sys.stderr.  While a thread is capturing,
+    what it prints goes to its own buffer, so the output of each command can
+    be sent back to the client that sent it.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, text):
+        buf = getattr(self.local, "buffer", None)
+        if buf is None:
+            return self.stream.write(text)
+        return buf.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def capture(self):
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        text = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return text
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """Reads a request line of JSON, and writes a response line"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line.decode("utf-8"))
+            args = [str(arg) for arg in request["args"]]
+            cwd = request.get("cwd")
+            token = str(request.get("token"))
+        except Exception as e:
+            response = {"code": 2, "stdout": "", "stderr": "Bad request: {0}\n".format(e)}
+        else:
+            if self.server.token is not None and not hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8")):
+                response = {"code": 2, "stdout": "", "stderr": "The server token is wrong or missing\n"}
+            else:
+                response = self.server.run_command(args, cwd)
+
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class PoolMixIn:
+    """Like socketserver.ThreadingMixIn, but the requests are handled by a
+    fixed number of worker threads"""
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class CommandServerMixIn(PoolMixIn):
+    def setup_commands(self, settings, workers=None, token=None):
+        self.settings = settings
+        self.token = token
+        self.settings_lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def run_command(self, args, cwd):
+        sys.stdout.capture()
+        sys.stderr.capture()
+        try:
+            code = self.do_command(args, cwd)
+        except SystemExit as e:
+            code = e.code
+            if code is None:
+                code = 0
+            elif not isinstance(code, int):
+                print(code, file=sys.stderr)
+                code = 1
+        except Exception:
+            print("Unhandled exception:\n" + traceback.format_exc(), file=sys.stderr)
+            code = 1
+        finally:
+            out = sys.stdout.release()
+            err = sys.stderr.release()
+
+        return {"code": code, "stdout": out, "stderr": err}
+
+    def do_command(self, args, cwd):
+        # a script would be launched while the arguments are parsed
+        if "-S" in args or "--script" in args:
+            print("Scripts can't be run by the server", file=sys.stderr)
+            return 1
+
+        opts = Options()
+        opts.parseCmdLineArgs(args, cwd)
+
+        if opts.serve:
+            print("The server is already running", file=sys.stderr)
+            return 1
+        if opts.interactive:
+            print("Interactive mode can't be used with the server", file=sys.stderr)
+            return 1
+        if not opts.no_gui:
+            print("The server only does command line actions", file=sys.stderr)
+            return 1
+
+        if opts.cv_api_key:
+            with self.settings_lock:
+                if opts.cv_api_key != self.settings.cv_api_key:
+                    self.settings.cv_api_key = opts.cv_api_key
+                    self.settings.save()
+                    cli.online_setup(self.settings)
+        if opts.only_set_key:
+            print("Key set")
+            return 0
+
+        cli.cli_mode(opts, self.settings)
+        return 0
+
+
+class UnixCommandServer(CommandServerMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class TCPCommandServer(CommandServerMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+def serve(settings, address=None, workers=None):
+    """Runs commands from clients until interrupted"""
+
+    if address is None:
+        address = default_address()
+    family, sock_address = parse_address(address)
+
+    if family == socket.AF_UNIX:
+        if os.path.exists(sock_address):
+            # left behind by a server that didn't shut down cleanly?
+            try:
+                send_command(address, ["--version"])
+            except OSError:
+                os.unlink(sock_address)
+            else:
+                print("A server is already running on {0}".format(address), file=sys.stderr)
+                return
+        # it runs commands as this user, so no one else may connect
+        umask = os.umask(0o177)
+        try:
+            server = UnixCommandServer(sock_address, CommandHandler)
+        finally:
+            os.umask(umask)
+    else:
+        # the token keeps out other users, but is sent in the clear
+        if not is_loopback(sock_address[0]):
+            print("The server only listens on loopback addresses, not {0}".format(sock_address[0]), file=sys.stderr)
+            return
+        server = TCPCommandServer(sock_address, CommandHandler)
+
+    token = None
+    if family != socket.AF_UNIX:
+        token = create_token(sock_address[1])
+
+    server.setup_commands(settings, workers, token)
+    cli.archive_pool = ArchivePool()
+    cli.online_setup(settings)
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = ThreadOutput(stdout)
+    sys.stderr = ThreadOutput(stderr)
+
+    # either one stops the server, and removes its socket file
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    print("Serving on {0}".format(address), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sys.stdout, sys.stderr = stdout, stderr
+        cli.archive_pool = None
+        if family == socket.AF_UNIX and os.path.exists(sock_address):
+            os.unlink(sock_address)
+        if token is not None and read_token(sock_address[1]) == token:
+            os.unlink(token_file(sock_address[1]))
+
+
+def send_command(address, args, cwd=None):
+    """Sends the arguments to the server, and returns its response: a dict
+    of the exit code, and what the command printed to stdout and stderr"""
+
+    if address is None:
+        address = default_address()
+    family, sock_address = parse_address(address)
+
+    request = {"args": list(args), "cwd": cwd}
+    if family != socket.AF_UNIX:
+        request["token"] = read_token(sock_address[1])
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(sock_address)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+
+    if not line:
+        raise ConnectionError("The server closed the connection")
+    return json.loads(line.decode("utf-8"))
@@ -103,6 +103,7 @@ class ComicTaggerSettings:
         self.remove_html_tables = False
         self.cv_api_key = ""
         self.auto_imprint = False
+        self.image_cache_max_mb = 512
 
         # CBL Tranform settings
 
@@ -286,6 +287,8 @@ class ComicTaggerSettings:
             self.remove_html_tables = self.config.getboolean("comicvine", "remove_html_tables")
         if self.config.has_option("comicvine", "cv_api_key"):
             self.cv_api_key = self.config.get("comicvine", "cv_api_key")
+        if self.config.has_option("comicvine", "image_cache_max_mb"):
+            self.image_cache_max_mb = self.config.getint("comicvine", "image_cache_max_mb")
 
         if self.config.has_option("cbl_transform", "assume_lone_credit_is_primary"):
             self.assume_lone_credit_is_primary = self.config.getboolean("cbl_transform", "assume_lone_credit_is_primary")
@@ -387,6 +390,7 @@ class ComicTaggerSettings:
         self.config.set("comicvine", "clear_form_before_populating_from_cv", self.clear_form_before_populating_from_cv)
         self.config.set("comicvine", "remove_html_tables", self.remove_html_tables)
         self.config.set("comicvine", "cv_api_key", self.cv_api_key)
+        self.config.set("comicvine", "image_cache_max_mb", self.image_cache_max_mb)
 
         if not self.config.has_section("cbl_transform"):
             self.config.add_section("cbl_transform")
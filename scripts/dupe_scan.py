@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+Scan comic archives for duplicates, without any GUI.  Comics with the same
+series, issue, title and year are grouped together, and optionally so are
+comics with near identical covers.  The groups are written out as JSON or
+CSV, which find_dupes.py can then load for a closer look.
+"""
+
+# Copyright 2012-2014 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
+import sys
+
+from comictaggerlib import utils
+from comictaggerlib.comicarchive import ComicArchive, MetaDataStyle
+from comictaggerlib.hashindex import HashIndex, LibraryHashIndex
+from comictaggerlib.imagehasher import ImageHasher
+from comictaggerlib.settings import ComicTaggerSettings
+
+
+class ComicRecord:
+    """What the scan keeps for each comic: no images, just names and hashes"""
+
+    __slots__ = ["path", "key", "digest", "series", "issue", "title", "year", "cover_hash"]
+
+    def __init__(self, path, key="", digest="", series=None, issue=None, title=None, year=None, cover_hash=None):
+        self.path = path
+        self.key = key
+        self.digest = digest
+        self.series = series
+        self.issue = issue
+        self.title = title
+        self.year = year
+        self.cover_hash = cover_hash
+
+    def to_dict(self):
+        d = {name: getattr(self, name) for name in self.__slots__}
+        if self.cover_hash is not None:
+            d["cover_hash"] = "{0:016x}".format(self.cover_hash)
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        record = ComicRecord(d["path"])
+        for name in ComicRecord.__slots__[1:]:
+            setattr(record, name, d.get(name))
+        if record.cover_hash is not None:
+            record.cover_hash = int(record.cover_hash, 16)
+        return record
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    blake2b = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            blake2b.update(chunk)
+    return blake2b.hexdigest()
+
+
+# all that's needed from the tags
+key_fields = {"series", "issue", "title", "year"}
+
+
+def make_key(x):
+    return "<" + str(x.series) + " #" + str(x.issue) + " - " + str(x.title) + " - " + str(x.year) + ">"
+
+
+def scan_archive(path, style, rar_exe_path, hash_cover):
+    """Read one archive.  Returns a ComicRecord, or None if it isn't a tagged comic"""
+
+    try:
+        ca = ComicArchive(path, rar_exe_path, default_image_path=ComicTaggerSettings.getGraphic("nocover.png"))
+        if not (ca.seemsToBeAComicArchive() and ca.hasMetadata(style)):
+            return None
+
+        md = ca.readMetadata(style, key_fields)
+        # the file digest is only needed for dupes, so add_digests() does it later
+        record = ComicRecord(path, make_key(md), "", md.series, md.issue, md.title, md.year)
+
+        if hash_cover:
+            cover = ca.getPage(0)
+            if cover is not None:
+                record.cover_hash = ImageHasher(data=cover).average_hash()
+    except Exception as e:
+        print("Error reading {0}: {1}".format(path, e), file=sys.stderr)
+        return None
+
+    return record
+
+
+def scan(file_list, style, rar_exe_path, workers=None, visual=False, index=None):
+    """
+    Read all of the archives on a pool of processes, and return their
+    records.  If visual is set, covers are hashed as well; covers that are
+    still current in the LibraryHashIndex aren't read again.
+    """
+
+    known_hashes = dict()
+    if visual and index is not None:
+        known_hashes = index.get_current_hashes(file_list)
+
+    records = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_archive, path, style, rar_exe_path, visual and path not in known_hashes) for path in file_list]
+        for i, future in enumerate(futures):
+            record = future.result()
+            print("{0}/{1}\r".format(i + 1, len(futures)), end="", file=sys.stderr)
+            if record is None:
+                continue
+            if visual and record.cover_hash is None:
+                record.cover_hash = known_hashes.get(record.path)
+            records.append(record)
+    print("", file=sys.stderr)
+
+    if visual and index is not None:
+        index.add_hashes([(r.path, r.cover_hash) for r in records if r.cover_hash is not None and r.path not in known_hashes])
+
+    return records
+
+
+def find_groups(records, visual_radius=-1):
+    """Returns a list of (reason, [ComicRecord]) dupe groups"""
+
+    by_key = dict()
+    for record in records:
+        by_key.setdefault(record.key, []).append(record)
+
+    groups = [("metadata", sorted(group, key=lambda r: r.path)) for key, group in sorted(by_key.items()) if len(group) > 1]
+
+    if visual_radius >= 0:
+        by_path = {record.path: record for record in records}
+        index = HashIndex()
+        for record in records:
+            if record.cover_hash is not None:
+                index.add(record.path, record.cover_hash)
+
+        known = set(frozenset(r.path for r in group) for reason, group in groups)
+        for paths in index.groups(visual_radius):
+            if frozenset(paths) not in known:
+                groups.append(("cover", [by_path[path] for path in sorted(paths)]))
+
+    return groups
+
+
+def add_digests(groups, workers=None):
+    """Fill in the file digests of the comics in the dupe groups, on a pool of
+    processes.  Only these comics are read in full."""
+
+    records = [record for reason, group in groups for record in group if not record.digest]
+    paths = list(dict.fromkeys(record.path for record in records))
+    if len(paths) == 0:
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        digests = dict(zip(paths, pool.map(file_digest, paths, chunksize=8)))
+
+    for record in records:
+        record.digest = digests[record.path]
+
+
+def write_json(groups, f):
+    json.dump([{"reason": reason, "comics": [r.to_dict() for r in group]} for reason, group in groups], f, indent=2)
+
+
+def read_json(f):
+    return [(g["reason"], [ComicRecord.from_dict(d) for d in g["comics"]]) for g in json.load(f)]
+
+
+def write_csv(groups, f):
+    writer = csv.writer(f)
+    writer.writerow(["group", "reason"] + ComicRecord.__slots__)
+    for i, (reason, group) in enumerate(groups):
+        for record in group:
+            d = record.to_dict()
+            writer.writerow([i, reason] + [d[name] for name in ComicRecord.__slots__])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate comics, and write the groups out as JSON or CSV")
+    parser.add_argument("-o", metavar="file", type=str, default="-", help="output file (default: stdout)")
+    parser.add_argument("-f", "--format", choices=["json", "csv"], default="json", help="output format")
+    parser.add_argument("-j", metavar="jobs", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument(
+        "-d", metavar="distance", type=int, default=-1, help="also group comics whose covers are within this hamming distance (e.g. 6)"
+    )
+    parser.add_argument("paths", metavar="PATH", type=str, nargs="+", help="Path(s) to search for duplicates")
+    args = parser.parse_args()
+
+    settings = ComicTaggerSettings()
+    file_list = utils.get_recursive_filelist(args.paths)
+
+    visual = args.d >= 0
+    index = LibraryHashIndex() if visual else None
+    records = scan(file_list, MetaDataStyle.CIX, settings.rar_exe_path, args.j, visual, index)
+    groups = find_groups(records, args.d)
+    add_digests(groups, args.j)
+
+    if args.o == "-":
+        out = sys.stdout
+    else:
+        out = open(args.o, "w", newline="")
+
+    if args.format == "csv":
+        write_csv(groups, out)
+    else:
+        write_json(groups, out)
+
+    if out is not sys.stdout:
+        out.close()
+
+    print("{0} duplicate groups in {1} comics".format(len(groups), len(records)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 #!/usr/bin/python3
-"""Find all duplicate comics"""
+"""
+Find all duplicate comics.  The scanning is done by dupe_scan.py; this is a
+viewer for picking which copies to keep.  It can scan the given folders
+itself, or load the JSON output of an earlier dupe_scan.py run.
+"""
 
 import argparse
 import ctypes
@@ -14,21 +18,25 @@ from typing import Dict, List
 
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 
+import dupe_scan
 import filetype
 from comictaggerlib.comicarchive import *
 from comictaggerlib.filerenamer import FileRenamer
+from comictaggerlib.hashindex import LibraryHashIndex
 from comictaggerlib.imagehasher import ImageHasher
 from comictaggerlib.settings import *
-from comictaggerlib.ui.qtutils import centerWindowOnParent
 from unrar.cffi import rarfile
 
 root = 1 << 31 - 1
 something = 1 << 31 - 1
 
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
 
 class ImageMeta:
-    def __init__(self, name, file_hash, image_hash, image_type, score=-1, score_file_hash=""):
+    def __init__(self, name, size, file_hash, image_hash, image_type, score=-1, score_file_hash=""):
         self.name = name
+        self.size = size
         self.file_hash = file_hash
         self.image_hash = image_hash
         self.type = image_type
@@ -41,72 +49,90 @@ class Duplicate:
 
     imageHashes: Dict[str, ImageMeta]
 
-    def __init__(self, path, metadata: GenericMetadata, cover):
-        self.path = path
-        self.digest = ""
-        self.metadata = metadata
+    def __init__(self, record: dupe_scan.ComicRecord):
+        self.path = record.path
+        self.digest = record.digest
+        self.metadata = GenericMetadata()
+        self.metadata.series = record.series
+        self.metadata.issue = record.issue
+        self.metadata.title = record.title
+        self.metadata.year = record.year
         self.imageHashes = dict()
         self.duplicateImages = set()
         self.extras = set()
-        self.extractedPath = ""
         self.deletable = False
         self.keeping = False
         self.fileCount = 0  # Excluding comicinfo.xml
         self.imageCount = 0
-        self.cover = cover
-        blake2b = hashlib.blake2b(digest_size=16)
-        for f in open(self.path, "rb"):
-            blake2b.update(f)
-
-        self.digest = blake2b.hexdigest()
-
-    def extract(self, directory):
+        self._cover = None
+        if not self.digest:
+            self.digest = dupe_scan.file_digest(self.path)
+
+    @property
+    def cover(self):
+        # only read when it's shown, so the scan results stay small
+        if self._cover is None:
+            self._cover = ComicArchive(self.path, default_image_path=ComicTaggerSettings.getGraphic("nocover.png")).getPage(0)
+        return self._cover
+
+    def open_archive(self):
         archive_type = filetype.archive_match(self.path)
         if archive_type is not None:
             if archive_type.extension == "zip":
-                archive = zipfile.ZipFile(self.path)
+                return zipfile.ZipFile(self.path)
             elif archive_type.extension == "rar":
                 archive = rarfile.RarFile(self.path)
                 archive.close = lambda: None
+                return archive
+        return None
+
+    def read_pages(self):
+        """Hash every page straight from the archive, reading each member once"""
+
+        if self.fileCount > 0:
+            return
+
+        archive = self.open_archive()
+        if archive is None:
+            return
+
+        for fileinfo in archive.infolist():
+            if not isinstance(fileinfo, rarfile.RarInfo) and fileinfo.is_dir():
+                continue
+            filename = os.path.basename(fileinfo.filename)
+            if filename.lower() in ["comicinfo.xml"]:
+                continue
+            self.fileCount += 1
+            file_bytes = archive.read(fileinfo)
+
+            image_type = filetype.image_match(file_bytes)
+            if image_type is not None:
+                self.imageCount += 1
+                file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest().upper()
+                if file_hash in self.imageHashes.keys():
+                    self.duplicateImages.add(filename)
+                else:
+                    image_hash = ImageHasher(data=file_bytes, width=12, height=12).average_hash()
+                    self.imageHashes[file_hash] = ImageMeta(fileinfo.filename, len(file_bytes), file_hash, image_hash, image_type.extension)
             else:
-                return
-
-            if archive is not None:
-                self.extractedPath = directory
-                for fileinfo in archive.infolist():
-                    if not isinstance(fileinfo, rarfile.RarInfo) and fileinfo.is_dir():
-                        continue
-                    filename = os.path.basename(fileinfo.filename)
-                    archived_file = archive.open(fileinfo)
-                    if filename.lower() in ["comicinfo.xml"]:
-                        continue
-                    self.fileCount += 1
-                    file_bytes = archive.read(fileinfo)
-
-                    image_type = filetype.image_match(archived_file)
-                    if image_type is not None:
-                        self.imageCount += 1
-                        file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest().upper()
-                        if file_hash in self.imageHashes.keys():
-                            self.duplicateImages.add(filename)
-                        else:
-                            image_hash = ImageHasher(data=file_bytes, width=12, height=12).average_hash()
-                            self.imageHashes[file_hash] = ImageMeta(
-                                os.path.join(self.extractedPath, filename), file_hash, image_hash, image_type.extension
-                            )
-                    else:
-                        self.extras.add(filename)
-
-                    os.makedirs(self.extractedPath, 0o777, True)
-                    unarchived_file = open(os.path.join(self.extractedPath, filename), mode="wb")
-                    archived_file.seek(0, io.SEEK_SET)
-                    shutil.copyfileobj(archived_file, unarchived_file)
-                    archived_file.close()
-                    unarchived_file.close()
-                archive.close()
+                self.extras.add(filename)
+        archive.close()
+
+    def get_image(self, file_hash):
+        """Read the page with the given hash back out of the archive, for display"""
+        archive = self.open_archive()
+        if archive is None:
+            return None
+        image_data = archive.read(self.imageHashes[file_hash].name)
+        archive.close()
+        return image_data
 
     def clean(self):
-        shutil.rmtree(self.extractedPath, ignore_errors=True)
+        self.imageHashes = dict()
+        self.duplicateImages = set()
+        self.extras = set()
+        self.fileCount = 0
+        self.imageCount = 0
 
     def delete(self):
         if not self.keeping:
@@ -115,7 +141,7 @@ class Duplicate:
                 os.remove(self.path)
             except Exception:
                 pass
-        return not (os.path.exists(self.path) or os.path.exists(self.extractedPath))
+        return not os.path.exists(self.path)
 
 
 class Tree(QtCore.QAbstractListModel):
@@ -149,18 +175,14 @@ class Tree(QtCore.QAbstractListModel):
 
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, file_list, settings, style, work_path, parent=None):
+    def __init__(self, groups, settings, parent=None):
         super().__init__(parent)
-        uic.loadUi("/home/timmy/build/source/comictagger-develop/scripts/mainwindow.ui", self)
+        uic.loadUi(os.path.join(script_dir, "mainwindow.ui"), self)
         self.dupes = []
         self.firstRun = 0
         self.dupe_set_list: List[List[Duplicate]] = list()
         self.settings = settings
-        self.style = style
-        if work_path == "":
-            work_path = tempfile.mkdtemp()
-        self.work_path = work_path
-        self.initFiles = file_list
+        self.groups = groups
         self.dupe_set_qlist.clicked.connect(self.dupe_set_clicked)
         self.dupe_set_qlist.doubleClicked.connect(self.dupe_set_double_clicked)
         self.actionCompare_Comic.triggered.connect(self.compare_action)
@@ -192,7 +214,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def compare(self, i):
         if len(self.dupe_set_list) > i:
-            dw = DupeWindow(self.dupe_set_list[i], self.work_path, self)
+            dw = DupeWindow(self.dupe_set_list[i], self)
             dw.closed.connect(self.update_dupes)
             dw.show()
 
@@ -229,7 +251,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.firstRun == 0:
             self.firstRun = 1
 
-            self.load_files(self.initFiles)
+            self.load_groups(self.groups)
             if len(self.dupe_set_list) < 1:
                 print("No duplicates found")
                 QtWidgets.QApplication.quit()
@@ -237,82 +259,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.dupe_set_qlist.setSelection(QtCore.QRect(0, 0, 0, 1), QtCore.QItemSelectionModel.ClearAndSelect)
         self.dupe_set_clicked(self.dupe_set_qlist.model().index(0, 0))
 
-    def load_files(self, file_list):
-        # Progress dialog on Linux flakes out for small range, so scale up
-        dialog = QtWidgets.QProgressDialog("", "Cancel", 0, len(file_list), parent=self)
-        dialog.setWindowTitle("Reading Comics")
-        dialog.setWindowModality(QtCore.Qt.ApplicationModal)
-        dialog.setMinimumDuration(300)
-        dialog.setMinimumWidth(400)
-        centerWindowOnParent(dialog)
-
-        comic_list = []
-        max_name_len = 2
-        for filename in file_list:
-            QtCore.QCoreApplication.processEvents()
-            if dialog.wasCanceled():
-                break
-            dialog.setValue(dialog.value() + 1)
-            dialog.setLabelText(filename)
-            ca = ComicArchive(
-                filename,
-                self.settings.rar_exe_path,
-                default_image_path="/home/timmy/build/source/comictagger-test/comictaggerlib/graphics/nocover.png",
-            )
-            if ca.seemsToBeAComicArchive() and ca.hasMetadata(self.style):
-                fmt_str = "{{0:{0}}}".format(max_name_len)
-                print(fmt_str.format(filename) + "\r", end="", file=sys.stderr)
-                sys.stderr.flush()
-                md = ca.readMetadata(self.style)
-                cover = ca.getPage(0)
-                comic_list.append((make_key(md), filename, md, cover))
-                max_name_len = len(filename)
-        print()
-
-        comic_list.sort(key=itemgetter(0), reverse=False)
-
-        # look for duplicate blocks
-        dupe_set = list()
-        prev_key = ""
-
-        dialog.setWindowTitle("Finding Duplicates")
-        dialog.setMaximum(len(comic_list))
-        dialog.setValue(dialog.minimum())
-
-        set_list = list()
-        for new_key, filename, md, cover in comic_list:
-            dialog.setValue(dialog.value() + 1)
-            QtCore.QCoreApplication.processEvents()
-            if dialog.wasCanceled():
-                break
-            dialog.setLabelText(filename)
-
-            # if the new key same as the last, add to to dupe set
-            if new_key == prev_key:
-                dupe_set.append((filename, md, cover))
-            # else we're on a new potential block
-            else:
-                # only add if the dupe list has 2 or more
-                if len(dupe_set) > 1:
-                    set_list.append(dupe_set)
-                dupe_set = list()
-                dupe_set.append((filename, md, cover))
-
-            prev_key = new_key
-
-        # Final dupe_set
-        if len(dupe_set) > 1:
-            set_list.append(dupe_set)
-
-        for d_set in set_list:
-            new_set = list()
-            for filename, md, cover in d_set:
-                new_set.append(Duplicate(filename, md, cover))
-            self.dupe_set_list.append(new_set)
+    def load_groups(self, groups):
+        for reason, group in groups:
+            self.dupe_set_list.append([Duplicate(record) for record in group])
 
         self.dupe_set_qlist.setModel(Tree(self.dupe_set_list))
-        dialog.close()
-
 
     # def delete_hashes(self):
     #     working_dir = os.path.join(self.tmp, "working")
@@ -351,9 +302,9 @@ class MainWindow(QtWidgets.QMainWindow):
 class DupeWindow(QtWidgets.QWidget):
     closed = QtCore.pyqtSignal()
 
-    def __init__(self, duplicates: List[Duplicate], tmp, parent=None):
+    def __init__(self, duplicates: List[Duplicate], parent=None):
         super().__init__(parent, QtCore.Qt.Window)
-        uic.loadUi("/home/timmy/build/source/comictagger-develop/scripts/dupe.ui", self)
+        uic.loadUi(os.path.join(script_dir, "dupe.ui"), self)
 
         for f in self.comic1Image.children():
             f.deleteLater()
@@ -364,8 +315,6 @@ class DupeWindow(QtWidgets.QWidget):
         self.dupe1 = -1
         self.dupe2 = -1
 
-        self.tmp = tmp
-
         self.setWindowTitle("ComicTagger Duplicate compare")
 
         self.pageList.currentItemChanged.connect(self.current_item_changed)
@@ -382,7 +331,7 @@ class DupeWindow(QtWidgets.QWidget):
 
         if len(duplicates) < 2:
             return
-        extract(duplicates, tmp)
+        read_pages(duplicates)
 
         tmp1 = DupeImage(self.duplicates[0])
         tmp2 = DupeImage(self.duplicates[1])
@@ -487,8 +436,12 @@ class DupeWindow(QtWidgets.QWidget):
         image_hash = self.duplicates[self.dupe1].imageHashes[file_hash]
         score_hash = self.duplicates[self.dupe2].imageHashes[image_hash.score_file_hash]
 
-        image1 = QtGui.QPixmap(image_hash.name)
-        image2 = QtGui.QPixmap(score_hash.name)
+        image1_data = self.duplicates[self.dupe1].get_image(image_hash.file_hash)
+        image2_data = self.duplicates[self.dupe2].get_image(score_hash.file_hash)
+        image1 = QtGui.QPixmap()
+        image1.loadFromData(image1_data)
+        image2 = QtGui.QPixmap()
+        image2.loadFromData(image2_data)
 
         page_color = "red"
         size_color = "red"
@@ -532,7 +485,7 @@ color: {image_color};
             )
         )
         self.comic1Image.setDuplicate(self.duplicates[self.dupe1])
-        self.comic1Image.setImage(image_hash.name)
+        self.comic1Image.setImage(image1_data)
         self.comic1Image.setText(text)
         self.comic1Image.setLabelStyle(style)
 
@@ -546,7 +499,7 @@ color: {image_color};
             )
         )
         self.comic2Image.setDuplicate(self.duplicates[self.dupe2])
-        self.comic2Image.setImage(score_hash.name)
+        self.comic2Image.setImage(image2_data)
         self.comic2Image.setText(text)
         self.comic2Image.setLabelStyle(style)
 
@@ -625,8 +578,8 @@ class DupeImage(QtWidgets.QWidget):
             pm = QtGui.QPixmap()
             if image == "cover":
                 pm.loadFromData(self.duplicate.cover)
-            else:
-                pm.load(image)
+            elif image is not None:
+                pm.loadFromData(image)
             self.iHeight = pm.height()
             self.iWidth = pm.width()
             self.image.setPixmap(pm)
@@ -664,9 +617,9 @@ def select_archive(prompt, dupe_set: List[Duplicate]):
     return selection
 
 
-def extract(dupe_set, directory):
+def read_pages(dupe_set):
     for dupe in dupe_set:
-        dupe.extract(unique_dir(os.path.join(directory, os.path.basename(dupe.path))))
+        dupe.read_pages()
 
 
 def compare_dupe(dupe1: Dict[str, ImageMeta], dupe2: Dict[str, ImageMeta]):
@@ -677,17 +630,22 @@ def compare_dupe(dupe1: Dict[str, ImageMeta], dupe2: Dict[str, ImageMeta]):
     #     hashes1 = dupe2
     #     hashes2 = dupe1
 
-    for k, image1 in dupe1.items():
-        score = sys.maxsize
-        file_hash = ""
-        for k2, image2 in dupe2.items():
-            tmp = ImageHasher.hamming_distance(image1.image_hash, image2.image_hash)
-            if tmp < score:
-                score = tmp
-                file_hash = image2.file_hash
+    if len(dupe1) == 0 or len(dupe2) == 0:
+        for image1 in dupe1.values():
+            image1.score = sys.maxsize
+            image1.score_file_hash = ""
+        return
 
-        dupe1[k].score = score
-        dupe1[k].score_file_hash = file_hash
+    images1 = list(dupe1.values())
+    images2 = list(dupe2.values())
+
+    # 12x12 average hashes, see Duplicate.read_pages()
+    scores = ImageHasher.hamming_matrix([i.image_hash for i in images1], [i.image_hash for i in images2], bits=144)
+    best = scores.argmin(axis=1)
+
+    for i, image1 in enumerate(images1):
+        image1.score = int(scores[i, best[i]])
+        image1.score_file_hash = images2[best[i]].file_hash
 
 
 def mark_hashes(dupe_set: List[Duplicate]):
@@ -708,20 +666,6 @@ def mark_hashes(dupe_set: List[Duplicate]):
     return all_deletable
 
 
-def make_key(x):
-    return "<" + str(x.series) + " #" + str(x.issue) + " - " + str(x.title) + " - " + str(x.year) + ">"
-
-
-def unique_dir(file_name):
-    counter = 1
-    file_name_parts = os.path.splitext(file_name)
-    while True:
-        if not os.path.lexists(file_name):
-            return file_name
-        file_name = file_name_parts[0] + " (" + str(counter) + ")" + file_name_parts[1]
-        counter += 1
-
-
 app = None
 
 
@@ -729,26 +673,43 @@ def main():
     signal.signal(signal.SIGINT, sigint_handler)
 
     parser = argparse.ArgumentParser(description="ComicTagger Duplicate comparison script")
-    parser.add_argument("-w", metavar="workdir", type=str, nargs=1, default=tempfile.mkdtemp(), help="work directory")
-    parser.add_argument("paths", metavar="PATH", type=str, nargs="+", help="Path(s) to search for duplicates")
+    parser.add_argument("-l", metavar="file", type=str, default=None, help="load the JSON output of dupe_scan.py instead of scanning")
+    parser.add_argument("-j", metavar="jobs", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument(
+        "-d", metavar="distance", type=int, default=-1, help="also group comics whose covers are within this hamming distance (e.g. 6)"
+    )
+    parser.add_argument("paths", metavar="PATH", type=str, nargs="*", help="Path(s) to search for duplicates")
     args = parser.parse_args()
 
     settings = ComicTaggerSettings()
-    style = MetaDataStyle.CIX
-    global workdir
     global app
-    workdir = args.w
+
+    if args.l is not None:
+        with open(args.l) as f:
+            groups = dupe_scan.read_json(f)
+    elif len(args.paths) > 0:
+        file_list = utils.get_recursive_filelist(args.paths)
+        visual = args.d >= 0
+        index = LibraryHashIndex() if visual else None
+        records = dupe_scan.scan(file_list, MetaDataStyle.CIX, settings.rar_exe_path, args.j, visual, index)
+        groups = dupe_scan.find_groups(records, args.d)
+        dupe_scan.add_digests(groups, args.j)
+    else:
+        parser.error("give either PATHs to scan, or a file to load with -l")
+
+    if len(groups) == 0:
+        print("No duplicates found")
+        return
+
     app = QtWidgets.QApplication(sys.argv)
-    file_list = utils.get_recursive_filelist(args.paths)
 
     timer = QtCore.QTimer()
     timer.start(50)  # You may change this if you wish.
     timer.timeout.connect(lambda: None)  # Let the interpreter run each 500 ms.
 
-    window = MainWindow(file_list, settings, style, workdir)
+    window = MainWindow(groups, settings)
     window.show()
     app.exec()
-    shutil.rmtree(workdir, True)
 
 
 def sigint_handler(*args):
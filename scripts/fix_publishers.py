@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+"""
+Normalize the publisher and imprint tags across a library, the same way
+auto-imprint does when tagging.  The archives can be given as paths, or
+taken from the library's cover hash index.
+"""
+
+# Copyright 2012-2014 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import concurrent.futures
+import os
+import sys
+
+from comictaggerlib import utils
+from comictaggerlib.comicarchive import ComicArchive, MetaDataStyle
+from comictaggerlib.hashindex import LibraryHashIndex
+from comictaggerlib.settings import ComicTaggerSettings
+
+# the tag styles that have a publisher
+styles = [MetaDataStyle.CIX, MetaDataStyle.CBI]
+
+
+def load_publishers(publisher_files):
+    for publisher_file in publisher_files:
+        utils.loadPublisherFile(publisher_file)
+
+
+def process_file(filename, rar_exe_path, dry_run):
+    """
+    Fix the publisher in each set of tags of one archive.  Returns a list of
+    (style name, old (publisher, imprint), new (publisher, imprint)) for the
+    tags that changed.
+    """
+
+    ca = ComicArchive(filename, rar_exe_path, default_image_path=ComicTaggerSettings.getGraphic("nocover.png"))
+    if not ca.isWritable():
+        return []
+
+    changes = []
+    with ca.transaction() as t:
+        for style in styles:
+            if not ca.hasMetadata(style):
+                continue
+
+            md = ca.readMetadata(style)
+            old = (md.publisher, md.imprint)
+            md.fixPublisher()
+            new = (md.publisher, md.imprint)
+            # fixPublisher() leaves an empty imprint rather than None
+            if new == old or (new[0] == old[0] and not new[1] and not old[1]):
+                continue
+
+            changes.append((MetaDataStyle.name[style], old, new))
+            if not dry_run and not ca.writeMetadata(md, style):
+                # leaves the archive as it was
+                raise IOError("can't write {0} tags".format(MetaDataStyle.name[style]))
+
+    if not t.success:
+        raise IOError("can't save the archive")
+
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize publisher and imprint tags across comic archives")
+    parser.add_argument("-n", action="store_true", help="dry run: only report what would change")
+    parser.add_argument("-j", metavar="jobs", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--publishers", metavar="FILE", action="append", default=[], help="JSON or TOML file of extra imprints")
+    parser.add_argument("--index", action="store_true", help="process every archive in the library's cover hash index")
+    parser.add_argument("paths", metavar="PATH", type=str, nargs="*", help="comic folder(s) or file(s)")
+    args = parser.parse_args()
+
+    if not args.index and len(args.paths) == 0:
+        parser.error("give some paths, or --index")
+
+    settings = ComicTaggerSettings()
+
+    # the user's own imprint map, as ComicTagger itself loads it
+    publisher_files = []
+    for name in ["publishers.json", "publishers.toml"]:
+        publisher_file = os.path.join(ComicTaggerSettings.getSettingsFolder(), name)
+        if os.path.exists(publisher_file):
+            publisher_files.append(publisher_file)
+    publisher_files.extend(args.publishers)
+
+    filelist = utils.get_recursive_filelist(args.paths)
+    if args.index:
+        filelist.extend(path for path in LibraryHashIndex().get_paths() if os.path.exists(path))
+
+    changed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.j, initializer=load_publishers, initargs=(publisher_files,)) as pool:
+        futures = {pool.submit(process_file, filename, settings.rar_exe_path, args.n): filename for filename in filelist}
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                changes = future.result()
+            except Exception as e:
+                print("Error processing {0}: {1}".format(filename, e), file=sys.stderr)
+                continue
+
+            if len(changes) > 0:
+                print(filename)
+                for style_name, old, new in changes:
+                    print("  {0}: {1} / {2} -> {3} / {4}".format(style_name, old[0], old[1], new[0], new[1]))
+                changed += 1
+
+    if args.n:
+        print("Would change {0} of {1} comics".format(changed, len(filelist)))
+    else:
+        print("Changed {0} of {1} comics".format(changed, len(filelist)))
+
+
+if __name__ == "__main__":
+    main()
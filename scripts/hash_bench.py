@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+"""Time cover hashing of a folder of page images, with and without JPEG drafts"""
+
+# Copyright 2013 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+import time
+
+from comictaggerlib.imagehasher import ImageHasher
+
+image_exts = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def read_pages(folder):
+    """The data of every image in the folder and below, read up front so the
+    timings are of the decoding only"""
+
+    pages = []
+    for root, dirs, files in os.walk(folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in image_exts:
+                with open(os.path.join(root, name), "rb") as f:
+                    pages.append((name, f.read()))
+    return pages
+
+
+def time_hashes(pages, method, use_draft, repeat):
+    ImageHasher.use_draft = use_draft
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        hashes = [getattr(ImageHasher(data=data), method)() for name, data in pages]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time cover hashing of a folder of page images, with full decodes and with JPEG drafts")
+    parser.add_argument("folder", help="folder of page images (e.g. an unpacked archive)")
+    parser.add_argument("-m", "--method", default="average_hash", choices=["average_hash", "average_hash2", "difference_hash", "dct_average_hash"])
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of each, the best one counts")
+    args = parser.parse_args()
+
+    pages = read_pages(args.folder)
+    if len(pages) == 0:
+        print("No page images in {0}".format(args.folder), file=sys.stderr)
+        sys.exit(1)
+
+    full_time, full_hashes = time_hashes(pages, args.method, False, args.repeat)
+    draft_time, draft_hashes = time_hashes(pages, args.method, True, args.repeat)
+
+    print("{0} pages, {1}".format(len(pages), args.method))
+    print("full decode: {0:8.3f}s  {1:7.2f}ms/page".format(full_time, 1000 * full_time / len(pages)))
+    print("draft:       {0:8.3f}s  {1:7.2f}ms/page".format(draft_time, 1000 * draft_time / len(pages)))
+    print("speedup:     {0:8.2f}x".format(full_time / draft_time))
+
+    # drafts change the hashes a little, which is why ImageHasher.version was bumped
+    distances = [ImageHasher.hamming_distance(a, b) for a, b in zip(full_hashes, draft_hashes)]
+    changed = sum(1 for d in distances if d > 0)
+    print("hashes changed: {0} of {1}, by at most {2} bits".format(changed, len(pages), max(distances)))
+
+
+if __name__ == "__main__":
+    main()
@@ -44,7 +44,7 @@ def main():
         ca = ComicArchive(filename, settings.rar_exe_path)
         if ca.hasMetadata(style):
             # make a list of paired file names and metadata objects
-            metadata_list.append((filename, ca.readMetadata(style)))
+            metadata_list.append((filename, ca.readMetadata(style, {"series", "issue", "year", "title"})))
 
             max_name_len = max(max_name_len, len(filename))
             fmt_str = u"{{0:{0}}}".format(max_name_len)
@@ -70,7 +70,7 @@ def main():
     fmt_str = u"{0:" + str(w0) + "} {1:" + str(w1) + "} #{2:6} ({3})"
 
     # now sort the list by issue, and then series
-    metadata_list.sort(key=lambda x: IssueString(x[1].issue).asString(3), reverse=False)
+    metadata_list.sort(key=lambda x: cachedIssueString(x[1].issue).sort_key, reverse=False)
     metadata_list.sort(key=lambda x: unicode(x[1].series).lower() + str(x[1].year), reverse=False)
 
     # now print
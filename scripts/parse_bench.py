@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+"""Time filename parsing of a library, one name at a time and with parse_many"""
+
+# Copyright 2013 Anthony Beville
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+import time
+
+from comicapi import filenameparser
+from comicapi.filenameparser import FileNameParser, parse_many
+
+
+def read_names(source):
+    """The paths in a list file (one per line), or of every file in a folder
+    and below"""
+
+    if os.path.isdir(source):
+        return [os.path.join(root, name) for root, dirs, files in os.walk(source) for name in sorted(files)]
+    with open(source, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def parse_each(paths):
+    parsed = []
+    for path in paths:
+        fnp = FileNameParser()
+        fnp.parseFilename(path, use_cache=False)
+        parsed.append(fnp)
+    return parsed
+
+
+def parse_all(paths):
+    # cold cache, so every name is parsed
+    filenameparser.parse_cache.clear()
+    return parse_many(paths)
+
+
+def time_parse(func, paths, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        parsed = func(paths)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, [(p.series, p.volume, p.issue, p.year, p.issue_count, p.remainder) for p in parsed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time filename parsing, one name at a time and with parse_many")
+    parser.add_argument("source", help="a folder of comics, or a file listing one path per line")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of each, the best one counts")
+    args = parser.parse_args()
+
+    paths = read_names(args.source)
+    if len(paths) == 0:
+        print("No file names in {0}".format(args.source), file=sys.stderr)
+        sys.exit(1)
+
+    each_time, each_results = time_parse(parse_each, paths, args.repeat)
+    many_time, many_results = time_parse(parse_all, paths, args.repeat)
+
+    print("{0} names".format(len(paths)))
+    print("one at a time: {0:8.3f}s  {1:7.2f}us/name".format(each_time, 1e6 * each_time / len(paths)))
+    print("parse_many:    {0:8.3f}s  {1:7.2f}us/name".format(many_time, 1e6 * many_time / len(paths)))
+    print("speedup:       {0:8.2f}x".format(each_time / many_time))
+    if each_results != many_results:
+        print("results differ!", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 """
 Create new comic archives from old one, removing  pages marked as ads
 and deleted. Walks recursively through the given folders.  Originals
@@ -19,13 +19,13 @@ are kept in a sub-folder at the level of the original
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import concurrent.futures
 import os
-import shutil
 import sys
-import tempfile
 import zipfile
 
-import comictaggerlib.utils
+from comictaggerlib import utils
 from comictaggerlib.comicarchive import *
 from comictaggerlib.settings import *
 
@@ -33,48 +33,85 @@ subfolder_name = "PRE_AD_REMOVAL"
 unwanted_types = ["Deleted", "Advertisement"]
 
 
-def main():
-    # utils.fix_output_encoding()
-    settings = ComicTaggerSettings()
+def process_file(filename, rar_exe_path, dry_run):
+    """
+    Remove the unwanted pages from one archive.  Returns a list of the
+    removed page names, and the number of bytes they took up in the archive.
+    """
 
     # this can only work with files with ComicRack tags
     style = MetaDataStyle.CIX
 
-    if len(sys.argv) < 2:
-        print("Usage: {0} [comic_folder]".format(sys.argv[0]), file=sys.stderr)
-        return
+    ca = ComicArchive(filename, rar_exe_path, default_image_path=ComicTaggerSettings.getGraphic("nocover.png"))
+    if not ((ca.isZip() or ca.isRar()) and ca.hasMetadata(style)):
+        return [], 0
+
+    md = ca.readMetadata(style)
+    remove_list = [int(p["Image"]) for p in md.pages if "Type" in p and p["Type"] in unwanted_types]
+    if len(remove_list) == 0:
+        return [], 0
+
+    # the tags can list pages that aren't in the archive
+    names = []
+    page_list = []
+    for idx in remove_list:
+        name = ca.getPageName(idx)
+        if name is None:
+            print("{0}: no page {1} in the archive, skipped".format(filename, idx), file=sys.stderr)
+            continue
+        names.append(name)
+        page_list.append(idx)
+    remove_list = page_list
+    if len(remove_list) == 0:
+        return [], 0
+
+    if ca.isZip():
+        with zipfile.ZipFile(filename) as zf:
+            saved = sum(zf.getinfo(name).compress_size for name in names)
+    else:
+        saved = sum(len(ca.getPage(idx)) for idx in remove_list)
+
+    if not dry_run:
+        if not ca.removePages(remove_list):
+            print("Failed to remove pages from {0}".format(filename), file=sys.stderr)
+            return [], 0
+
+    return names, saved
 
-    if sys.argv[1] == "-n":
-        filelist = utils.get_recursive_filelist(sys.argv[2:])
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove pages tagged as ads or deleted from comic archives")
+    parser.add_argument("-n", action="store_true", help="dry run: only report what would be removed")
+    parser.add_argument("-j", metavar="jobs", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("paths", metavar="PATH", type=str, nargs="+", help="comic folder(s) or file(s)")
+    args = parser.parse_args()
+
+    settings = ComicTaggerSettings()
+    filelist = utils.get_recursive_filelist(args.paths)
+
+    total_pages = 0
+    total_bytes = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.j) as pool:
+        futures = {pool.submit(process_file, filename, settings.rar_exe_path, args.n): filename for filename in filelist}
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                names, saved = future.result()
+            except Exception as e:
+                print("Error processing {0}: {1}".format(filename, e), file=sys.stderr)
+                continue
+
+            if len(names) > 0:
+                print(filename)
+                for name in names:
+                    print("  removing " + name)
+                total_pages += len(names)
+                total_bytes += saved
+
+    if args.n:
+        print("Would remove {0} pages, saving {1} bytes".format(total_pages, total_bytes))
     else:
-        filelist = utils.get_recursive_filelist(sys.argv[1:])
-
-    # first read in CIX metadata from all files, make a list of candidates
-    modify_list = []
-    for filename in filelist:
-        print(filename,end='\n')
-
-        ca = ComicArchive(filename, settings.rar_exe_path, default_image_path="/home/timmy/build/source/comictagger-test/comictaggerlib/graphics/nocover.png")
-        if (ca.isZip or ca.isRar()) and ca.hasMetadata(style):
-            md = ca.readMetadata(style)
-            if len(md.pages) != 0:
-                pgs = list()
-                mod = False
-                for p in md.pages:
-                    if "Type" in p and p["Type"] in unwanted_types:
-                        # This one has pages to remove. Remove it!
-                        print("removing " + ca.getPageName(int(p["Image"])))
-                        if sys.argv[1] != "-n":
-                            mod = True
-                            ca.archiver.removeArchiveFile(ca.getPageName(int(p["Image"])))
-                    else:
-                        pgs.append(p)
-
-                if mod:
-                    for num, p in enumerate(pgs):
-                        p["Image"] = str(num)
-                    md.pages = pgs
-                    ca.writeCIX(md)
+        print("Removed {0} pages, saving {1} bytes".format(total_pages, total_bytes))
 
 
 if __name__ == "__main__":
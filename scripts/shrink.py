@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 """Reduce the image size of pages in the comic archive"""
 
 # Copyright 2013 Anthony Beville
@@ -15,169 +15,277 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import collections
+import concurrent.futures
+import io
+import os
 import shutil
+import sys
+import tempfile
+import zipfile
 
-import Image
-from comictaggerlib.comicarchive import *
-from comictaggerlib.settings import *
-
-# import comictaggerlib.utils
+from PIL import Image
 
+from comictaggerlib import utils
+from comictaggerlib.comicarchive import ComicArchive
+from comictaggerlib.comicinfoxml import ComicInfoXml
+from comictaggerlib.settings import ComicTaggerSettings
 
 subfolder_name = "ORIGINALS"
-max_height = 2000
 
+# file extension for each output format
+format_ext = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
 
-def main():
-    utils.fix_output_encoding()
-    settings = ComicTaggerSettings()
 
-    # this can only work with files with ComicRack tags
-    style = MetaDataStyle.CIX
-
-    if len(sys.argv) < 2:
-        print >> sys.stderr, "Usage: {0} [comic_folder]".format(sys.argv[0])
-        return
-
-    filelist = utils.get_recursive_filelist(sys.argv[1:])
-
-    # first make a list of all comic archive files
-    comics_list = []
-    max_name_len = 2
-    fmt_str = u"{{0:{0}}}".format(max_name_len)
-    for filename in filelist:
-
-        ca = ComicArchive(filename, settings.rar_exe_path)
-        if ca.seemsToBeAComicArchive():
-            # Check the images in the file, see if we need to reduce any
-
-            for idx in range(ca.getNumberOfPages()):
-                in_data = ca.getPage(idx)
-                if in_data is not None:
-                    try:
-                        im = Image.open(StringIO.StringIO(in_data))
-                        w, h = im.size
-                        if h > max_height:
-                            comics_list.append(ca)
-
-                            max_name_len = max(max_name_len, len(filename))
-                            fmt_str = u"{{0:{0}}}".format(max_name_len)
-                            print >> sys.stderr, fmt_str.format(filename) + "\r",
-                            sys.stderr.flush()
-                            break
-
-                    except IOError:
-                        # doesn't appear to be an image
-                        pass
-
-    print >> sys.stderr, fmt_str.format("") + "\r",
-    print "--------------------------------------------------------------------------"
-    print "Found {0} comics with over-large pages".format(len(comics_list))
-    print "--------------------------------------------------------------------------"
-
-    for item in comics_list:
-        print item.path
-
-    # now actually process those files with over-large pages
-    for ca in comics_list:
-        filename = ca.path
-        curr_folder = os.path.dirname(filename)
-        curr_subfolder = os.path.join(curr_folder, subfolder_name)
-
-        # skip any of our generated subfolders...
-        if os.path.basename(curr_folder) == subfolder_name:
-            continue
-
-        sys.stdout.write("Processing: " + filename)
-
-        # verify that we can write to current folder
-        if not os.access(filename, os.W_OK):
-            print "Can't move: {0}: skipped!".format(filename)
-            continue
-        if not os.path.exists(curr_subfolder) and not os.access(curr_folder, os.W_OK):
-            print "Can't create subfolder here: {0}: skipped!".format(filename)
-            continue
-        if not os.path.exists(curr_subfolder):
-            os.mkdir(curr_subfolder)
-        if not os.access(curr_subfolder, os.W_OK):
-            print "Can't write to the subfolder here: {0}: skipped!".format(filename)
-            continue
-
-        # generate a new file with temp name
-        tmp_fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename))
-        os.close(tmp_fd)
-
-        cix_md = None
-        if ca.hasCIX():
-            cix_md = ca.readCIX()
+def open_archive(filename, settings):
+    return ComicArchive(filename, settings.rar_exe_path, default_image_path=ComicTaggerSettings.getGraphic("nocover.png"))
+
+
+def page_sizes(filename, rar_exe_path):
+    """
+    Returns the (width, height) of every page in the archive.  PIL only parses
+    the image header when opening, so for zip files this doesn't decompress
+    more than the start of each page.
+    """
+
+    ca = ComicArchive(filename, rar_exe_path, default_image_path=ComicTaggerSettings.getGraphic("nocover.png"))
+    if not ca.seemsToBeAComicArchive():
+        return None
 
+    sizes = []
+    zf = zipfile.ZipFile(filename) if ca.isZip() else None
+    for idx, name in enumerate(ca.getPageNameList()):
         try:
-            zout = zipfile.ZipFile(tmp_name, "w")
-
-            # Check the images in the file, see if we want to reduce them
-            page_count = ca.getNumberOfPages()
-
-            for idx in range(ca.getNumberOfPages()):
-                name = ca.getPageName(idx)
-                in_data = ca.getPage(idx)
-                out_data = in_data
-                if in_data is not None:
-                    try:
-                        im = Image.open(StringIO.StringIO(in_data))
-                        w, h = im.size
-                        if h > max_height:
-                            # resize the image
-                            hpercent = max_height / float(h)
-                            wsize = int((float(w) * float(hpercent)))
-                            size = (wsize, max_height)
-                            im = im.resize(size, Image.ANTIALIAS)
-
-                            output = StringIO.StringIO()
-                            im.save(output, format="JPEG", quality=85)
-                            out_data = output.getvalue()
-                            output.close()
-
-                    except IOError:
-                        # doesn't appear to be an image
-                        pass
-
-                else:
-                    # page is empty?? nothing to write
-                    out_data = ""
-
-                sys.stdout.write(".")
-                sys.stdout.flush()
-
-                # write out the new resized image
-                zout.writestr(name, out_data)
-
-            # preserve the old comment
-            comment = ca.archiver.getArchiveComment()
-            if comment is not None:
-                zout.comment = ca.archiver.getArchiveComment()
-
-        except Exception as e:
-            print "Failure creating new archive: {0}!".format(filename)
-            print e, sys.exc_info()[0]
-            zout.close()
-            os.unlink(tmp_name)
-        else:
-            zout.close()
-
-            # Success!  Now move the files
+            if zf is not None:
+                with zf.open(name) as f:
+                    sizes.append(Image.open(f).size)
+            else:
+                sizes.append(Image.open(io.BytesIO(ca.getPage(idx))).size)
+        except Exception:
+            # doesn't appear to be an image
+            sizes.append(None)
+    if zf is not None:
+        zf.close()
+
+    return sizes
+
+
+def is_oversized(filename, rar_exe_path, max_height):
+    try:
+        sizes = page_sizes(filename, rar_exe_path)
+    except Exception as e:
+        print("Error scanning {0}: {1}".format(filename, e), file=sys.stderr)
+        return False
+    return sizes is not None and any(s is not None and s[1] > max_height for s in sizes)
+
+
+def needs_shrink(data, max_height):
+    """True if the page is an image taller than max_height.  Only the image
+    header is parsed"""
+
+    try:
+        return Image.open(io.BytesIO(data)).size[1] > max_height
+    except Exception:
+        # doesn't appear to be an image
+        return False
+
+
+def unique_member_name(name, old_name, used_names):
+    """
+    A page that changes format gets a new extension, which may clash with
+    another file in the archive (001.png next to 001.jpg).  Then the new
+    extension is added to the whole old name instead, which keeps the pages
+    in the same order.
+    """
+
+    if name == old_name or name not in used_names:
+        return name
+
+    base, ext = os.path.splitext(name)
+    name = old_name + ext
+    count = 1
+    while name in used_names:
+        name = "{0}-{1}{2}".format(old_name, count, ext)
+        count += 1
+    return name
+
+
+def shrink_page(name, data, max_height, out_format, quality):
+    """
+    Resize one page to fit max_height, re-encoding it in the requested format.
+    Returns (name, data, width, height); the name changes with the format.
+    Pages that are already small enough are left alone.
+    """
+
+    try:
+        im = Image.open(io.BytesIO(data))
+        w, h = im.size
+    except Exception:
+        # doesn't appear to be an image
+        return name, data, None, None
+
+    if h <= max_height:
+        return name, data, w, h
+
+    fmt = out_format or im.format
+    if fmt not in format_ext:
+        fmt = "JPEG"
+
+    # decode at a reduced scale where the format allows it
+    wsize = int(float(w) * max_height / float(h))
+    im.draft(im.mode, (wsize, max_height))
+    im = im.resize((wsize, max_height), Image.LANCZOS)
+    if fmt == "JPEG" and im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+
+    output = io.BytesIO()
+    im.save(output, format=fmt, quality=quality)
+
+    name = os.path.splitext(name)[0] + format_ext[fmt]
+    return name, output.getvalue(), wsize, max_height
+
+
+def shrink_archive(ca, pool, out_name, max_height, out_format, quality, workers):
+    """
+    Write a shrunken copy of the archive to out_name.  Pages are read one at a
+    time and resized on the pool, with only a few pages in flight, and written
+    out in order as they come back.
+    """
+
+    page_names = ca.getPageNameList()
+    page_set = set(page_names)
+    used_names = set(ca.archiver.getArchiveFilenameList())
+    cix_md = ca.readCIX() if ca.hasCIX() else None
+
+    new_sizes = dict()
+    with zipfile.ZipFile(out_name, "w", allowZip64=True) as zout:
+        # (index, old name, data) for the pages kept as they are, and
+        # (index, old name, future) for the ones being resized
+        pending = collections.deque()
+
+        def write_next():
+            idx, old_name, result = pending.popleft()
+            if isinstance(result, concurrent.futures.Future):
+                name, data, w, h = result.result()
+                name = unique_member_name(name, old_name, used_names)
+                used_names.add(name)
+                new_sizes[idx] = (len(data), w, h)
+            else:
+                name, data = old_name, result
+            zout.writestr(name, data)
+            sys.stdout.write(".")
+            sys.stdout.flush()
+
+        for idx, name in enumerate(page_names):
+            data = ca.getPage(idx)
+            if data is None:
+                # page is empty?? nothing to write
+                data = b""
+            if needs_shrink(data, max_height):
+                # only the pages to resize are sent to the workers
+                pending.append((idx, name, pool.submit(shrink_page, name, data, max_height, out_format, quality)))
+            else:
+                pending.append((idx, name, data))
+            if len(pending) >= 2 * workers:
+                write_next()
+        while len(pending) > 0:
+            write_next()
+
+        # keep everything else in the archive, except the old CIX
+        for name in ca.archiver.getArchiveFilenameList():
+            if name not in page_set and name != ca.ci_xml_filename:
+                zout.writestr(name, ca.archiver.readArchiveFile(name))
+
+        # and the CIX, with the new page sizes
+        if cix_md is not None:
+            for p in cix_md.pages:
+                idx = int(p["Image"])
+                if idx in new_sizes:
+                    size, w, h = new_sizes[idx]
+                    p["ImageSize"] = str(size)
+                    if w is not None:
+                        p["ImageWidth"] = str(w)
+                        p["ImageHeight"] = str(h)
+            zout.writestr(ca.ci_xml_filename, ComicInfoXml().stringFromMetadata(cix_md))
+
+        # preserve the old comment
+        comment = ca.archiver.getArchiveComment()
+        if comment:
+            zout.comment = comment if isinstance(comment, bytes) else bytes(comment, "utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduce the image size of pages in comic archives.  Originals are kept in a sub-folder.")
+    parser.add_argument("--max-height", type=int, default=2000, help="pages taller than this are resized (default: 2000)")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG/WebP quality (default: 85)")
+    parser.add_argument(
+        "--format", choices=["keep", "jpeg", "webp", "png"], default="jpeg", help="format for resized pages (default: jpeg)"
+    )
+    parser.add_argument("-j", metavar="jobs", type=int, default=os.cpu_count(), help="number of worker processes (default: one per CPU)")
+    parser.add_argument("paths", metavar="PATH", type=str, nargs="+", help="comic folder(s) or file(s)")
+    args = parser.parse_args()
+
+    settings = ComicTaggerSettings()
+    out_format = None if args.format == "keep" else args.format.upper()
+    filelist = [f for f in utils.get_recursive_filelist(args.paths) if os.path.basename(os.path.dirname(f)) != subfolder_name]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.j) as pool:
+
+        # first make a list of all comic archive files with over-large pages
+        oversized = pool.map(is_oversized, filelist, [settings.rar_exe_path] * len(filelist), [args.max_height] * len(filelist), chunksize=8)
+        comics_list = [filename for filename, big in zip(filelist, oversized) if big]
+
+        print("--------------------------------------------------------------------------")
+        print("Found {0} comics with over-large pages".format(len(comics_list)))
+        print("--------------------------------------------------------------------------")
+
+        for filename in comics_list:
+            print(filename)
+
+        # now actually process those files with over-large pages
+        for filename in comics_list:
+            curr_folder = os.path.dirname(filename)
+            curr_subfolder = os.path.join(curr_folder, subfolder_name)
+
+            sys.stdout.write("Processing: " + filename)
+
+            # verify that we can write to current folder
+            if not os.access(filename, os.W_OK):
+                print("Can't move: {0}: skipped!".format(filename))
+                continue
+            if not os.path.exists(curr_subfolder) and not os.access(curr_folder, os.W_OK):
+                print("Can't create subfolder here: {0}: skipped!".format(filename))
+                continue
+            if not os.path.exists(curr_subfolder):
+                os.mkdir(curr_subfolder)
+            if not os.access(curr_subfolder, os.W_OK):
+                print("Can't write to the subfolder here: {0}: skipped!".format(filename))
+                continue
+
+            ca = open_archive(filename, settings)
+
+            # generate a new file with temp name
+            tmp_fd, tmp_name = tempfile.mkstemp(dir=curr_folder)
+            os.close(tmp_fd)
+
+            try:
+                shrink_archive(ca, pool, tmp_name, args.max_height, out_format, args.quality, args.j)
+            except Exception as e:
+                print("Failure creating new archive: {0}!".format(filename))
+                print(e, sys.exc_info()[0])
+                os.unlink(tmp_name)
+                continue
+
+            # Success!  Now move the files.  A rar has become a zip, so fix
+            # the extension to match
+            new_filename = filename
+            if ca.isRar():
+                new_filename = os.path.splitext(filename)[0] + ".cbz"
             shutil.move(filename, curr_subfolder)
-            os.rename(tmp_name, filename)
-            # TODO: We might have converted a rar to a zip, and should probably change
-            #  the extension, as needed.
-
-            print "Done!".format(filename)
-
-            # Create a new archive object for the new file, and write the old
-            # CIX data, w/o page info
-            if cix_md is not None:
-                ca = ComicArchive(filename, settings.rar_exe_path)
-                cix_md.pages = []
-                ca.writeCIX(cix_md)
+            os.rename(tmp_name, new_filename)
+
+            print("Done!")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+import pathlib
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from comicapi.comicinfoxml import ComicInfoXml
+
+golden_files = sorted((pathlib.Path(__file__).parent / "data").glob("*.xml"))
+
+
+@pytest.fixture(params=golden_files, ids=lambda path: path.name)
+def golden(request):
+    return request.param.read_bytes()
+
+
+def test_round_trip(golden):
+    cix = ComicInfoXml()
+    md = cix.metadataFromString(golden.decode("utf-8"))
+    assert cix.stringFromMetadata(md).encode("utf-8") == golden
+
+
+def test_partial_read_matches_full_read(golden):
+    cix = ComicInfoXml()
+    md = cix.metadataFromString(golden.decode("utf-8"))
+    partial = cix.metadataFromString(golden.decode("utf-8"), ["series", "issue", "credits", "pages"])
+    assert (partial.series, partial.issue, partial.credits, partial.pages) == (md.series, md.issue, md.credits, md.pages)
+
+
+def test_writer_matches_element_tree(golden):
+    # the writer skips building the tree, but must write what ET would
+    cix = ComicInfoXml()
+    md = cix.metadataFromString(golden.decode("utf-8"))
+    tree = cix.convertMetadataToXML(cix, md)
+    assert cix.stringFromMetadata(md) == '<?xml version="1.0"?>\n' + ET.tostring(tree.getroot()).decode()
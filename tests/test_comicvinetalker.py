@@ -0,0 +1,65 @@
+import pytest
+
+from comictaggerlib.comicvinecacher import ComicVineCacher
+from comictaggerlib.comicvinetalker import ComicVineTalker
+
+
+def volume(volume_id, name):
+    return {
+        "id": volume_id,
+        "name": name,
+        "start_year": "2000",
+        "publisher": {"name": "DC Comics"},
+        "image": None,
+        "description": "",
+        "count_of_issues": 10,
+    }
+
+
+# what Comic Vine answers for each (normalized) query
+volumes = {
+    "batman beyond": [volume(2, "Batman Beyond"), volume(1, "Batman")],
+    "batman": [volume(3, "Batman: The Dark Knight"), volume(1, "Batman"), volume(4, "The Batman")],
+}
+
+
+@pytest.fixture
+def talker(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("APPDATA", str(tmp_path))
+    (tmp_path / ".ComicTagger").mkdir()
+    (tmp_path / "ComicTagger").mkdir()
+    monkeypatch.setattr(ComicVineCacher, "db_checked", False)
+    monkeypatch.setattr(ComicVineTalker, "series_index", None)
+
+    talker = ComicVineTalker()
+    talker.queries = []
+
+    def getCVContent(url, params):
+        talker.queries.append(params["query"])
+        results = volumes[params["query"]]
+        return {"limit": 100, "number_of_page_results": len(results), "number_of_total_results": len(results), "results": results}
+
+    monkeypatch.setattr(talker, "getCVContent", getCVContent)
+    return talker
+
+
+def test_other_spellings_use_the_cache(talker):
+    first = talker.searchForSeries("Batman!")
+    second = talker.searchForSeries("The Batman")
+    assert [record["id"] for record in second] == [record["id"] for record in first]
+    assert talker.queries == ["batman"]
+
+
+def test_side_results_dont_answer_searches(talker):
+    talker.searchForSeries("Batman Beyond")
+    # "Batman" was seen, but only in the results for another name
+    results = talker.searchForSeries("Batman")
+    assert talker.queries == ["batman beyond", "batman"]
+    assert len(results) == 3
+
+
+def test_results_ranked_by_name(talker):
+    results = talker.searchForSeries("Batman")
+    # the exact names first, then in Comic Vine's order
+    assert [record["id"] for record in results] == [1, 4, 3]
@@ -0,0 +1,74 @@
+import pytest
+
+from comicapi import filenameparser
+from comicapi.filenameparser import FileNameParser, ParseCache, parse_many
+
+# (filename, (series, volume, issue, year, issue count, remainder))
+names = [
+    ("Batman 012 (2011) (Digital) (Zone-Empire).cbz", ("Batman", "", "12", "2011", "", "(Digital) (Zone-Empire)")),
+    ("The Amazing Spider-Man v2 #1.MU (of 4) (1999) [Webrip].cbr", ("The Amazing Spider-Man", "2", "1.MU", "1999", "4", "[Webrip]")),
+    ("Saga_Vol.3_014_(2014).cbz", ("Saga", "3", "14", "2014", "", "")),
+    ("Hellboy--2011--#3.cbz", ("Hellboy", "", "Hellboy", "2011", "", "--#3")),
+    ("Sandman TPB (1990).cbz", ("Sandman", "1990", "", "1990", "", "TPB")),
+    ("X-Men 1 of 12 (1991).cbz", ("X-Men", "", "1", "1991", "12", "")),
+    ("dir/Fables #½.zip", ("Fables", "", "½", "", "", "")),
+]
+
+
+def fields(fnp):
+    return (fnp.series, fnp.volume, fnp.issue, fnp.year, fnp.issue_count, fnp.remainder)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    filenameparser.parse_cache.clear()
+    yield
+    filenameparser.parse_cache.clear()
+
+
+@pytest.mark.parametrize("filename, expected", names)
+def test_parse_filename(filename, expected):
+    fnp = FileNameParser()
+    fnp.parseFilename(filename, use_cache=False)
+    assert fields(fnp) == expected
+
+
+def test_parse_many_matches_parse_filename():
+    # the same series and scan info again and again, as in a real library
+    paths = ["/comics/Batman {0:03} (2011) (Digital).cbz".format(i) for i in range(20)]
+    paths += ["Batman #{0} (of 20) (2011).cbr".format(i) for i in range(20)]
+    paths += [filename for filename, expected in names] * 2
+
+    expected = []
+    for path in paths:
+        fnp = FileNameParser()
+        fnp.parseFilename(path, use_cache=False)
+        expected.append(fields(fnp))
+
+    parsed = parse_many(paths)
+    assert [fields(fnp) for fnp in parsed] == expected
+    # every path gets its own parser, even the repeated ones
+    assert len(set(map(id, parsed))) == len(paths)
+
+    # the second time they all come from the cache
+    hits = filenameparser.parse_cache.hits
+    assert [fields(fnp) for fnp in parse_many(paths)] == expected
+    assert filenameparser.parse_cache.hits == hits + len(paths)
+
+
+def test_cache_get_many_put_many():
+    cache = ParseCache(max_size=3)
+    cache.put_many([("a", ("1",)), ("b", ("2",))])
+    assert cache.get_many(["a", "x", "b"]) == [("1",), None, ("2",)]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # "a" was used last, so "b" goes first
+    cache.get("a")
+    cache.put_many([("c", ("3",)), ("d", ("4",))])
+    assert len(cache) == 3
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "c", "d"]) == [("1",), ("3",), ("4",)]
+
+    # only the last max_size of a long list are kept
+    cache.put_many((str(i), (str(i),)) for i in range(10))
+    assert list(cache.entries) == ["7", "8", "9"]
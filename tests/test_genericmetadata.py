@@ -0,0 +1,92 @@
+import pickle
+import subprocess
+import sys
+
+from comicapi.genericmetadata import GenericMetadata
+
+pages = [
+    {"Type": "Story", "Image": "0", "Key": "k"},
+    {"Image": "1", "ImageSize": "012", "DoublePage": "True", "Type": "Advertisement"},
+    {"Image": "2", "ImageWidth": "800", "ImageHeight": "1200"},
+]
+
+
+def make_metadata():
+    md = GenericMetadata()
+    for page_dict in pages:
+        md.addPage(dict(page_dict))
+    return md
+
+
+def test_pages_keep_key_order():
+    assert [list(p.items()) for p in make_metadata().pages] == [list(p.items()) for p in pages]
+
+
+def test_default_page_list():
+    md = GenericMetadata()
+    md.setDefaultPageList(3)
+    assert md.pages == [{"Image": "0", "Type": "FrontCover"}, {"Image": "1"}, {"Image": "2"}]
+
+
+def test_metadata_is_hashable():
+    md = make_metadata()
+    assert md in {md}
+
+
+def test_pages_unpickle_in_another_process():
+    # the other process's page codes are numbered differently
+    code = (
+        "import pickle, sys\n"
+        "from comicapi.genericmetadata import PageRecords\n"
+        "PageRecords.getCode('Other'), PageRecords.getCode(('Bookmark',))\n"
+        "md = pickle.loads(sys.stdin.buffer.read())\n"
+        "print(repr([list(p.items()) for p in md.pages]))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], input=pickle.dumps(make_metadata()), capture_output=True, check=True)
+    assert result.stdout.decode().strip() == repr([list(p.items()) for p in pages])
+
+
+def test_is_same():
+    md = make_metadata()
+    md.series = "S"
+    md.addCredit("Person", "Writer")
+
+    other = make_metadata()
+    other.series = "S"
+    other.addCredit("Person", "Writer")
+    assert md.isSame(other)
+    assert md != other
+
+    other.series = "T"
+    assert not md.isSame(other)
+
+
+def test_is_same_compares_packed_pages():
+    md = make_metadata()
+    other = make_metadata()
+    assert md._page_records is not None
+    assert md.isSame(other)
+    # still packed afterwards
+    assert md._page_records is not None and other._page_records is not None
+
+    other = make_metadata()
+    other.addPage({"Image": "3"})
+    assert not md.isSame(other)
+
+    other = GenericMetadata()
+    for page_dict in pages[:2]:
+        other.addPage(dict(page_dict))
+    other.addPage({"Image": "2", "ImageWidth": "800", "ImageHeight": "1201"})
+    assert not md.isSame(other)
+
+
+def test_is_same_with_unpacked_pages():
+    md = make_metadata()
+    other = make_metadata()
+    other.pages[1]["Bookmark"] = "b"
+    assert not md.isSame(other)
+    del other.pages[1]["Bookmark"]
+    assert md.isSame(other)
+    # key order doesn't count
+    other.pages[0] = dict(reversed(list(other.pages[0].items())))
+    assert md.isSame(other)
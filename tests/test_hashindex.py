@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from comicapi.filenameparser import ParseCache
+from comictaggerlib import hashindex
+from comictaggerlib.hashindex import HashIndex, LibraryHashIndex
+from comictaggerlib.imagehasher import numpy_available, popcount
+
+
+def skewed_hashes(count, seed=1):
+    # mostly dark covers: the low chunks are nearly always the same
+    rng = random.Random(seed)
+    hashes = dict()
+    for i in range(count):
+        h = rng.getrandbits(32) << 32
+        if rng.random() < 0.3:
+            h |= 1 << rng.randrange(32)
+        hashes["book{0}".format(i)] = h
+    # a few near copies of each other
+    for i in range(0, count, 50):
+        hashes["copy{0}".format(i)] = hashes["book{0}".format(i)] ^ (1 << 40)
+    return hashes
+
+
+def brute_force_groups(hashes, radius):
+    keys = list(hashes)
+    parent = {key: key for key in keys}
+
+    def find(key):
+        while parent[key] != key:
+            key = parent[key]
+        return key
+
+    for i, a in enumerate(keys):
+        for b in keys[i + 1 :]:
+            if popcount(hashes[a] ^ hashes[b]) <= radius:
+                parent[find(b)] = find(a)
+
+    groups = dict()
+    for key in keys:
+        groups.setdefault(find(key), set()).add(key)
+    return sorted(sorted(g) for g in groups.values() if len(g) > 1)
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_groups_keep_pairs_in_big_buckets(monkeypatch, use_numpy):
+    if use_numpy and not numpy_available:
+        pytest.skip("numpy isn't installed")
+    monkeypatch.setattr(hashindex, "numpy_available", use_numpy)
+    # small enough that the shared chunks are over it
+    monkeypatch.setattr(HashIndex, "max_bucket", 16)
+    monkeypatch.setattr(HashIndex, "block_size", 1000)
+
+    hashes = skewed_hashes(600)
+    index = HashIndex()
+    for key, h in hashes.items():
+        index.add(key, h)
+
+    groups = sorted(sorted(g) for g in index.groups(4))
+    assert groups == brute_force_groups(hashes, 4)
+    assert len(groups) > 0
+
+
+def test_groups_agree_with_query(monkeypatch):
+    monkeypatch.setattr(HashIndex, "max_bucket", 16)
+    hashes = skewed_hashes(300, seed=2)
+    index = HashIndex()
+    for key, h in hashes.items():
+        index.add(key, h)
+
+    grouped = {key for g in index.groups(4) for key in g}
+    queried = {key for key, h in hashes.items() if len(index.query(h, 4)) > 1}
+    assert grouped == queried
+
+
+def test_parse_cache_is_stored_with_the_index(tmp_path, monkeypatch):
+    index = LibraryHashIndex(str(tmp_path / "index.db"))
+    cache = ParseCache(max_size=3)
+    cache.put_many([("a.cbz", ("1", "A", "", "", "", "")), ("b.cbz", ("2", "B", "", "", "", ""))])
+    index.save_parse_cache(cache)
+
+    loaded = ParseCache(max_size=3)
+    assert index.load_parse_cache(loaded) == 2
+    assert loaded.items() == cache.items()
+
+    # only as many as the cache holds are kept, the most recently used ones
+    cache.get("a.cbz")
+    cache.put_many([("c.cbz", ("3", "C", "", "", "", "")), ("d.cbz", ("4", "D", "", "", "", ""))])
+    index.save_parse_cache(cache)
+    loaded = ParseCache(max_size=3)
+    index.load_parse_cache(loaded)
+    assert [name for name, result in loaded.items()] == ["a.cbz", "c.cbz", "d.cbz"]
+
+    # results from another version of the parser aren't loaded
+    monkeypatch.setattr(ParseCache, "version", ParseCache.version + 1)
+    assert index.load_parse_cache(ParseCache()) == 0
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from comictaggerlib.imagefetcher import ImageFetcher, ImageFetcherException
+
+
+@pytest.fixture
+def fetcher(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("APPDATA", str(tmp_path))
+    (tmp_path / ".ComicTagger").mkdir()
+    (tmp_path / "ComicTagger").mkdir()
+    monkeypatch.setattr(ImageFetcher, "db_con", None)
+    fetcher = ImageFetcher()
+    yield fetcher
+    ImageFetcher.db_con.close()
+
+
+def test_downloads_start_before_cached_images(fetcher, monkeypatch):
+    fetcher.add_image_to_cache("http://cached/1", b"one")
+    fetcher.add_image_to_cache("http://cached/2", b"two")
+
+    started = threading.Event()
+
+    def download(url):
+        started.set()
+        return url.encode()
+
+    monkeypatch.setattr(fetcher, "download", download)
+
+    results = fetcher.fetch_many(["http://cached/1", "http://new/1", "http://cached/2"])
+    assert next(results) == ("http://cached/1", b"one")
+    # running while the caller is still busy with the cached images
+    assert started.wait(5)
+    assert dict(results) == {"http://cached/2": b"two", "http://new/1": b"http://new/1"}
+
+
+def test_failed_download_cancels_the_rest(fetcher, monkeypatch):
+    monkeypatch.setattr(ImageFetcher, "max_workers", 1)
+    release = threading.Event()
+    downloaded = []
+
+    def download(url):
+        downloaded.append(url)
+        if url == "http://new/0":
+            raise ImageFetcherException("Network Error!")
+        release.wait(5)
+        return b""
+
+    monkeypatch.setattr(fetcher, "download", download)
+
+    with pytest.raises(ImageFetcherException):
+        for url, image_data in fetcher.fetch_many(["http://new/{0}".format(i) for i in range(5)]):
+            pass
+    release.set()
+    # the worker may have taken the next one before they were cancelled
+    assert downloaded[0] == "http://new/0"
+    assert len(downloaded) <= 2
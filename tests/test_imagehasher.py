@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+from comictaggerlib.imagehasher import ImageHasher, pil_available
+
+pytestmark = pytest.mark.skipif(not pil_available, reason="PIL isn't installed")
+
+
+def page_data(image_format):
+    from PIL import Image
+
+    image = Image.linear_gradient("L").resize((1600, 2400)).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, image_format)
+    return out.getvalue()
+
+
+def test_jpeg_draft_decodes_less(monkeypatch):
+    hasher = ImageHasher(data=page_data("JPEG"))
+    hasher.shrink(8, 8)
+    # decoded at 1/8 scale, in grayscale
+    assert hasher.image.size == (200, 300)
+    assert hasher.image.mode == "L"
+
+    monkeypatch.setattr(ImageHasher, "use_draft", False)
+    hasher = ImageHasher(data=page_data("JPEG"))
+    hasher.shrink(8, 8)
+    assert hasher.image.size == (1600, 2400)
+
+
+def test_draft_keeps_the_hash_close(monkeypatch):
+    data = page_data("JPEG")
+    draft_hash = ImageHasher(data=data).average_hash()
+    monkeypatch.setattr(ImageHasher, "use_draft", False)
+    full_hash = ImageHasher(data=data).average_hash()
+    assert ImageHasher.hamming_distance(draft_hash, full_hash) <= 4
+
+
+def test_other_formats_decode_in_full():
+    hasher = ImageHasher(data=page_data("PNG"))
+    hasher.shrink(8, 8)
+    assert hasher.image.size == (1600, 2400)
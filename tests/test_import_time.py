@@ -0,0 +1,71 @@
+import os
+import pathlib
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+# loaded only by the GUI, online searches, HTML parsing and RAR archives
+heavy_modules = ["PyQt5", "bs4", "requests", "rarfile"]
+
+# cumulative import time of comictaggerlib.main, in microseconds.  It's
+# about 50ms on a recent machine, and several times that with Qt or requests
+import_budget = 400000
+
+repo_root = pathlib.Path(__file__).parent.parent
+
+
+@pytest.fixture
+def env(tmp_path):
+    # an empty PyQt5 shadows the real one, if any, so that importing it shows
+    # up even where Qt isn't installed
+    fake_qt = tmp_path / "fake_qt"
+    (fake_qt / "PyQt5").mkdir(parents=True)
+    (fake_qt / "PyQt5" / "__init__.py").write_text("")
+    (tmp_path / ".ComicTagger").mkdir()
+
+    path = os.pathsep.join([str(fake_qt), str(repo_root), os.environ.get("PYTHONPATH", "")])
+    return dict(os.environ, HOME=str(tmp_path), PYTHONPATH=path)
+
+
+def test_print_imports_are_light(tmp_path, env):
+    path = tmp_path / "test.cbz"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("001.jpg", b"not really a jpeg")
+        zf.writestr("ComicInfo.xml", "<ComicInfo><Series>S</Series><Number>1</Number></ComicInfo>")
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "comictaggerlib", "-p", str(path)], env=env, cwd=str(tmp_path), capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert "ComicRack tags" in result.stdout
+
+    # lines look like "import time:   self [us] | cumulative | package"
+    cumulative = dict()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "[us]" not in line:
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            cumulative[name.strip()] = int(cumulative_us)
+
+    imported = {name.partition(".")[0] for name in cumulative}
+    assert imported.isdisjoint(heavy_modules), sorted(imported.intersection(heavy_modules))
+    assert cumulative["comictaggerlib.main"] < import_budget
+
+
+def test_online_modules_leave_qt_alone(tmp_path, env):
+    # what an online search or auto-tag from the command line loads and uses
+    code = (
+        "import sys\n"
+        "from comictaggerlib import cli\n"
+        "from comictaggerlib.settings import ComicTaggerSettings\n"
+        "from comictaggerlib.issueidentifier import IssueIdentifier\n"
+        "from comictaggerlib.comicvinetalker import ComicVineTalker\n"
+        "from comictaggerlib.imagefetcher import ImageFetcher\n"
+        "cli.online_setup(ComicTaggerSettings())\n"
+        "ComicVineTalker(), ImageFetcher()\n"
+        "print(sorted(name for name in sys.modules if name.partition('.')[0] == 'PyQt5'))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=env, cwd=str(tmp_path), capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,130 @@
+import json
+import os
+import pathlib
+import signal
+import socket
+import stat
+import subprocess
+import sys
+import time
+import zipfile
+
+import pytest
+
+repo_root = pathlib.Path(__file__).parent.parent
+
+
+@pytest.fixture
+def env(tmp_path):
+    (tmp_path / ".ComicTagger").mkdir()
+    return dict(os.environ, HOME=str(tmp_path), PYTHONPATH=os.pathsep.join([str(repo_root), os.environ.get("PYTHONPATH", "")]))
+
+
+@pytest.fixture
+def comic(tmp_path):
+    path = tmp_path / "test.cbz"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("001.jpg", b"not really a jpeg")
+        zf.writestr("ComicInfo.xml", "<ComicInfo><Series>Original</Series><Number>1</Number></ComicInfo>")
+    return str(path)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def ctagger(env, *args, **kwargs):
+    return subprocess.run([sys.executable, "-m", "comictaggerlib"] + list(args), env=env, capture_output=True, text=True, timeout=60, **kwargs)
+
+
+class Server:
+    def __init__(self, env, address):
+        self.env = env
+        self.address = address
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "comictaggerlib", "--serve", "--socket", address], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        # it prints once it's listening
+        line = self.proc.stdout.readline()
+        if not line.startswith("Serving on"):
+            self.proc.wait(10)
+            raise RuntimeError("server didn't start: " + line + self.proc.stderr.read())
+
+    def run(self, *args):
+        return ctagger(self.env, "--use-server", "--socket", self.address, *args)
+
+    def stop(self):
+        self.proc.send_signal(signal.SIGTERM)
+        self.proc.wait(10)
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+
+
+@pytest.fixture
+def unix_server(env, tmp_path):
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("no unix sockets")
+    server = Server(env, str(tmp_path / "server.sock"))
+    yield server
+    server.stop()
+    assert not os.path.exists(server.address)
+
+
+@pytest.fixture
+def tcp_server(env):
+    server = Server(env, "127.0.0.1:{0}".format(free_port()))
+    yield server
+    server.stop()
+
+
+def test_unix_socket_is_private(unix_server):
+    assert stat.S_IMODE(os.stat(unix_server.address).st_mode) & 0o077 == 0
+
+
+def test_commands_leave_pooled_metadata_alone(unix_server, comic):
+    result = unix_server.run("-p", "-t", "cr", comic)
+    assert result.returncode == 0, result.stderr
+    assert "Original" in result.stdout
+
+    # changes the metadata, but writes nothing
+    result = unix_server.run("-s", "-n", "-t", "cr", "-m", "series=Changed", comic)
+    assert result.returncode == 0, result.stderr
+    assert "Changed" in result.stdout
+
+    result = unix_server.run("-p", "-t", "cr", comic)
+    assert "Original" in result.stdout
+    assert "Changed" not in result.stdout
+
+
+def test_tcp_needs_token(tcp_server, tmp_path, comic):
+    port = int(tcp_server.address.rpartition(":")[2])
+    token_path = tmp_path / ".ComicTagger" / "server-{0}.token".format(port)
+    assert stat.S_IMODE(os.stat(token_path).st_mode) == 0o600
+
+    # the client reads the token from the file
+    result = tcp_server.run("-p", "-t", "cr", comic)
+    assert result.returncode == 0, result.stderr
+    assert "Original" in result.stdout
+
+    for token in [None, "wrong", token_path.read_text() + "x"]:
+        request = {"args": ["-p", "-t", "cr", comic], "cwd": str(tmp_path), "token": token}
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                response = json.loads(f.readline().decode("utf-8"))
+        assert response["code"] == 2
+        assert response["stdout"] == ""
+
+    tcp_server.stop()
+    assert not token_path.exists()
+
+
+def test_tcp_only_on_loopback(env, tmp_path):
+    port = free_port()
+    start = time.time()
+    result = ctagger(env, "--serve", "--socket", "0.0.0.0:{0}".format(port))
+    assert time.time() - start < 30
+    assert "only listens on loopback" in result.stderr
+    assert not (tmp_path / ".ComicTagger" / "server-{0}.token".format(port)).exists()
@@ -0,0 +1,67 @@
+import sys
+import zipfile
+
+import pytest
+
+from comicapi import comicarchive
+from comicapi.comicarchive import ZipArchiver
+
+page_data = bytes(range(256)) * 400
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    path = tmp_path / "test.cbz"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("001.jpg", page_data, compress_type=zipfile.ZIP_STORED)
+        zf.writestr("002.jpg", page_data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+        zf.writestr("ComicInfo.xml", "<ComicInfo/>", compress_type=zipfile.ZIP_DEFLATED)
+        zf.comment = b"a comment"
+    return str(path)
+
+
+def test_raw_copy_supported_here():
+    # if this fails, zipfile's internals have changed: check copyRawFile()
+    # against the new version before adding it to raw_copy_supported
+    if (3, 6) <= sys.version_info[:2] <= (3, 13):
+        assert comicarchive.raw_copy_supported
+
+
+@pytest.mark.parametrize("raw_copy", [True, False])
+def test_rebuild_keeps_untouched_files(zip_path, monkeypatch, raw_copy):
+    if raw_copy and not comicarchive.raw_copy_supported:
+        pytest.skip("raw copies aren't supported on this Python")
+    monkeypatch.setattr(comicarchive, "raw_copy_supported", raw_copy)
+
+    with zipfile.ZipFile(zip_path) as zf:
+        before = {info.filename: info for info in zf.infolist()}
+
+    assert ZipArchiver(zip_path).writeArchiveFile("ComicInfo.xml", "<ComicInfo><Series>S</Series></ComicInfo>")
+
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        assert zf.comment == b"a comment"
+        assert zf.read("001.jpg") == page_data
+        assert zf.read("002.jpg") == page_data
+        assert zf.read("ComicInfo.xml") == b"<ComicInfo><Series>S</Series></ComicInfo>"
+        for name in ["001.jpg", "002.jpg"]:
+            info = zf.getinfo(name)
+            assert info.compress_type == before[name].compress_type
+            assert info.CRC == before[name].CRC
+
+        if raw_copy:
+            # copied as is, not recompressed at the default level
+            assert zf.getinfo("002.jpg").compress_size == before["002.jpg"].compress_size
+
+
+def test_remove_in_transaction(zip_path):
+    archiver = ZipArchiver(zip_path)
+    archiver.beginTransaction()
+    archiver.removeArchiveFile("001.jpg")
+    archiver.writeArchiveFile("003.jpg", page_data)
+    assert sorted(archiver.getArchiveFilenameList()) == ["002.jpg", "003.jpg", "ComicInfo.xml"]
+    assert archiver.commitTransaction()
+
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == ["002.jpg", "003.jpg", "ComicInfo.xml"]